@@ -3,7 +3,9 @@
 __docformat__ = "restructuredtext"
 
 import networkx as nx
-from mrv.dge import Graph, ComputeError
+from mrv.dge import Graph, ComputeError, Attribute
+import itertools
+import inspect
 import time
 import weakref
 import traceback
@@ -55,7 +57,7 @@ class DirtyException( Exception ):
 class Workflow( Graph ):
 	"""Implements a workflow as connected processes
 	
-	:note: if you have to access the processes directly, use the DiGraph methods"""
+	:note: if you have to access the processes directly, use the `Graph` node methods"""
 
 	#{ Utility Classes
 	class ProcessData( object ):
@@ -108,10 +110,12 @@ class Workflow( Graph ):
 		"""Simple wrapper storing a call graph, keeping the root at which the call started
 		
 		:note: this class is specialized to be used by workflows, its not general for that purpose"""
-		def __init__( self ):
+		def __init__( self, profiler = None ):
+			""":param profiler: if not None, a `dge.Profiler` to be informed about each call"""
 			super( Workflow.CallGraph, self ).__init__( name="Callgraph" )
 			self._call_stack = []
 			self._root = None
+			self._profiler = profiler
 
 		def startCall( self, pdata ):
 			"""Add a call of a process"""
@@ -126,6 +130,8 @@ class Workflow( Graph ):
 				self._root = pdata
 
 			self._call_stack.append( pdata )
+			if self._profiler is not None:
+				self._profiler.startCall( pdata )
 
 		def endCall( self, result ):
 			"""End the call start started previously
@@ -134,6 +140,8 @@ class Workflow( Graph ):
 			lastprocessdata = self._call_stack.pop( )
 			lastprocessdata.endtime = time.clock( )
 			lastprocessdata.setResult( result )
+			if self._profiler is not None:
+				self._profiler.endCall( lastprocessdata )
 
 		def callRoot( self ):
 			""":return: root at which the call started"""
@@ -192,6 +200,8 @@ class Workflow( Graph ):
 
 		self._callgraph = None
 		self._mode = False
+		self._routes = dict()		# target key -> tuple( rate, shell, ambiguous picks ), see `targetRating`
+		self._routable = None		# True if targets can be routed by type, None if unknown
 
 
 	def __str__( self ):
@@ -216,14 +226,16 @@ class Workflow( Graph ):
 		shell, result = self._evaluate( target, processmode, globalmode )
 		return result
 
-	def makeTargets( self, targetList, errstream=None, donestream=None ):
+	def makeTargets( self, targetList, errstream=None, donestream=None, batch=False, workers=0 ):
 		"""batch module compatible method allowing to make mutliple targets at once
 		
 		:param targetList: iterable providing the targets to make
 		:param errstream: object with file interface allowing to log errors that occurred
 			during operation
 		:param donestream: if list, targets successfully done will be appended to it, if
-			it is a stream, the string representation will be wrtten to it"""
+			it is a stream, the string representation will be wrtten to it
+		:param batch: see `iterTargets`
+		:param workers: see `iterTargets`"""
 		def to_stream(msg, stream):
 			"""print msg to stream or use the logger instead"""
 			if stream:
@@ -233,16 +245,16 @@ class Workflow( Graph ):
 			# END errstream handling
 		# END utility
 			
-		for target in targetList:
-			try:
-				self.makeTarget( target )
-			except ComputeError,e:
-				to_stream(str( e ) + "\n", errstream)
-			except Exception, e:
-				# except all
-				msg = "--> UNHANDLED EXCEPTION: " + str( e ) + "\n"
-				msg += traceback.format_exc( )
-				to_stream(msg, errstream)
+		for target, result, error in self.iterTargets( targetList, batch, workers ):
+			if error is not None:
+				e, tb = error
+				if isinstance( e, ComputeError ):
+					to_stream(str( e ) + "\n", errstream)
+				else:
+					msg = "--> UNHANDLED EXCEPTION: " + str( e ) + "\n"
+					msg += tb
+					to_stream(msg, errstream)
+			# END error handling
 			if donestream is None:
 				continue
 
@@ -256,6 +268,84 @@ class Workflow( Graph ):
 
 
 
+	def iterTargets( self, targetList, batch=False, workers=0 ):
+		"""Make all targets in targetList, streaming the results as they become available
+		
+		:return: generator yielding tuple( target, result, error ) for each target in the
+			order of targetList. error is None if the target was made, or tuple( exception, traceback string )
+			otherwise, in which case the result is None
+		:param batch: if True, the input and output shells are resolved only once per target type
+			and reused for all targets of that type. If plug attributes or processes judge values 
+			beyond their type, the shells are resolved per target anyway
+		:param workers: if larger than 1, the targets are made by the given amount of threads,
+			each using its own duplicate of this workflow ( see `iDuplicatable.duplicate` ).
+			Processes must not share state that they alter during evaluation for this to work
+		:note: on error, the workflow's callgraph of the failed target stays available for
+			inspection only if workers is smaller than 2"""
+		import process
+		pb = process.ProcessBase
+		processmode = globalmode = pb.is_state | pb.target_state
+
+		def maker( workflow ):
+			"""Make targets on the given workflow, which can serve one target at a time"""
+			shellmap = None
+			if batch and workflow._ratesByType( ):
+				shellmap = dict()		# target key -> tuple( inputshell, outputshell )
+
+			def make( target ):
+				try:
+					shells = None
+					if shellmap is not None:
+						key = workflow._targetKey( target )
+						try:
+							shells = shellmap[ key ]
+						except KeyError:
+							shells = shellmap[ key ] = workflow._resolveShells( target )
+					# END get shells
+					shell, result = workflow._evaluate( target, processmode, globalmode, shells )
+					return ( target, result, None )
+				except Exception, e:
+					return ( target, None, ( e, traceback.format_exc( ) ) )
+			# END make
+			return make
+		# END maker
+
+		if workers < 2:
+			return itertools.imap( maker( self ), targetList )
+
+		return self._iterTargetsParallel( targetList, maker, workers )
+
+	def _iterTargetsParallel( self, targetList, maker, workers ):
+		""":return: generator streaming the results of targets made by workers duplicates
+		of this workflow in order, see `iterTargets`"""
+		from multiprocessing.pool import ThreadPool
+		import Queue
+
+		# each duplicate serves one target at a time
+		makers = Queue.Queue( )
+		for i in range( workers ):
+			wfl = self.duplicate( )
+			wfl.profiler = self.profiler
+			makers.put( maker( wfl ) )
+		# END for each worker
+
+		def make( target ):
+			wflmake = makers.get( )
+			try:
+				return wflmake( target )
+			finally:
+				makers.put( wflmake )
+		# END make
+
+		pool = ThreadPool( workers )
+		try:
+			for item in pool.imap( make, targetList ):
+				yield item
+		finally:
+			pool.terminate( )
+			pool.join( )
+		# END assure pool is shut down
+
 	def _evaluateDirtyState( self, outputplug, processmode ):
 		"""Evaluate the given plug in process mode and return a dirty report tuple
 		as used by `makeDirtyReport`"""
@@ -328,21 +418,22 @@ class Workflow( Graph ):
 		for a new instance
 		
 		:param global_evaluation_mode: evaluation mode to be used"""
-		self._callgraph = Workflow.CallGraph( )
+		self._callgraph = Workflow.CallGraph( profiler = self.profiler )
 		self._mode = global_evaluation_mode
 
 
-	def _setupProcess( self, target, globalmode ):
+	def _setupProcess( self, target, globalmode, shells = None ):
 		"""Setup the workflow's dg such that the returned output shell can be queried
 		to evaluate target
 		
 		:param globalmode: mode with which all other processes will be handling
 			their input calls
+		:param shells: if not None, tuple( inputshell, outputshell ) as returned by
+			`_resolveShells` for a target of the same type
 		"""
-		# find suitable process
-		inputshell = self.targetRating( target )[1]
-		if inputshell is None:
-			raise TargetError( "Cannot handle target %r" % target )
+		if shells is None:
+			shells = self._resolveShells( target )
+		inputshell, outputshell = shells
 
 		# clear previous callgraph
 		self._clearState( globalmode )
@@ -352,6 +443,35 @@ class Workflow( Graph ):
 			node.prepareProcess( )
 		# END reset dg handling
 
+		# we do not care about ambiguity, simply pull one
+		# QUESTION: should we warn about multiple affected plugs ?
+		inputshell.set( target, ignore_connection = True )
+		return outputshell
+
+	def _ratesByType( self ):
+		""":return: True if the attributes of all our plugs rate values by their type only,
+			and no process judges targets itself by overriding targetRating, thus shells 
+			found for a target can be used for all targets of the same type"""
+		import process
+		baserating = process.ProcessBase.targetRating.im_func
+		for node in self.iterNodes( ):
+			if getattr( type( node ).targetRating, 'im_func', None ) is not baserating:
+				return False
+			for plug in node.plugs( ):
+				if type( plug.attr ).compatabilityRate.im_func is not Attribute.compatabilityRate.im_func:
+					return False
+			# END for each plug
+		# END for each node
+		return True
+
+	def _resolveShells( self, target ):
+		""":return: tuple( inputshell, outputshell ) - the input shell will receive the target,
+			the output shell can be queried to make it
+		:raise TargetError: if no suitable shells could be found"""
+		# find suitable process
+		inputshell = self.targetRating( target )[1]
+		if inputshell is None:
+			raise TargetError( "Cannot handle target %r" % target )
 
 		# OUTPUT SHELL HANDLING
 		#########################
@@ -406,19 +526,17 @@ class Workflow( Graph ):
 		if not outputshell:
 			raise TypeError( "Target %s cannot be handled by this workflow (%s) as a computable output for %s cannot be found" % ( target, self, str( inputshell ) ) )
 
-		# we do not care about ambiguity, simply pull one
-		# QUESTION: should we warn about multiple affected plugs ?
-		inputshell.set( target, ignore_connection = True )
-		return outputshell
+		return ( inputshell, outputshell )
 
 
-	def _evaluate( self, target, processmode, globalmode ):
+	def _evaluate( self, target, processmode, globalmode, shells = None ):
 		"""Make or update the target using a process in our workflow
 		
 		:param processmode: the mode with which to call the initial process
+		:param shells: see `_setupProcess`
 		:return: tuple( shell, result ) - plugshell queried to get the result
 		"""
-		outputshell = self._setupProcess( target, globalmode )
+		outputshell = self._setupProcess( target, globalmode, shells )
 		######################################################
 		result = outputshell.get( processmode )
 		######################################################
@@ -468,13 +586,66 @@ class Workflow( Graph ):
 			
 			Walk the dependency graph such that leaf nodes have higher ratings than
 			non-leaf nodes
-		:note: you can use the `process.ProcessBase` enumeration for comparison"""
+		:note: you can use the `process.ProcessBase` enumeration for comparison
+		:note: as long as all plug attributes and processes rate targets by their type, the result is
+			kept per target type until nodes or connections change, see `clearTargetRoutes`"""
+		if self._routable is None:
+			self._routable = self._ratesByType( )
+
+		if not self._routable:
+			rate, shell, ambiguous = self._routeTarget( target )
+		else:
+			key = self._targetKey( target )
+			try:
+				rate, shell, ambiguous = self._routes[ key ]
+			except KeyError:
+				rate, shell, ambiguous = self._routes[ key ] = self._routeTarget( target )
+		# END get route
+
+		if ambiguous:
+			raise AssertionError( "There should only be one suitable process for %r, found %i (%s)" % ( target, len( ambiguous ), ambiguous ) )
+		return ( rate, shell )
+
+	def clearTargetRoutes( self ):
+		"""Forget the processes found for target types by `targetRating`. This happens
+		automatically if nodes or connections change, but needs to be done if plugs or
+		attributes of our processes are changed"""
+		self._routes.clear()
+		self._routable = None
+
+	def _topologyChanged( self ):
+		super( Workflow, self )._topologyChanged( )
+		self.clearTargetRoutes( )
+
+	def _targetKey( self, target ):
+		""":return: key identifying all targets rated equally if all attributes rate by type"""
+		if isinstance( target, type ):
+			return ( True, target )		# classes are rated by themselves
+		return ( False, target.__class__ )
+
+	def _rateKwargs( self, node, ratecache ):
+		""":return: keyword arguments to pass to the targetRating method of the given node,
+			which includes the ratecache if the method accepts it - overrides
+			might not do so"""
+		try:
+			args, varargs, varkw, defaults = inspect.getargspec( node.targetRating )
+		except TypeError:
+			return dict()		# not a python function
+		# END handle non-functions
+		if varkw is None and 'rate_cache' not in args:
+			return dict()
+		return dict( rate_cache = ratecache )
+
+	def _routeTarget( self, target ):
+		""":return: tuple( rate, shell, ambiguous picks ) - the picks are a list of all tuple( rate, shell )
+			with the best rating if there is more than one, and empty otherwise"""
 		rescache = list()
 		best_process = None
+		ratecache = dict()		# nodes of the same type share their attributes - rate them once
 
 		for node in self.iterNodes( ):
 			try:
-				rate, shell = node.targetRating( target )
+				rate, shell = node.targetRating( target, **self._rateKwargs( node, ratecache ) )
 			except TypeError,e:
 				# could be that there is a node having ambigous plugs, but we are not
 				# going to take it anyway
@@ -493,19 +664,20 @@ class Workflow( Graph ):
 
 		rescache.sort()							# last is most suitable
 		if not rescache or rescache[-1][0] == 0:
-			return ( 0, None )
+			return ( 0, None, list() )
 
 		bestpick = rescache[-1]
 
-		# check if we have several best picks - raise if so
+		# check if we have several best picks - the caller raises if so
 		allbestpicks = [ pick for pick in rescache if pick[0] == bestpick[0] ]
 		if len( allbestpicks ) > 1:
-			raise AssertionError( "There should only be one suitable process for %r, found %i (%s)" % ( target, len( allbestpicks ), allbestpicks ) )
+			return ( 0, None, allbestpicks )
 
 
 		shell = bestpick[1]
 		# recompute rate as we might have changed it
-		return shell.node.targetRating( target )
+		rate, shell = shell.node.targetRating( target, **self._rateKwargs( shell.node, ratecache ) )
+		return ( rate, shell, list() )
 
 	def callgraph( self ):
 		""":return: current callgraph instance
@@ -6,50 +6,194 @@ from the commandline, possibly wrapped by a shell script to specialize its usae
 """
 import sys,os
 import signal
+import select
+import errno
+import fcntl
 from collections import deque
+from itertools import chain
 import subprocess
+import traceback
+from ast import literal_eval
 import time
 
 # module is supposed to be used as standalone program - we prevent from x import *
 __all__ = None
 
-def superviseJobs( jobs, returnIfLessThan, cmdinput, errorstream, donestream ):
-	"""Check on the jobs we have and wait for finished ones. Write information
-	about them into the respective streams
-	:param returnIfLessThan: return once we have less than the given amount of running jobs"""
-	sleeptime = 1.0		 # wait one second in the main loop before checking the processes
+def _setNonBlocking( fd ):
+	fcntl.fcntl( fd, fcntl.F_SETFL, fcntl.fcntl( fd, fcntl.F_GETFL ) | os.O_NONBLOCK )
 
-	if not jobs:
+def _readStderr( process, errorstream ):
+	"""Read all currently available data from the stderr pipe of the given process and
+	write it to the errorstream if it is not None. The pipe will be closed once it is depleted
+	:return: False if the pipe is depleted"""
+	fd = process.stderr.fileno()
+	while True:
+		try:
+			data = os.read( fd, 65536 )
+		except OSError, e:
+			if e.errno in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+				return True
+			if e.errno == errno.EINTR:
+				continue
+			raise
+		# END handle exceptions
+
+		if not data:
+			process.stderr.close()
+			return False
+
+		if errorstream:
+			errorstream.write( data )
+			errorstream.flush()
+	# END read loop
+
+def _installChildHandler( ):
+	"""Install a handler for SIGCHLD which writes to a pipe whenever a child process exits
+	:return: tuple( read fd of the pipe, write fd of the pipe, handler to restore ) or None if signals cannot be
+		handled, i.e. on systems without SIGCHLD or if we are not in the main thread"""
+	if not hasattr( signal, "SIGCHLD" ):
+		return None
+
+	rfd, wfd = os.pipe()
+	for fd in ( rfd, wfd ):
+		_setNonBlocking( fd )
+
+	def onChildExit( signum, frame ):
+		try:
+			os.write( wfd, "x" )
+		except OSError:
+			pass		# pipe is full, which is fine as we are woken up anyway
+	# END handler
+
+	try:
+		prevhandler = signal.signal( signal.SIGCHLD, onChildExit )
+	except ValueError:
+		os.close( rfd )
+		os.close( wfd )
+		return None
+	# END handle non-main threads
+
+	# system calls should not be interrupted by our handler, select will be interrupted anyway
+	signal.siginterrupt( signal.SIGCHLD, False )
+	return rfd, wfd, prevhandler
+
+def _uninstallChildHandler( handlerinfo ):
+	"""Restore the signal handler replaced by `_installChildHandler`
+	:note: the previous interrupt flag of SIGCHLD cannot be queried, hence system calls 
+		will be interrupted by it again, which is python's default for all handlers"""
+	if handlerinfo is None:
 		return
 
+	rfd, wfd, prevhandler = handlerinfo
+	signal.signal( signal.SIGCHLD, prevhandler )
+	signal.siginterrupt( signal.SIGCHLD, True )
+	os.close( rfd )
+	os.close( wfd )
+
+def _waitForEvents( jobs, errorstream, wakeupfd ):
+	"""Block until a child may have exited, writing stderr data of all jobs to the
+	errorstream meanwhile
+	:param wakeupfd: file descriptor which becomes readable once a child exited, or None
+		in which case the jobs will be polled frequently"""
+	fds = dict( ( p.stderr.fileno(), p ) for p in jobs if not p.stderr.closed )
+	timeout = 0.05
+	if wakeupfd is not None:
+		fds[ wakeupfd ] = None
+		timeout = None
+	# END setup wakeup
+
+	try:
+		readable = select.select( fds.keys(), [], [], timeout )[0]
+	except select.error, e:
+		if e.args[0] != errno.EINTR:
+			raise
+		return		# a signal arrived, possibly SIGCHLD
+	# END handle interrupts
+
+	for fd in readable:
+		process = fds[ fd ]
+		if process is None:
+			try:
+				while os.read( wakeupfd, 4096 ):
+					pass
+			except OSError:
+				pass		# depleted
+		else:
+			_readStderr( process, errorstream )
+		# END handle fd type
+	# END for each readable fd
+
+def _pollJob( process ):
+	"""As Popen.poll, but stores the resource usage of the process in its 'batchrusage'
+	attribute if it finished and the system supports it"""
+	if process.returncode is not None or not hasattr( os, "wait4" ):
+		return process.poll()
+
+	try:
+		pid, status, rusage = os.wait4( process.pid, os.WNOHANG )
+	except OSError, e:
+		if e.errno != errno.ECHILD:
+			raise
+		return process.poll()		# reaped by someone else
+	# END handle exceptions
+
+	if pid == 0:
+		return None
+
+	process.batchrusage = rusage
+	if os.WIFSIGNALED( status ):
+		process.returncode = -os.WTERMSIG( status )
+	else:
+		process.returncode = os.WEXITSTATUS( status )
+	return process.returncode
+
+def superviseJobs( jobs, returnIfLessThan, cmdinput, errorstream, donestream, wakeupfd = None ):
+	"""Check on the jobs we have and wait for finished ones. Write information
+	about them into the respective streams. The stderr output of the jobs is written
+	to the errorstream as it arrives.
+	:param returnIfLessThan: return once we have less than the given amount of running jobs
+	:param cmdinput: inputs of jobs which do not provide their own ones in a 'batchinput' attribute
+	:param wakeupfd: file descriptor becoming readable once a child process exits, see
+		`_installChildHandler`. If None, the jobs will be polled
+	:return: list of finished processes. Processes with a 'batchstart' time attribute
+		get their wall time assigned to their 'batchtime' attribute"""
+	finished = list()
+	if not jobs:
+		return finished
+
 	while True:
 
 		jobscp = jobs[:]			# are going to alter the jobs queue
 		for process in jobscp:
 			# check if subprocess is done
-			if process.poll() == None:
+			if _pollJob( process ) == None:
 				continue
 
 			# pop the process off the queue
 			jobs.remove( process )
+			finished.append( process )
+			if hasattr( process, 'batchstart' ):
+				process.batchtime = time.time() - process.batchstart
 
-			# the process finished - get the stderr
-			if errorstream:
-				errorstream.writelines( process.stderr.readlines() )
-				errorstream.flush()
+			# the process finished - get the rest of its stderr
+			while not process.stderr.closed and _readStderr( process, errorstream ):
+				# it was inherited by a process which is still running
+				if not select.select( [ process.stderr ], [], [], 0.05 )[0]:
+					process.stderr.close()
+			# END drain stderr
 
 			# append to the done list only if there is no error
 			if donestream is not None and process.returncode == 0:
-				donestream.writelines( "\n".join( cmdinput ) + "\n" )
+				donestream.writelines( "\n".join( getattr( process, 'batchinput', cmdinput ) ) + "\n" )
 				donestream.flush()
 
 			# can we return ?
 			if len( jobs ) < returnIfLessThan:
-				return
+				return finished
 
 		# END for each job
 
-		time.sleep( sleeptime )
+		_waitForEvents( jobs, errorstream, wakeupfd )
 	# END endless loop
 
 def killProcess( process ):
@@ -62,76 +206,566 @@ def killProcess( process ):
 
 
 
+def _startJob( cmd, args, cmdinput, preexec_fn = None ):
+	""":return: started process for the given inputs
+	:param preexec_fn: called in the child process before cmd is executed"""
+	callcmd = (cmd,)+tuple(args)+tuple(cmdinput)
+	process = subprocess.Popen( callcmd,stderr=subprocess.PIPE, stdin=subprocess.PIPE, env=os.environ,
+								preexec_fn = preexec_fn )
+	_setNonBlocking( process.stderr.fileno() )
+	process.batchinput = cmdinput
+	process.batchstart = time.time()
+
+	# fill our input argumets additionally to stdin
+	try:
+		process.stdin.writelines( '\n'.join( cmdinput ) )
+		process.stdin.flush()
+		process.stdin.close()
+	except IOError:
+		pass 	# could be closed already
+
+	return process
+
+
+class _Distributor( object ):
+	"""Hands out chunks of inputs to jobs, sizing them according to the time it took
+	to process previous inputs, and keeps track of the attempts of each input"""
+
+	def __init__( self, inputList, inputsPerProcess, numJobs, attempts, targetJobTime ):
+		self.inputs = iter( inputList )
+		self.numRemaining = None			# amount of inputs not yet handed out, if known
+		if hasattr( inputList, '__len__' ):
+			self.numRemaining = len( inputList )
+		self.inputsPerProcess = inputsPerProcess
+		self.numJobs = numJobs
+		self.attempts = attempts
+		self.targetJobTime = targetJobTime
+		self.retries = deque()				# inputs to be run on their own again
+		self.attempt = dict()				# input -> number of times it was run
+		self.totalTime = 0.0				# time spent processing inputs
+		self.numTimed = 0					# inputs processed in totalTime
+
+	def chunkSize( self ):
+		""":return: amount of inputs the next job should receive"""
+		size = self.inputsPerProcess
+		if self.targetJobTime and self.numTimed:
+			timePerInput = self.totalTime / self.numTimed
+			if timePerInput > 0:
+				size = max( 1, min( size, int( self.targetJobTime / timePerInput ) ) )
+		# END adjust to observed timings
+
+		# distribute the tail across all jobs
+		if self.numRemaining is not None:
+			size = max( 1, min( size, -( -self.numRemaining // self.numJobs ) ) )
+		return size
+
+	def nextChunk( self ):
+		""":return: list of inputs for the next job, empty if there is nothing left to do"""
+		if self.retries:
+			return [ self.retries.popleft() ]
+
+		chunk = list()
+		size = self.chunkSize()
+		for item in self.inputs:
+			chunk.append( item )
+			if len( chunk ) == size:
+				break
+		# END for each input
+		if self.numRemaining is not None:
+			self.numRemaining -= len( chunk )
+		return chunk
+
+	def finished( self, cmdinput, jobtime, success ):
+		"""Record the result of a job processing the given inputs
+		:return: list of tuples( input, attempts ) of inputs that are done, which are
+			either processed successfully or failed finally"""
+		self.totalTime += jobtime
+		self.numTimed += len( cmdinput )
+
+		done = list()
+		for item in cmdinput:
+			numattempts = self.attempt.pop( item, 0 ) + 1
+			if not success and numattempts < self.attempts:
+				self.attempt[ item ] = numattempts
+				self.retries.append( item )
+			else:
+				done.append( ( item, numattempts ) )
+		# END for each input
+		return done
+
+
+class _ResourceMonitor( object ):
+	"""Limits the amount of jobs by the memory they use and the load of the system, applies
+	resource limits to jobs and records the resources they used"""
+
+	def __init__( self, maxRSS = None, maxLoad = None, rlimits = None ):
+		self.maxRSS = maxRSS
+		self.maxLoad = maxLoad
+		self.rlimits = rlimits or dict()
+		self.jobs = list()				# dicts with information about each finished job
+		self.peakRSS = list()			# peak rss in bytes of finished jobs
+
+	@classmethod
+	def currentRSS( cls, pid ):
+		""":return: resident set size of the given process in bytes, or 0 if it is unknown"""
+		try:
+			fp = open( "/proc/%i/statm" % pid )
+			try:
+				return int( fp.read().split()[1] ) * os.sysconf( "SC_PAGE_SIZE" )
+			finally:
+				fp.close()
+		except ( IOError, OSError, ValueError, IndexError ):
+			return 0
+		# END handle systems without proc
+
+	def preexec( self ):
+		""":return: function applying our resource limits in a child process, or None"""
+		if not self.rlimits:
+			return None
+
+		import resource
+		rlimits = self.rlimits.items()
+		def applyLimits( ):
+			for rlimit, limits in rlimits:
+				resource.setrlimit( rlimit, limits )
+		# END utility
+		return applyLimits
+
+	def allowsJob( self, jobs ):
+		""":return: True if another job may be started while the given jobs are running"""
+		if not jobs:
+			return True
+
+		if self.maxLoad is not None and hasattr( os, "getloadavg" ):
+			if os.getloadavg()[0] >= self.maxLoad:
+				return False
+		# END check load
+
+		if self.maxRSS is not None:
+			estimate = 0
+			if self.peakRSS:
+				estimate = sum( self.peakRSS ) / len( self.peakRSS )
+			if sum( self.currentRSS( p.pid ) for p in jobs ) + estimate > self.maxRSS:
+				return False
+		# END check memory
+		return True
+
+	def jobFinished( self, process ):
+		"""Record the resources used by the given finished process"""
+		info = dict( inputs = list( process.batchinput ), exitcode = process.returncode,
+					walltime = process.batchtime, cputime = None, maxrss = None )
+		rusage = getattr( process, 'batchrusage', None )
+		if rusage is not None:
+			info[ 'cputime' ] = rusage.ru_utime + rusage.ru_stime
+			# kilobytes on linux, bytes on osx
+			maxrss = rusage.ru_maxrss
+			if sys.platform != 'darwin':
+				maxrss *= 1024
+			info[ 'maxrss' ] = maxrss
+			self.peakRSS.append( maxrss )
+		# END handle rusage
+		self.jobs.append( info )
+
+	def writeSummary( self, filepath ):
+		"""Write a json file with the recorded information about each job, as well as totals"""
+		import json
+		known = lambda key: [ j[ key ] for j in self.jobs if j[ key ] is not None ]
+		total = dict( jobs = len( self.jobs ), failed = len( [ j for j in self.jobs if j[ 'exitcode' ] != 0 ] ),
+					walltime = sum( known( 'walltime' ) ), cputime = sum( known( 'cputime' ) ),
+					maxrss = max( known( 'maxrss' ) or [ None ] ) )
+		fp = open( filepath, "w" )
+		try:
+			json.dump( dict( jobs = self.jobs, total = total ), fp, indent = 1 )
+		finally:
+			fp.close()
+		# END assure file is closed
+
+
 def process( cmd, args, inputList, errorstream = None, donestream = None, inputsPerProcess = 1,
-			 numJobs=1):
+			 numJobs=1, attempts=1, targetJobTime=None, reportstream=None, maxRSS=None,
+			 maxLoad=None, rlimits=None, summaryfile=None ):
 	"""Launch process at cmd with args and a list of input objects from inputList appended to args
 	:param cmd: full path to tool you wish to start, like /bin/bash
 	:param args: List of all argument strings to be passed to cmd
-	:param inputList: list of input files to be passed as input to cmd
-	:param errorstream: stream to which errors will be written to as they occour if not None
+	:param inputList: iterable of input files to be passed as input to cmd. It is consumed
+	as inputs are needed, hence it may be a stream
+	:param errorstream: stream to which errors will be written to as they occour if not None.
+	Each input that finally failed is reported with its exit code, attempts and time
 	:param donestream: stream to which items from input list will be passed once they
 	have been processed if not None. Items are newline terminated
 	:param inputsPerProcess: pass the given number of inputs to the cmd, or less if there
-	are not enough items on the input list
+	are not enough items on the input list. If targetJobTime is set, this is the maximum amount
 	:param numJobs: number of processes we may run in parallel
+	:param attempts: number of times each input may be processed before it is considered failed.
+	Inputs of failed jobs are run on their own when they are retried
+	:param targetJobTime: if not None, the amount of inputs per process will be adjusted such
+	that each process runs for about the given amount of seconds, based on the time previous
+	inputs took
+	:param reportstream: stream to which a line per input will be written if not None, with tab
+	separated fields status ( done|failed|aborted ), attempts, seconds and the input. The time of
+	an input is the time of its job divided by the amount of inputs in it
+	:param maxRSS: if not None, new jobs will only be started if the resident memory of all
+	running jobs plus the average peak memory of the finished ones stays below the given
+	amount of bytes
+	:param maxLoad: if not None, new jobs will only be started if the 1 minute load average
+	of the system is lower than the given value
+	:note: at least one job will always run, no matter what the limits say
+	:param rlimits: dict( resource.RLIMIT_* -> tuple( soft, hard ) ) of limits to apply to
+	each job using resource.setrlimit
+	:param summaryfile: if not None, a json file with the exit code, wall time, cpu time and
+	peak memory of each job will be written to the given path once all jobs are done
 	"""
-	# very simple for now - just get the input together and call the cmd
-	jobs = list()
-	numInputs = len( inputList )
-	for i in range( 0, numInputs, inputsPerProcess ):
-
-		cmdinput = inputList[ i : i + inputsPerProcess ]	# deals with bounds
-		callcmd = (cmd,)+tuple(args)+tuple(cmdinput)
-		process = subprocess.Popen( callcmd,stderr=subprocess.PIPE, stdin=subprocess.PIPE, env=os.environ )
-
-		jobs.append( process )
-
-		# fill our input argumets additionally to stdin
-		try:
-			process.stdin.writelines( '\n'.join( cmdinput ) )
-			process.stdin.flush()
-			process.stdin.close()
-		except IOError:
-			pass 	# could be closed already
-
-
-		# get another job ?
-		if len( jobs ) < numJobs:
-			continue
+	monitor = _ResourceMonitor( maxRSS, maxLoad, rlimits )
+	handlerinfo = _installChildHandler()
+	wakeupfd = None
+	if handlerinfo is not None:
+		wakeupfd = handlerinfo[0]
+	try:
+		distributor = _Distributor( inputList, inputsPerProcess, numJobs, attempts, targetJobTime )
+		_process( cmd, args, distributor, errorstream, donestream, reportstream, wakeupfd, monitor )
+	finally:
+		_uninstallChildHandler( handlerinfo )
+		if summaryfile is not None:
+			monitor.writeSummary( summaryfile )
+	# END assure signal handler is restored
+
+def _report( stream, status, attempts, seconds, cmdinput ):
+	if stream is None:
+		return
+	stream.writelines( "%s\t%i\t%f\t%s\n" % ( status, attempts, seconds, item ) for item in cmdinput )
+	stream.flush()
 
+def _process( cmd, args, distributor, errorstream, donestream, reportstream, wakeupfd, monitor ):
+	"""Implements `process`"""
+	numJobs = distributor.numJobs
+	preexec_fn = monitor.preexec()
+	jobs = list()
+	while True:
+		# fill all free slots
+		while len( jobs ) < numJobs and monitor.allowsJob( jobs ):
+			cmdinput = distributor.nextChunk()
+			if not cmdinput:
+				break
+			jobs.append( _startJob( cmd, args, cmdinput, preexec_fn ) )
+		# END for each free slot
 
-		if len( jobs ) != numJobs:
-			raise AssertionError( "invalid job count" )
+		if not jobs:
+			break
 
-		# we have a full queue now - get a new one asap
+		# get a new job asap
 		try:
-			superviseJobs( jobs, numJobs, cmdinput, errorstream, donestream )
+			finished = superviseJobs( jobs, len( jobs ), list(), errorstream, donestream, wakeupfd )
 		except KeyboardInterrupt:
 			# kill all processes - we do not know which one hangs
 			for process in jobs:
 				killProcess( process )
+			for process in jobs:
+				process.stderr.close()
+				process.wait()
+				_reportAborted( distributor, reportstream, process.batchinput )
+			# END for each killed process
 			jobs = list()
 			sys.stdout.write("Aborted all running processes - continuing\n")
-	# END for each chunk of inputs
+			continue
+		# END handle interrupts
+
+		for process in finished:
+			monitor.jobFinished( process )
+			_recordResult( distributor, process.batchinput, process.batchtime, process.returncode,
+							errorstream, reportstream )
+		# END for each finished process
+	# END scheduling loop
+
+def _reportAborted( distributor, reportstream, cmdinput ):
+	"""Forget the attempts of the given inputs of an aborted job, and report them"""
+	for item in cmdinput:
+		_report( reportstream, "aborted", distributor.attempt.pop( item, 0 ) + 1, 0.0, ( item, ) )
+	# END for each item
+
+def _recordResult( distributor, cmdinput, jobtime, exitcode, errorstream, reportstream ):
+	"""Inform the distributor about a finished job and report its inputs"""
+	seconds = jobtime / len( cmdinput )
+	success = exitcode == 0
+	for item, numattempts in distributor.finished( cmdinput, jobtime, success ):
+		if success:
+			_report( reportstream, "done", numattempts, seconds, ( item, ) )
+			continue
+		# END handle success
+
+		_report( reportstream, "failed", numattempts, seconds, ( item, ) )
+		if errorstream:
+			errorstream.write( "FAILED: %s ( exit code %i, %i attempt(s), %f s )\n" % ( item, exitcode, numattempts, seconds ) )
+			errorstream.flush()
+	# END for each done input
+
+
+#{ Worker Pool
+
+def _resolveEntryPoint( entrypoint ):
+	""":return: callable at the given entrypoint in the form module.path:callable.path"""
+	modulename, sep, attrpath = entrypoint.partition( ":" )
+	if not sep or not attrpath:
+		raise ValueError( "Entry point must be given as module:callable, got %s" % entrypoint )
+
+	obj = __import__( modulename, fromlist = [ "" ] )
+	for attr in attrpath.split( "." ):
+		obj = getattr( obj, attr )
+	return obj
+
+def _workerMain( entrypoint, searchpath = '' ):
+	"""Run as worker process of `processWithWorkers`. Reads lists of inputs from stdin,
+	one python literal per line, passes them to the callable at entrypoint and writes a
+	response line per call. Everything written to stdout by the callable goes to stderr
+	:param searchpath: os.pathsep separated module search paths of the parent process, 
+		they are appended to our own ones to make the entrypoint importable"""
+	# our directory contains modules shadowing standard modules, like cmd
+	scriptdir = os.path.dirname( os.path.abspath( __file__ ) )
+	for path in searchpath.split( os.pathsep ):
+		if path and path not in sys.path:
+			sys.path.append( path )
+	# END for each parent path
+	sys.path = [ p for p in sys.path if os.path.abspath( p or os.curdir ) != scriptdir ]
+	func = _resolveEntryPoint( entrypoint )
+
+	protocol = os.fdopen( os.dup( sys.stdout.fileno() ), "w" )
+	os.dup2( sys.stderr.fileno(), sys.stdout.fileno() )
+
+	for line in iter( sys.stdin.readline, '' ):
+		inputs = literal_eval( line )
+		response = dict( ok = True, result = None )
+		try:
+			result = func( inputs )
+			if result is not None:
+				response[ 'result' ] = str( result )
+		except Exception:
+			traceback.print_exc()
+			response[ 'ok' ] = False
+		# END handle exceptions
+		sys.stdout.flush()
+		sys.stderr.flush()
+
+		protocol.write( repr( response ) + "\n" )
+		protocol.flush()
+	# END for each request
+
+
+class _Worker( object ):
+	"""A worker process running `_workerMain`, handling one chunk of inputs at a time"""
+
+	def __init__( self, python, entrypoint ):
+		script = os.path.splitext( os.path.abspath( __file__ ) )[0] + ".py"
+		searchpath = os.pathsep.join( os.path.abspath( p or os.curdir ) for p in sys.path )
+		self.process = subprocess.Popen( ( python, script, "--worker", entrypoint, searchpath ), stdin = subprocess.PIPE,
+										stdout = subprocess.PIPE, stderr = subprocess.PIPE, env = os.environ )
+		_setNonBlocking( self.process.stderr.fileno() )
+		_setNonBlocking( self.process.stdout.fileno() )
+		self.numTasks = 0
+		self.batchinput = None			# inputs currently being processed
+		self.batchstart = None			# time at which the processing started
+		self._buffer = ''
+
+	def send( self, cmdinput ):
+		""":return: True if the inputs could be sent to the worker"""
+		self.batchinput = cmdinput
+		self.batchstart = time.time()
+		self.numTasks += 1
+		try:
+			self.process.stdin.write( repr( list( cmdinput ) ) + "\n" )
+			self.process.stdin.flush()
+		except IOError:
+			return False
+		return True
+
+	def receive( self ):
+		""":return: response dict if it is complete, None if it is incomplete
+		:raise EOFError: if the worker died"""
+		while True:
+			try:
+				data = os.read( self.process.stdout.fileno(), 65536 )
+			except OSError, e:
+				if e.errno in ( errno.EAGAIN, errno.EWOULDBLOCK ):
+					return None
+				if e.errno == errno.EINTR:
+					continue
+				raise
+			# END handle exceptions
+
+			if not data:
+				raise EOFError( "Worker %i died" % self.process.pid )
+
+			self._buffer += data
+			if "\n" in self._buffer:
+				line, self._buffer = self._buffer.split( "\n", 1 )
+				return literal_eval( line )
+			# END handle complete line
+		# END read loop
+
+	def stop( self, errorstream ):
+		"""Let the worker finish and write its remaining stderr output to errorstream
+		:return: exit code of the worker"""
+		try:
+			self.process.stdin.close()
+		except IOError:
+			pass
+		while not self.process.stderr.closed:
+			if _readStderr( self.process, errorstream ):
+				select.select( [ self.process.stderr ], [], [], 0.05 )
+		# END drain stderr
+		self.process.stdout.close()
+		return self.process.wait()
+
+
+def processWithWorkers( entrypoint, inputList, errorstream = None, donestream = None, inputsPerProcess = 1,
+						numJobs = 1, attempts = 1, targetJobTime = None, reportstream = None,
+						resultstream = None, tasksPerWorker = 0, python = sys.executable ):
+	"""Process the inputs from inputList with numJobs persistent worker processes, each
+	running the given callable. The interpreter startup costs are only paid once per worker.
+	
+	Parameters are as in `process`, additionally:
+	:param entrypoint: callable in the form module.path:callable.path. It must be importable
+		by the worker processes and is called with a list of inputs. Exceptions mark the inputs
+		as failed, and results which are not None are written to the resultstream
+	:param resultstream: stream to which the results of the callable will be written, one per line,
+		if not None
+	:param tasksPerWorker: if larger than 0, workers will be replaced by new ones once they
+		processed the given amount of input chunks, which bounds their memory consumption
+	:param python: path to the interpreter to run the workers with"""
+	distributor = _Distributor( inputList, inputsPerProcess, numJobs, attempts, targetJobTime )
+	idle = list()				# workers waiting for inputs
+	busy = list()				# workers processing inputs
+
+	def retire( worker, status = None ):
+		"""Stop the worker, and record its inputs with the given status if it is not None"""
+		exitcode = worker.stop( errorstream )
+		if status == "failed":
+			_recordResult( distributor, worker.batchinput, time.time() - worker.batchstart, exitcode or 1,
+							errorstream, reportstream )
+		elif status == "aborted":
+			_reportAborted( distributor, reportstream, worker.batchinput )
+	# END utility
+
+	try:
+		while True:
+			# fill all free slots
+			while len( busy ) < numJobs:
+				cmdinput = distributor.nextChunk()
+				if not cmdinput:
+					break
+				worker = ( idle and idle.pop() ) or _Worker( python, entrypoint )
+				if worker.send( cmdinput ):
+					busy.append( worker )
+				else:
+					retire( worker, "failed" )
+			# END for each free slot
+
+			if not busy:
+				break
+
+			# wait for responses, drain stderr meanwhile
+			try:
+				fds = dict( ( w.process.stdout.fileno(), w ) for w in busy )
+				errfds = dict( ( w.process.stderr.fileno(), w ) for w in busy + idle if not w.process.stderr.closed )
+				try:
+					readable = select.select( fds.keys() + errfds.keys(), [], [], None )[0]
+				except select.error, e:
+					if e.args[0] != errno.EINTR:
+						raise
+					continue
+				# END handle interrupts
+			except KeyboardInterrupt:
+				for worker in busy:
+					killProcess( worker.process )
+					retire( worker, "aborted" )
+				busy = list()
+				sys.stdout.write("Aborted all running processes - continuing\n")
+				continue
+			# END handle interrupts
+
+			for fd in readable:
+				if fd in errfds:
+					# the worker could have been stopped meanwhile
+					if not errfds[ fd ].process.stderr.closed:
+						_readStderr( errfds[ fd ].process, errorstream )
+					continue
+				# END handle stderr
+
+				worker = fds[ fd ]
+				try:
+					response = worker.receive()
+				except EOFError:
+					busy.remove( worker )
+					retire( worker, "failed" )
+					continue
+				# END handle dead workers
+
+				if response is None:
+					continue
+
+				busy.remove( worker )
+				success = response[ 'ok' ]
+				if success:
+					if donestream is not None:
+						donestream.writelines( "\n".join( worker.batchinput ) + "\n" )
+						donestream.flush()
+					if resultstream is not None and response[ 'result' ] is not None:
+						resultstream.write( response[ 'result' ] + "\n" )
+						resultstream.flush()
+				# END handle success
+				_recordResult( distributor, worker.batchinput, time.time() - worker.batchstart, int( not success ),
+								errorstream, reportstream )
+
+				if tasksPerWorker > 0 and worker.numTasks >= tasksPerWorker:
+					retire( worker )
+				else:
+					idle.append( worker )
+			# END for each readable fd
+		# END scheduling loop
+	finally:
+		for worker in busy:
+			killProcess( worker.process )
+		for worker in idle + busy:
+			worker.stop( errorstream )
+		# END for each worker
+	# END assure workers are stopped
+
+#} END worker pool
 
-	# queue is empty, finalize our pending jobs
-	superviseJobs( jobs, 1, list(), errorstream, donestream )
 
 
 #{ Command Line Tool
 
 def _usageAndExit( msg = None ):
 	"""Print usage"""
-	sys.stdout.write("""python batch.py inputarg [inputarg ...] [-E fileForErrors|-] [-D fileForFinishedOutput|-] [-s numInputsPerProcess] -e cmd [cmdArg ...]
--E|D - 	means to use the default stream, either stderr or stdout
+	sys.stdout.write("""python batch.py inputarg [inputarg ...] [-E fileForErrors|-] [-D fileForFinishedOutput|-] [-R fileForReport|-] [-s numInputsPerProcess] -e cmd [cmdArg ...] | -w module:callable
+-E|D|R|O - 	means to use the default stream, either stderr or stdout
+-R	write a line per input with tab separated status ( done|failed|aborted ), attempts,
+	seconds and the input itself
 -I	if specified, arguments will also be read from stdin until it is depleted as
-	newline separated list of names
-	Its particlularly important that the pipe to stdin closes once its done as
-	this command currently does not support streaming of input args
+	newline separated list of names. They are read as they are needed, hence the
+	processing starts before the pipe to stdin is closed
 -e 	ends the parsing of commandline arguments for the batch process tool
 	and uses the rest of the commandline as direct input for your command
 -s	defines how many input arguments will be passed per command invocation
 -j	the number of processes to keep running in parallel, default 1
+-a	the number of times an input may be processed until it is considered failed, default 1.
+	Inputs of failed invocations are retried on their own
+-M	the amount of megabytes all running commands may use. New commands are only started if
+	the memory used by the running ones plus the average peak memory of the finished ones
+	is below this value
+-L	only start new commands if the 1 minute load average of the system is below this value
+-m	the maximum amount of megabytes of address space per command
+-c	the maximum amount of cpu seconds per command
+-S	write a json file with the exit code, wall time, cpu time and peak memory of each command
+	to the given path
+-w	module:callable
+	instead of starting cmd for each chunk of inputs, start -j persistent worker processes
+	calling the given callable with a list of inputs. It must be importable by the workers
+-r	the number of input chunks after which a worker will be replaced by a new one, default 0,
+	which keeps workers alive until all inputs are processed
+-p	the python interpreter to start workers with, default is the current one
+-O	write the results of the callable given with -w which are not None, one per line
+-t	the amount of seconds each command invocation should take. If set, the amount of inputs
+	per invocation is adjusted based on the time previous inputs took, with -s being the maximum
 
 	The given inputargs will be passed as arguments to the commands or into
 	the standardinput of the process""")
@@ -170,10 +804,27 @@ def main( *args ):
 		_usageAndExit( )
 
 	inputList = list()
-	streams = list( ( None, None ) )
+	inputSources = [ inputList ]
+	streams = list( ( None, None, None, None ) )
+
+	if args[0] == "--worker":
+		if len( args ) not in ( 2, 3 ):
+			_usageAndExit( "--worker must be followed by the entry point and optionally the module search path" )
+		_workerMain( *args[1:] )
+		return
+	# END worker mode
 
 	numJobs = 1
 	inputsPerProcess = 1
+	attempts = 1
+	targetJobTime = None
+	tasksPerWorker = 0
+	python = sys.executable
+	maxRSS = None
+	maxLoad = None
+	rlimits = dict()
+	summaryfile = None
+	entrypoint = None
 	cmd = None
 	cmdargs = list()
 	haveReadInput = False
@@ -201,7 +852,8 @@ def main( *args ):
 		# STREAMS
 		############
 		flagfound = False
-		for i,(flag,stream) in enumerate( ( ( "-E",sys.stderr ), ( "-D", sys.stdout ) ) ):
+		for i,(flag,stream) in enumerate( ( ( "-E",sys.stderr ), ( "-D", sys.stdout ), ( "-R", sys.stdout ),
+											( "-O", sys.stdout ) ) ):
 			if arg == flag:
 				argval = _popleftchecked( argv, "%s must be followed by - or a filepath" % flag )
 				streams[ i ] = _toStream( argval, stream )
@@ -229,6 +881,83 @@ def main( *args ):
 				_usageAndExit( msg )
 		# END -s
 
+		if flagfound: continue
+		if arg == "-a":
+			msg = "-a must be followed by a number > 0"
+			attempts = int( _popleftchecked( argv, msg ) )
+			flagfound = True
+			if attempts < 1:
+				_usageAndExit( msg )
+		# END -a
+
+		if flagfound: continue
+		if arg == "-t":
+			msg = "-t must be followed by a number of seconds > 0"
+			targetJobTime = float( _popleftchecked( argv, msg ) )
+			flagfound = True
+			if targetJobTime <= 0:
+				_usageAndExit( msg )
+		# END -t
+
+		if flagfound: continue
+		if arg in ( "-m", "-c" ):
+			import resource
+			msg = "%s must be followed by a number > 0" % arg
+			limit = int( _popleftchecked( argv, msg ) )
+			flagfound = True
+			if limit < 1:
+				_usageAndExit( msg )
+			if arg == "-m":
+				rlimits[ resource.RLIMIT_AS ] = ( limit * 1024 * 1024, ) * 2
+			else:
+				rlimits[ resource.RLIMIT_CPU ] = ( limit, ) * 2
+		# END -m, -c
+
+		if flagfound: continue
+		if arg == "-M":
+			msg = "-M must be followed by a number of megabytes > 0"
+			maxRSS = int( _popleftchecked( argv, msg ) ) * 1024 * 1024
+			flagfound = True
+			if maxRSS < 1:
+				_usageAndExit( msg )
+		# END -M
+
+		if flagfound: continue
+		if arg == "-L":
+			msg = "-L must be followed by a load average > 0"
+			maxLoad = float( _popleftchecked( argv, msg ) )
+			flagfound = True
+			if maxLoad <= 0:
+				_usageAndExit( msg )
+		# END -L
+
+		if flagfound: continue
+		if arg == "-S":
+			summaryfile = _popleftchecked( argv, "-S must be followed by a filepath" )
+			flagfound = True
+		# END -S
+
+		if flagfound: continue
+		if arg == "-w":
+			entrypoint = _popleftchecked( argv, "-w must be followed by module:callable" )
+			flagfound = True
+		# END -w
+
+		if flagfound: continue
+		if arg == "-r":
+			msg = "-r must be followed by a number > 0"
+			tasksPerWorker = int( _popleftchecked( argv, msg ) )
+			flagfound = True
+			if tasksPerWorker < 1:
+				_usageAndExit( msg )
+		# END -r
+
+		if flagfound: continue
+		if arg == "-p":
+			python = _popleftchecked( argv, "-p must be followed by the interpreter to use" )
+			flagfound = True
+		# END -p
+
 		if flagfound: continue
 
 		# INPUT ARGUMENTS FROM STDIN
@@ -238,8 +967,10 @@ def main( *args ):
 				_usageAndExit( "-I may only be specified once" )
 
 			haveReadInput = True
-			# read stripped lines from stdin
-			inputList.extend( ( l.strip() for l in  sys.stdin.readlines() ) )
+			# read stripped lines from stdin as they are needed
+			inputSources.append( ( l.strip() for l in iter( sys.stdin.readline, '' ) ) )
+			inputList = list()
+			inputSources.append( inputList )
 		# END -s
 
 		if flagfound: continue
@@ -250,12 +981,24 @@ def main( *args ):
 	# END for each argument
 
 
-	if not cmd:
-		_usageAndExit( "No command to execute - add it after the -e flag" )
+	if not cmd and not entrypoint:
+		_usageAndExit( "No command to execute - add it after the -e flag or use -w" )
+	if cmd and entrypoint:
+		_usageAndExit( "-e and -w cannot be used together" )
 
 
 	# have everything, transfer control to the actual batch method
-	process( cmd, cmdargs, inputList, streams[0], streams[1], inputsPerProcess, numJobs )
+	if haveReadInput:
+		inputList = chain( *inputSources )
+
+	if entrypoint:
+		processWithWorkers( entrypoint, inputList, streams[0], streams[1], inputsPerProcess, numJobs,
+							attempts, targetJobTime, streams[2], streams[3], tasksPerWorker, python )
+		return
+	# END worker pool mode
+
+	process( cmd, cmdargs, inputList, streams[0], streams[1], inputsPerProcess, numJobs,
+			attempts, targetJobTime, streams[2], maxRSS, maxLoad, rlimits, summaryfile )
 
 
 
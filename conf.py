@@ -24,7 +24,11 @@ from ConfigParser import (	RawConfigParser,
 							NoOptionError,
 							ParsingError)
 from exc import MRVError
+from util import replaceFileAtomically
 import copy
+import itertools
+import cPickle
+import hashlib
 import re
 import sys
 import StringIO
@@ -137,12 +141,19 @@ class ConfigAccessor( object ):
 		Keys and Sections have property attributes of type `Section`
 		Their keys and values are used to further define key merging behaviour for example
 		
+	**Lookups**:
+		Sections and keys are looked up by name using an index of the whole chain, which 
+		is built on demand. Any structural change to the chain, like adding or removing 
+		sections or keys, invalidates it, the next lookup will rebuild it in a single pass.
+		
 	:note: The configaccessor should only be used in conjunction with the `ConfigManager`"""
-	__slots__ = "_configChain"
+	__slots__ = ( "_configChain", "_index", "_indexState" )
 
 	def __init__( self ):
 		""" Initialize instance variables """
 		self._configChain = ConfigChain( )  # keeps configuration from different sources
+		self._index = None					# ( keyindex, sectionindex, nodeindex ) tuple, see _lookupIndex
+		self._indexState = None				# state of the chain when the index was built
 
 	def __repr__( self ):
 		stream = ConfigStringIO()
@@ -164,6 +175,95 @@ class ConfigAccessor( object ):
 			tokens.insert( 0, None )
 		return tokens
 
+	def _chainState( self ):
+		""":return: tuple describing the state of our chain's structure"""
+		return tuple( ( node, node._changes.count ) for node in self._configChain )
+
+	def _lookupIndex( self ):
+		""":return: tuple( keyindex, sectionindex, nodeindex ) of dicts mapping key names to lists of 
+			(`Key`,`Section`) tuples, section names to lists of `Section` objects and 
+			section ids to the position of their node in our chain respectively. 
+			The lists are ordered as the nodes in our chain. The index is rebuilt if 
+			the structure of our chain changed since it was created
+		:note: our own structural changes update the index in place, only changes 
+			done by others cause it to be rebuilt
+		:note: changes are tracked by the change counters of our nodes, hence sections and keys 
+			must be added and removed through the methods of `ConfigNode` and `Section` 
+			instead of altering their sets directly"""
+		state = self._chainState()
+		if self._index is None or self._indexState != state:
+			keyindex = dict()
+			sectionindex = dict()
+			nodeindex = dict()
+			for nodepos, node in enumerate( self._configChain ):
+				for section in node._sections:
+					nodeindex[ id( section ) ] = nodepos
+					sectionindex.setdefault( section._name, list() ).append( section )
+					for key in section.keys:
+						keyindex.setdefault( key._name, list() ).append( ( key, section ) )
+					# END for each key
+				# END for each section
+			# END for each node
+			self._index = ( keyindex, sectionindex, nodeindex )
+			self._indexState = state
+		# END rebuild index
+		return self._index
+
+	def _indexPosition( self, sections, section ):
+		""":return: position at which an entry for section needs to be inserted into 
+			an index list with entries for the given sections to keep it ordered by node"""
+		nodeindex = self._index[2]
+		nodepos = nodeindex[ id( section ) ]
+		for i, other in enumerate( sections ):
+			if nodeindex[ id( other ) ] > nodepos:
+				return i
+		# END for each indexed section
+		return len( sections )
+
+	def _indexKey( self, key, section ):
+		"""Add the newly created key of the given indexed section to our index
+		
+		:note: the index must have been current before the key was created"""
+		entries = self._index[0].setdefault( key._name, list() )
+		entries.insert( self._indexPosition( [ s for k, s in entries ], section ), ( key, section ) )
+		self._indexState = self._chainState()
+
+	def _indexSection( self, section, nodepos ):
+		"""Add the given section of the node at nodepos and all its keys to our index 
+		unless they are indexed already
+		
+		:note: the index must have been current before the section was altered"""
+		keyindex, sectionindex, nodeindex = self._index
+		nodeindex[ id( section ) ] = nodepos
+		entries = sectionindex.setdefault( section._name, list() )
+		if not [ s for s in entries if s is section ]:
+			entries.insert( self._indexPosition( entries, section ), section )
+		# END index section
+		
+		for key in section.keys:
+			entries = keyindex.get( key._name, tuple() )
+			if not [ k for k, s in entries if k is key ]:
+				self._indexKey( key, section )
+		# END for each key
+		self._indexState = self._chainState()
+
+	def _sectionKeyDefault( self, section, keyname, value ):
+		""":return: `Key` with keyname in the given indexed section, it will be 
+			created with value if required"""
+		for key, keysection in self._lookupIndex()[0].get( keyname, tuple() ):
+			if keysection is section:
+				return key
+		# END for each key with keyname
+		
+		key = section.keyDefault( keyname, value )[0]
+		self._indexKey( key, section )
+		return key
+
+	def _setChain( self, chain ):
+		"""Set our configuration chain to the given one"""
+		self._configChain = chain
+		self._index = None
+
 	def _parseProperties( self ):
 		"""Analyse the freshly parsed configuration chain and add the found properties
 		to the respective sections and keys
@@ -173,6 +273,9 @@ class ConfigAccessor( object ):
 			thus be written back to the file as required
 		
 		:raise ConfigParsingPropertyError: """
+		# merging properties only alters property sections, which are not part of the chain, 
+		# hence the index stays valid for the whole run
+		keyindex, sectionindex, nodeindex = self._lookupIndex()
 		sectioniter = self._configChain.sectionIterator()
 		exc = ConfigParsingPropertyError( )
 		for section in sectioniter:
@@ -184,7 +287,7 @@ class ConfigAccessor( object ):
 			targetkeytokens = self._getNameTuple( propname ) # fully qualified property name
 
 			# find all keys matching the keyname !
-			keymatchtuples = self.keysByName( targetkeytokens[1] )
+			keymatchtuples = keyindex.get( targetkeytokens[1], list() )
 
 			# SEARCH FOR KEYS primarily !
 			propertytarget = None		# will later be key or section
@@ -219,8 +322,8 @@ class ConfigAccessor( object ):
 			# could be a section property
 			if propertytarget is None:
 				try:
-					propertytarget = self.section( targetkeytokens[1] )
-				except NoSectionError:
+					propertytarget = sectionindex[ targetkeytokens[1] ][0]
+				except KeyError:
 					# nothing found - skip it
 					excmessage += "Property '" + propname + "' references unknown section or key\n"
 
@@ -236,8 +339,24 @@ class ConfigAccessor( object ):
 			raise exc
 
 
+	def _snapshot( self ):
+		""":return: list with the compiled sections of each node in our chain"""
+		return [ [ _sectionToTuple( section ) for section in node._sections ] for node in self._configChain ]
+
+	def _restoreSnapshot( self, fileobjectlist, snapshot ):
+		"""Rebuild our configuration chain from a snapshot as returned by `_snapshot`, 
+		using the given file-like objects as sources of the nodes"""
+		chain = ConfigChain( )
+		for fp, sections in zip( fileobjectlist, snapshot ):
+			node = ConfigNode( fp )
+			for t in sections:
+				node._addSection( _tupleToSection( t ) )
+			chain.append( node )
+		# END for each node
+		self._setChain( chain )
+
 	#{ IO Interface
-	def readfp( self, filefporlist, close_fp = True ):
+	def readfp( self, filefporlist, close_fp = True, cachefile = None ):
 		""" Read the configuration from the file like object(s) representing INI files.
 		
 		:note: This will overwrite and discard all existing configuration.
@@ -245,12 +364,31 @@ class ConfigAccessor( object ):
 		
 		:param close_fp: if True, the file-like object will be closed before the method returns,
 			but only for file-like objects that have actually been processed
+		
+		:param cachefile: if not None, path to a file keeping a compiled snapshot of the 
+			parsed configuration. If none of the sources changed since the snapshot was
+			written, it will be loaded instead of parsing the sources. Otherwise the 
+			sources will be parsed and the snapshot will be rewritten.
 
 		:raise ConfigParsingError: """
 		fileobjectlist = filefporlist
 		if not isinstance( fileobjectlist, (list,tuple) ):
 			fileobjectlist = ( filefporlist, )
 
+		stamps = None
+		if cachefile is not None:
+			stamps = _sourceStamps( fileobjectlist )
+			snapshot = _readSnapshot( cachefile, stamps )
+			if snapshot is not None:
+				self._restoreSnapshot( fileobjectlist, snapshot['chain'] )
+				if close_fp:
+					for fp in fileobjectlist:
+						fp.close()
+				# END close files
+				return
+			# END use snapshot
+		# END handle cache
+		
 		# create one parser per file, append information to our configuration chain
 		tmpchain = ConfigChain( )			# to be stored later if we do not have an exception
 
@@ -264,13 +402,17 @@ class ConfigAccessor( object ):
 					fp.close()
 
 		# keep the chain - no error so far
-		self._configChain = tmpchain
+		self._setChain( tmpchain )
 
 		try:
 			self._parseProperties( )
 		except ConfigParsingPropertyError:
-			self._configChain = ConfigChain()	# undo changes and reraise
+			self._setChain( ConfigChain() )	# undo changes and reraise
 			raise
+		
+		if stamps is not None:
+			_writeSnapshot( cachefile, stamps, dict( chain=self._snapshot() ) )
+		# END write snapshot
 
 	def write( self, close_fp=True ):
 		""" Write current state back to files.
@@ -358,12 +500,7 @@ class ConfigAccessor( object ):
 	#{ General Access ( disregarding writable state )
 	def hasSection( self, name ):
 		""":return: True if the given section exists"""
-		try:
-			self.section( name )
-		except NoSectionError:
-			return False
-
-		return True
+		return name in self._lookupIndex()[1]
 
 	def section( self, section ):
 		""" :return: first section with name
@@ -372,11 +509,10 @@ class ConfigAccessor( object ):
 			`flatten` ed list.
 			
 		:raise NoSectionError: if the requested section name does not exist """
-		for node in self._configChain:
-			if section in node._sections:
-				return node.section( section )
-
-		raise NoSectionError( section )
+		try:
+			return self._lookupIndex()[1][ section ][0]
+		except KeyError:
+			raise NoSectionError( section )
 
 	def keyDefault( self, sectionname, keyname, value ):
 		"""Convenience Function: get key with keyname in first section with sectionname with the key's value being initialized to value if it did not exist.
@@ -387,7 +523,7 @@ class ConfigAccessor( object ):
 			It can be a list of values as well, basically anything that `Key` allows as value
 			
 		:return: `Key`"""
-		return self.sectionDefault( sectionname ).keyDefault(keyname, value )[0]
+		return self._sectionKeyDefault( self.sectionDefault( sectionname ), keyname, value )
 
 	def keysByName( self, name ):
 		""":param name: the name of the key you wish to find
@@ -396,7 +532,7 @@ class ConfigAccessor( object ):
 
 	def iterateKeysByName( self, name ):
 		"""As `keysByName`, but returns an iterator instead"""
-		return self._configChain.iterateKeysByName( name )
+		return iter( self._lookupIndex()[0].get( name, tuple() ) )
 		
 	def get( self, key_id, default = None ):
 		"""Convenience function allowing to easily specify the key you wish to retrieve
@@ -428,7 +564,7 @@ class ConfigAccessor( object ):
 					raise NoOptionError(kid, sid)
 				else:
 					for section in self.sectionIterator():
-						return section.keyDefault(kid, default)[0]
+						return self._sectionKeyDefault(section, kid, default)
 					# create default section 
 					return self.sectionDefault('default').keyDefault(kid, default)[0]
 				# END default handling
@@ -469,9 +605,11 @@ class ConfigAccessor( object ):
 			pass
 
 		# find the first writable node and create the section there
-		for node in self._configChain:
+		for nodepos, node in enumerate( self._configChain ):
 			if node.writable:
-				return node.sectionDefault( section )
+				section = node.sectionDefault( section )
+				self._indexSection( section, nodepos )
+				return section
 
 		# we did not find any writable node - fail
 		raise IOError( "Could not find a single writable configuration file" )
@@ -481,17 +619,36 @@ class ConfigAccessor( object ):
 		
 		:return: the number of nodes that did *not* allow the section to be removed as they are read-only, thus
 			0 will be returned if everything was alright"""
+		keyindex, sectionindex, nodeindex = self._lookupIndex()
 		numReadonly = 0
-		for node in self._configChain:
-			if not node.hasSection( name ):
-				continue
+		remaining = list()
+		for section in sectionindex.get( name, tuple() ):
+			node = self._configChain[ nodeindex[ id( section ) ] ]
 
 			# can we write it ?
 			if not node._isWritable( ):
 				numReadonly += 1
+				remaining.append( section )
 				continue
 
-			node._sections.remove( name )
+			node._removeSection( section )
+			
+			# drop it from the index as well
+			del( nodeindex[ id( section ) ] )
+			for key in section.keys:
+				entries = [ entry for entry in keyindex[ key._name ] if entry[1] is not section ]
+				if entries:
+					keyindex[ key._name ] = entries
+				else:
+					del( keyindex[ key._name ] )
+			# END for each key
+		# END for each section with name
+		
+		if remaining:
+			sectionindex[ name ] = remaining
+		else:
+			sectionindex.pop( name, None )
+		self._indexState = self._chainState()
 
 		return numReadonly
 
@@ -501,9 +658,12 @@ class ConfigAccessor( object ):
 		
 		:raise IOError: if no writable node was found
 		:return: name of the file source that has received the section"""
-		for node in self._configChain:
+		for nodepos, node in enumerate( self._configChain ):
 			if node._isWritable():
-				node.sectionDefault( str( section ) ).mergeWith( section )
+				self._lookupIndex()
+				mysection = node.sectionDefault( str( section ) )
+				mysection.mergeWith( section )
+				self._indexSection( mysection, nodepos )
 				return node._fp.name( )
 
 		raise IOError( "No writable section found for merge operation" )
@@ -534,7 +694,7 @@ class ConfigManager( object ):
 	
 	__slots__ = ( '__config', 'config', '_writeBackOnDestruction', '_closeFp' ) 
 
-	def __init__( self, filePointers=list(), write_back_on_desctruction=True, close_fp = True ):
+	def __init__( self, filePointers=list(), write_back_on_desctruction=True, close_fp = True, cachefile = None ):
 		"""Initialize the class with a list of Extended File Classes
 		
 		:param filePointers: Point to the actual configuration to use
@@ -546,13 +706,15 @@ class ConfigManager( object ):
 
 		:param write_back_on_desctruction: if True, the config chain and possible
 			changes will be written once this instance is being deleted. If false,
-			the changes must explicitly be written back using the write method"""
+			the changes must explicitly be written back using the write method
+			
+		:param cachefile: see `readfp`"""
 		self.__config = ConfigAccessor( )
 		self.config = None					# will be set later
 		self._writeBackOnDestruction = write_back_on_desctruction
 		self._closeFp = close_fp
 
-		self.readfp( filePointers, close_fp=close_fp )
+		self.readfp( filePointers, close_fp=close_fp, cachefile=cachefile )
 
 
 	def __del__( self ):
@@ -598,16 +760,45 @@ class ConfigManager( object ):
 			# TODO: raise a proper error here as mentioned in the docs
 			# raise IOError()
 
-	def readfp( self, filefporlist, close_fp=True ):
+	def readfp( self, filefporlist, close_fp=True, cachefile=None ):
 		""" Read the configuration from the file pointers.
 		
 		:raise ConfigParsingError:
 		:param filefporlist: single file like object or list of such
+		:param cachefile: if not None, path to a file keeping a compiled snapshot of the 
+			configuration chain and its flattened version. It will be used instead of 
+			parsing and flattening if none of the sources changed since it was written, 
+			and rewritten otherwise. Sources which are neither files nor in-memory 
+			buffers disable the cache.
 		:return: the configuration that is meant to be used for accessing the configuration"""
-		self.__config.readfp( filefporlist, close_fp = close_fp )
+		fileobjectlist = filefporlist
+		if not isinstance( fileobjectlist, (list,tuple) ):
+			fileobjectlist = ( filefporlist, )
+		
+		stamps = None
+		if cachefile is not None:
+			stamps = _sourceStamps( fileobjectlist )
+			snapshot = _readSnapshot( cachefile, stamps )
+			if snapshot is not None and 'flat' in snapshot:
+				self.__config._restoreSnapshot( fileobjectlist, snapshot['chain'] )
+				if close_fp:
+					for fp in fileobjectlist:
+						fp.close()
+				# END close files
+				self.config = ConfigAccessor( )
+				self.config._restoreSnapshot( ( ConfigStringIO(), ), snapshot['flat'] )
+				return self.config
+			# END use snapshot
+		# END handle cache
+		
+		self.__config.readfp( fileobjectlist, close_fp = close_fp )
 
 		# flatten the list and attach it
 		self.config = self.__config.flatten( ConfigStringIO() )
+		
+		if stamps is not None:
+			_writeSnapshot( cachefile, stamps, dict( chain=self.__config._snapshot(), flat=self.config._snapshot() ) )
+		# END write snapshot
 		return self.config
 
 	#} End IO Methods
@@ -923,7 +1114,7 @@ class BasicSet( set ):
 	:note: indexing a set is not the fastest because the matching key has to be searched.
 		Good news is that the actual 'is k in set' question can be answered quickly"""
 	__slots__ = tuple()
-	
+
 	def __getitem__( self, item ):
 		# assure we have the item
 		if not item in self:
@@ -937,6 +1128,14 @@ class BasicSet( set ):
 		# should never come here !
 		raise AssertionError( "Should never have come here" )
 
+class _ChangeCounter( object ):
+	"""Counts the structural changes of a `ConfigNode` and its sections, allowing 
+	indices of the configuration structure to be invalidated"""
+	__slots__ = 'count'
+	
+	def __init__( self ):
+		self.count = 0
+
 
 class _PropertyHolderBase( object ):
 	"""Simple Base defining how to deal with properties
@@ -1123,7 +1322,7 @@ class Section( _PropertyHolderBase ):
 	all its keys and section properties
 
 	:note: name will be stored stripped and must not contain certain chars """
-	__slots__ = ( '_name', 'keys' )
+	__slots__ = ( '_name', 'keys', '_changes' )
 	_re_checkName = re.compile( r'\+?\w+(:' + Key.validchars+ r'+)?' )
 
 	def __iter__( self ):
@@ -1136,6 +1335,7 @@ class Section( _PropertyHolderBase ):
 		:param order: -1 = will be written to end of list, or to given position otherwise """
 		self._name 			= ''
 		self.keys 			= BasicSet()
+		self._changes		= _ChangeCounter()	# shared with our node once we are added to one
 		_PropertyHolderBase.__init__( self, name, order )
 
 	def __hash__( self ):
@@ -1185,10 +1385,14 @@ class Section( _PropertyHolderBase ):
 		if othersection.properties is not None:
 			self.properties.mergeWith( othersection.properties )
 
+		# looking up our keys by name in the set is linear, hence we use a map
+		keymap = dict( ( key._name, key ) for key in self.keys )
 		for fkey in othersection.keys:
-			key,created = self.keyDefault( fkey.name, 1 )
-			if created:
+			key = keymap.get( fkey._name )
+			if key is None:
+				key = self.keyDefault( fkey.name, 1 )[0]
 				key._values = list()	# reset the value if key has been newly created
+			# END create key
 
 			# merge the keys
 			key.mergeWith( fkey )
@@ -1217,6 +1421,7 @@ class Section( _PropertyHolderBase ):
 			if isinstance( self, PropertySection ):
 				key.properties = None
 			self.keys.add( key )
+			self._changes.count += 1
 			return ( key, True )
 
 	def setKey( self, name, value ):
@@ -1242,13 +1447,25 @@ class ConfigNode( object ):
 	Additionally, it is aware of it being element of a chain, and can provide next
 	and previous elements respectively """
 	#{Construction/Destruction
-	__slots__ = ( '_sections', '_fp' )
+	__slots__ = ( '_sections', '_fp', '_changes' )
 	def __init__( self, fp ):
 		""" Initialize Class Instance"""
 		self._sections	= BasicSet()			# associate sections with key holders
 		self._fp		= fp					# file-like object that we can read from and possibly write to
+		self._changes	= _ChangeCounter()		# counts changes of our sections and their keys
 	#}
 
+	def _addSection( self, section ):
+		"""Add the given section to our sections, its keys are tracked by our change counter from now on"""
+		section._changes = self._changes
+		self._sections.add( section )
+		self._changes.count += 1
+
+	def _removeSection( self, section ):
+		"""Remove the given section from our sections"""
+		self._sections.remove( section )
+		self._changes.count += 1
+
 
 	def _isWritable( self ):
 		return self._fp.isWritable()
@@ -1387,13 +1604,118 @@ class ConfigNode( object ):
 				sectionclass = PropertySection
 
 			section = sectionclass( name, -1 )
-			self._sections.add( section )
+			self._addSection( section )
 			return section
 			
 	#} END section access
 #} END utility classes
 
 
+#{ Snapshots
+
+# increment if the layout of the snapshot data changes
+_snapshotVersion = 1
+
+def _sourceStamps( fileobjectlist ):
+	""":return: list of stamps identifying the state of each of the given `ExtendedFileInterface` 
+		objects, or None if at least one of them cannot be identified reliably.
+		Files are identified by their path, modification time and size, in-memory buffers 
+		by the digest of their contents"""
+	stamps = list()
+	for fp in fileobjectlist:
+		if isinstance( fp, ConfigFile ):
+			path = os.path.abspath( fp.name() )
+			try:
+				st = os.stat( path )
+			except OSError:
+				return None
+			stamps.append( ( path, st.st_mtime, st.st_size ) )
+		elif isinstance( fp, StringIO.StringIO ):
+			stamps.append( ( fp.name(), hashlib.md5( fp.getvalue() ).hexdigest() ) )
+		else:
+			return None
+		# END handle source type
+	# END for each file object
+	return stamps
+
+def _readSnapshot( cachefile, stamps ):
+	""":return: the snapshot data stored in cachefile if it was created from sources 
+		matching the given stamps, or None"""
+	if stamps is None:
+		return None
+	try:
+		fp = open( cachefile, 'rb' )
+		try:
+			version, filestamps, snapshot = cPickle.load( fp )
+		finally:
+			fp.close()
+	except Exception:
+		# missing or unreadable snapshots are just reparsed
+		return None
+	# END exception handling
+
+	if version != _snapshotVersion or filestamps != stamps:
+		return None
+	return snapshot
+
+def _writeSnapshot( cachefile, stamps, snapshot ):
+	"""Write the snapshot data along with the stamps of its sources into the cachefile.
+	The file is replaced atomically, failures are logged, but not raised as the 
+	snapshot will just be recreated next time"""
+	def writer( fp ):
+		cPickle.dump( ( _snapshotVersion, stamps, snapshot ), fp, cPickle.HIGHEST_PROTOCOL )
+	# END writer
+	
+	try:
+		replaceFileAtomically( cachefile, writer )
+	except (IOError, OSError), e:
+		log.warn( "Could not write configuration snapshot to %s: %s" % ( cachefile, e ) )
+	# END exception handling
+
+def _sectionToTuple( section ):
+	""":return: tuple of plain data representing the given section, its keys and properties"""
+	properties = None
+	if section.properties is not None:
+		properties = _sectionToTuple( section.properties )
+	keys = list()
+	for key in section.keys:
+		keyproperties = None
+		if key.properties is not None:
+			keyproperties = _sectionToTuple( key.properties )
+		keys.append( ( key._name, key._values, key.order, keyproperties ) )
+	# END for each key
+	return ( isinstance( section, PropertySection ), section._name, section.order, keys, properties )
+
+def _tupleToSection( data ):
+	""":return: `Section` or `PropertySection` as described by the tuple returned by `_sectionToTuple`
+	:note: as the data was validated when it was parsed, we bypass the validation
+		done by the constructors"""
+	isproperty, name, order, keys, properties = data
+	section = object.__new__( ( isproperty and PropertySection ) or Section )
+	section._name = name
+	section._changes = _ChangeCounter()
+	section.order = order
+	section.properties = None
+	if properties is not None:
+		section.properties = _tupleToSection( properties )
+	
+	keyset = BasicSet()
+	for keyname, values, keyorder, keyproperties in keys:
+		key = object.__new__( Key )
+		key._name = keyname
+		key._values = values
+		key.order = keyorder
+		key.properties = None
+		if keyproperties is not None:
+			key.properties = _tupleToSection( keyproperties )
+		keyset.add( key )
+	# END for each key
+	section.keys = keyset
+	return section
+
+#} END snapshots
+
+
 #{ Configuration Diffing Classes
 
 class DiffData( object ):
@@ -1464,15 +1786,37 @@ class DiffKey( DiffData ):
 
 	@classmethod
 	def _subtractLists( cls, a, b ):
-		"""Subtract the values of b from a, return the list with the differences"""
-		acopy = a[:]
-		for val in b:
-			try:
-				acopy.remove( val )
-			except ValueError:
-				pass
-
-		return acopy
+		"""Subtract the values of b from a, return the list with the differences
+		
+		:note: for each value in b, the first equal value in a is removed, the order of 
+			the remaining values is kept"""
+		# count the values to remove - this is linear, whereas removing them one by one
+		# from the list is quadratic
+		counts = dict()
+		try:
+			for val in b:
+				counts[val] = counts.get( val, 0 ) + 1
+		except TypeError:
+			# unhashable values
+			acopy = a[:]
+			for val in b:
+				try:
+					acopy.remove( val )
+				except ValueError:
+					pass
+			# END for each value to remove
+			return acopy
+		# END handle unhashable values
+		
+		out = list()
+		for val in a:
+			count = counts.get( val, 0 )
+			if count:
+				counts[val] = count - 1
+				continue
+			out.append( val )
+		# END for each value
+		return out
 
 	@classmethod
 	def _matchLists( cls, a, b ):
@@ -1486,10 +1830,6 @@ class DiffKey( DiffData ):
 		:note: currently the implementation is not index based, but set- and thus value based
 		:note: changed has no meaning in this case and will always be empty """
 
-		# compare based on string list, as this matches the actual representation in the file
-		avals = frozenset( str( val ) for val in A._values  )
-		bvals = frozenset( str( val ) for val in B._values  )
-		# we store real
 		self.added = self._subtractLists( B._values, A._values )
 		self.removed = self._subtractLists( A._values, B._values )
 		self.unchanged = self._subtractLists( B._values, self.added )	# this gets the commonalities
@@ -1541,11 +1881,13 @@ class DiffSection( DiffData ):
 		self.changed = list()
 		self.unchanged = list()
 		self.name = A.name
-		# find and set changed keys
+		# find and set changed keys - looking them up in the sets would be linear
+		akeys = dict( ( key._name, key ) for key in A.keys )
+		bkeys = dict( ( key._name, key ) for key in B.keys )
 		common = A.keys & B.keys
 		for key in common:
-			akey = A.key( str( key ) )
-			bkey = B.key( str( key ) )
+			akey = akeys[ key._name ]
+			bkey = bkeys[ key._name ]
 			dkey = DiffKey( akey, bkey )
 
 			if dkey.hasDifferences( ): self.changed.append( dkey )
@@ -1564,20 +1906,29 @@ class DiffSection( DiffData ):
 		if targetSection is None:
 			return
 
+		# retrieve existing keys from a map as the lookup in the set is linear
+		keymap = dict( ( key._name, key ) for key in targetSection.keys )
+		def getKey( keyname ):
+			key = keymap.get( keyname )
+			if key is None:
+				key = keymap[ keyname ] = self._getNewKey( targetSection, keyname )
+			return key
+		# END utility
+
 		# add added keys - they could exist already, which is why they are being merged
 		for addedkey in self.added:
-			key = self._getNewKey( targetSection, addedkey.name )
-			key.mergeWith( addedkey )
+			getKey( addedkey.name ).mergeWith( addedkey )
 
 		# remove moved keys - simply delete them from the list
 		for removedkey in self.removed:
 			if removedkey in targetSection.keys:
 				targetSection.keys.remove( removedkey )
+				targetSection._changes.count += 1
+				keymap.pop( removedkey.name, None )
 
 		# handle changed keys - we will create a new key if this is required
 		for changedKeyDiff in self.changed:
-			key = self._getNewKey( targetSection, changedKeyDiff.name )
-			changedKeyDiff.applyTo( key )
+			changedKeyDiff.applyTo( getKey( changedKeyDiff.name ) )
 
 		# apply section property diff
 		if self.properties is not None:
@@ -1628,13 +1979,13 @@ class ConfigDiffer( DiffData ):
 		this is not the case - sets would simply drop keys with the same name
 		leading to invalid results - thus we have to merge equally named sections
 		
-		:return: BasicSet with merged sections
-		:todo: make this algo work on sets instead of individual sections for performance"""
+		:return: BasicSet with merged sections"""
 		sectionlist = list( configaccessor.sectionIterator() )
 		if len( sectionlist ) < 2:
 			return BasicSet( sectionlist )
 
 		out = BasicSet( )				# need a basic set for indexing
+		merged = dict()					# name -> section in out, as indexing the set is linear
 		for section in sectionlist:
 			# skip property sections - they have been parsed into properties, but are
 			# still available as ordinary sections
@@ -1642,51 +1993,145 @@ class ConfigDiffer( DiffData ):
 				continue
 
 			section_to_add = section
-			if section in out:
+			previous = merged.get( section._name )
+			if previous is not None:
 				# get a copy of A and merge it with B
 				# assure the merge works left-to-right - previous to current
 				# NOTE: only the first copy makes sense - all the others that might follow are not required ...
-				merge_section = copy.deepcopy( out[ section ] )	# copy section and all keys - they will be altered
+				merge_section = copy.deepcopy( previous )	# copy section and all keys - they will be altered
 				merge_section.mergeWith( section )
 
 				#remove old and add copy
 				out.remove( section )
 				section_to_add = merge_section
 			out.add( section_to_add )
+			merged[ section._name ] = section_to_add
 		return out
 
-	def _populate( self, A, B ):
-		""" Perform the acutal diffing operation to fill our data structures
+	@classmethod
+	def iterDiff( cls, A, B ):
+		"""Compare the configuration accessors A and B, yielding the differences of B 
+		compared to A as they are found.
+		
+		The sections of both sides are compared using hashed set operations, hence 
+		the diff is linear in the amount of sections and keys.
+		
+		:return: iterator yielding ( kind, item ) tuples, kind being one of 'added', 'removed',
+			'changed' or 'unchanged', item being what would be stored in the respective list 
+			of a `ConfigDiffer` instance. All added and removed sections are yielded before
+			the changed and unchanged ones.
 		:note: this method directly accesses ConfigAccessors internal datastructures """
 		# diff sections  - therefore we actually have to treat the chains
 		#  in a flattened manner
 		# built section sets !
-		asections = self._getMergedSections( A )
-		bsections = self._getMergedSections( B )
+		asections = cls._getMergedSections( A )
+		bsections = cls._getMergedSections( B )
 		# assure we do not work on references !
 		
 		# Deepcopy can be 0 in case we are shutting down - deepcopy goes down too early 
 		# for some reason
 		assert copy.deepcopy is not None, "Deepcopy is not available"
-		self.added = list( copy.deepcopy( bsections - asections ) )
-		self.removed = list( copy.deepcopy( asections - bsections ) )
-		self.changed = list( )
-		self.unchanged = list( )
-		self.name = ''
-		common = asections & bsections		# will be copied later later on key level
+		for section in bsections - asections:
+			yield 'added', copy.deepcopy( section )
+		for section in asections - bsections:
+			yield 'removed', copy.deepcopy( section )
 		
 		# get a deeper analysis of the common sections - added,removed,changed keys
-		for section in common:
+		amap = dict( ( section._name, section ) for section in asections )
+		bmap = dict( ( section._name, section ) for section in bsections )
+		for section in asections & bsections:
 			# find out whether the section has changed
-			asection = asections[ section ]
-			bsection = bsections[ section ]
-			dsection = DiffSection( asection, bsection )
+			asection = amap[ section._name ]
+			dsection = DiffSection( asection, bmap[ section._name ] )
 			if dsection.hasDifferences( ): 
-				self.changed.append( dsection )
+				yield 'changed', dsection
 			else: 
-				self.unchanged.append( asection )
+				yield 'unchanged', asection
 		# END for each common section
 
+	def _populate( self, A, B ):
+		""" Perform the acutal diffing operation to fill our data structures """
+		self.added = list( )
+		self.removed = list( )
+		self.changed = list( )
+		self.unchanged = list( )
+		self.name = ''
+		for kind, item in self.iterDiff( A, B ):
+			getattr( self, kind ).append( item )
+		# END for each difference
+
+	@classmethod
+	def applyStream( cls, ca, diffiter ):
+		"""Apply the differences yielded by the given iterator to the given ConfigAccessor
+		in one batch. 
+		
+		The effect is the same as applying a `ConfigDiffer` holding all the differences, 
+		but the structure of the configuration is only indexed once instead of being 
+		searched for each section.
+		
+		:param diffiter: iterator yielding ( kind, item ) tuples as returned by `iterDiff`
+		:return: see `applyTo`"""
+		rval = (list(),list(),list())
+		
+		# the first writable node receives new sections
+		writablenode = None
+		for node in ca._configChain:
+			if node._isWritable():
+				writablenode = node
+				break
+		# END for each node
+		
+		nodesections = None		# name -> section map of the writable node
+		if writablenode is not None:
+			nodesections = dict( ( section._name, section ) for section in writablenode._sections )
+		sections = None			# name -> first section in chain, invalidated by structural changes
+		
+		def writableSection( name ):
+			section = nodesections.get( name )
+			if section is None:
+				section = nodesections[ name ] = writablenode.sectionDefault( name )
+			return section
+		# END utility
+		
+		for kind, item in diffiter:
+			if kind == 'added':
+				# merge the added sections - only to the first we find
+				if writablenode is None:
+					rval[0].append( item )
+					continue
+				writableSection( str( item ) ).mergeWith( item )
+				sections = None
+			elif kind == 'removed':
+				# remove removed sections - everywhere possible
+				# This is because diffs will only be done on merged lists
+				numfailedremoved = ca.removeSection( item.name )
+				if numfailedremoved:
+					rval[1].append( item )
+				if nodesections is not None:
+					nodesections.pop( item.name, None )
+				sections = None
+			elif kind == 'changed':
+				# handle the changed sections - here only keys or properties have changed
+				# respectively
+				# note: changes may only be applied once ! The diff works only on
+				# merged configuration chains - this means one secion only exists once
+				# here we have an unmerged config chain, and to get consistent results,
+				# the changes may only be applied to one section - we use the first we get
+				if sections is None:
+					sections = dict( ( name, sectionlist[0] ) for name, sectionlist in ca._lookupIndex()[1].iteritems() )
+				
+				targetSection = sections.get( item.name )
+				if targetSection is None:
+					if writablenode is None:
+						rval[2].append( item )
+						continue
+					targetSection = sections[ item.name ] = writableSection( item.name )
+				# END create section
+				item.applyTo( targetSection )
+			# END handle kind
+		# END for each difference
+		return rval
+
 	def applyTo( self, ca ):
 		"""Apply the stored differences in this ConfigDiffer instance to the given ConfigAccessor
 
@@ -1707,37 +2152,10 @@ class ConfigDiffer( DiffData ):
 			 - [1] = list of `Section` s failed to be removed
 			 
 			 - [2] = list of `DiffSection` s failed to apply their changes """
-			 
-
-		# merge the added sections - only to the first we find
-		rval = (list(),list(),list())
-		for addedsection in self.added:
-			try:
-				ca.mergeSection( addedsection )
-			except IOError:
-				rval[0].append( addedsection )
-
-		# remove removed sections - everywhere possible
-		# This is because diffs will only be done on merged lists
-		for removedsection in self.removed:
-			numfailedremoved = ca.removeSection( removedsection.name )
-			if numfailedremoved:
-				rval[1].append( removedsection )
-
-		# handle the changed sections - here only keys or properties have changed
-		# respectively
-		for sectiondiff in self.changed:
-			# note: changes may only be applied once ! The diff works only on
-			# merged configuration chains - this means one secion only exists once
-			# here we have an unmerged config chain, and to get consistent results,
-			# the changes may only be applied to one section - we use the first we get
-			try:
-				targetSection = ca.sectionDefault( sectiondiff.name )
-				sectiondiff.applyTo( targetSection )
-			except IOError:
-				rval[2].append( sectiondiff )
-
-		return rval
+		diffiter = itertools.chain( ( ( 'added', s ) for s in self.added ), 
+									( ( 'removed', s ) for s in self.removed ), 
+									( ( 'changed', d ) for d in self.changed ) )
+		return self.applyStream( ca, diffiter )
 
 #} END configuration diffing classes
 
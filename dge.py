@@ -8,13 +8,16 @@ import networkx as nx
 from collections import deque
 import inspect
 import weakref
-import itertools
+import sys
+import os
+import time
+import threading
 from util import iDuplicatable
 
 __all__ = ("ConnectionError", "PlugIncompatible", "PlugAlreadyConnected", "AccessError",
            "NotWritableError", "NotReadableError", "MissingDefaultValueError", "ComputeError", 
            "ComputeFailed", "ComputeFailed", "PlugUnhandled", 
-           "iterShells", "Attribute", "iPlug", "plug", "Graph", "NodeBase")
+           "iterShells", "Attribute", "iPlug", "plug", "Profiler", "Graph", "NodeBase")
 
 #####################
 ## EXCEPTIONS ######
@@ -189,6 +192,14 @@ class Attribute( object ):
 	kNo, kGood, kPerfect = 0, 127, 255				# specify how good attributes fit together
 	exact_type, readonly, computable, cls, uncached, unconnectable,check_passing_values = ( 1, 2, 4, 8, 16, 32, 64 )
 
+	#{ Configuration
+	# maximum amount of class ratings to be cached, see `_getClassRating`
+	rating_cache_size = 8192
+	#} END configuration
+
+	# ( typecls, exact_type, cls ) -> rating, shared by all attributes
+	_rating_cache = dict()
+
 	def __init__( self, typeClass, flags, default = None ):
 		self.typecls = typeClass
 		self.flags = flags			# used for bitflags describing mode
@@ -210,6 +221,24 @@ class Attribute( object ):
 		if not isinstance( cls, type ):
 			return 0
 
+		# the rating only depends on the mros of both classes, which do not change
+		# once the classes exist
+		key = ( self.typecls, exact_type, cls )
+		try:
+			return self._rating_cache[ key ]
+		except KeyError:
+			pass
+		# END cache lookup
+
+		rate = self._computeClassRating( cls, exact_type )
+		ratecache = Attribute._rating_cache
+		if len( ratecache ) >= self.rating_cache_size:
+			ratecache.clear()
+		ratecache[ key ] = rate
+		return rate
+
+	def _computeClassRating( self, cls, exact_type ):
+		""":return: uncached class rating, see `_getClassRating`"""
 		mro = self.typecls.mro()
 		mro.reverse()
 
@@ -294,6 +323,32 @@ class Attribute( object ):
 
 		return 0
 
+	@classmethod
+	def compatabilityRates( cls, attributes, value, rate_cache = None ):
+		""":return: list of compatability rates of value, one for each of the given attributes,
+			see `compatabilityRate`
+		:param rate_cache: if not None, a dict attribute -> rate of attributes rated against
+			the same value before. Pass the same dict to all calls rating the same value
+			to rate each attribute only once"""
+		if rate_cache is None:
+			rate_cache = dict()
+
+		rates = list()
+		for attr in attributes:
+			try:
+				rate = rate_cache[ attr ]
+			except KeyError:
+				rate = rate_cache[ attr ] = attr.compatabilityRate( value )
+			rates.append( rate )
+		# END for each attribute
+		return rates
+
+	@classmethod
+	def clearRatingCache( cls ):
+		"""Clear the class ratings cached by all attributes. This is only required
+		if the bases of a class were altered after it has been rated"""
+		Attribute._rating_cache.clear()
+
 	def default( self ):
 		""":return: default value stored for this attribute, or raise
 		:note: handles dynamic defaults, so you should not directly access the default member variable
@@ -391,13 +446,16 @@ class plug( iPlug ):
 	"""
 	kNo,kGood,kPerfect = ( 0, 127, 255 )
 
+	# incremented whenever an affects relationship changes
+	_affects_generation = 0
+
 	#{ Overridden object methods
 	def __init__( self, attribute ):
 		"""Intialize the plug with a distinctive name"""
 		self._name = None
 		self.attr = attribute
-		self._affects = list()			# list of plugs that are affected by us
-		self._affectedBy = list()		# keeps record of all plugs that affect us
+		self._affects = tuple()			# plugs that are affected by us
+		self._affectedBy = tuple()		# keeps record of all plugs that affect us
 
 	#} END object overridden methods
 
@@ -436,24 +494,30 @@ class plug( iPlug ):
 
 	def affects( self, otherplug ):
 		"""Set an affects relation ship between this plug and otherplug, saying
-		that this plug affects otherplug."""
+		that this plug affects otherplug.
+		
+		:note: as the relation is kept in tuples, `affected` and `affectedBy` can
+			hand them out without copying"""
 		if otherplug not in self._affects:
-			self._affects.append( otherplug )
+			self._affects += ( otherplug, )
 
 		if self not in otherplug._affectedBy:
-			otherplug._affectedBy.append( self )
+			otherplug._affectedBy += ( self, )
+
+		# input and output sets of the class plug tables need to be rebuilt
+		plug._affects_generation += 1
 
 	def affected( self ):
 		""":return: tuple containing affected plugs ( plugs that are affected by our value )"""
-		return tuple( self._affects )
+		return self._affects
 
 	def affectedBy( self ):
 		""":return: tuple containing plugs that affect us ( plugs affecting our value )"""
-		return tuple( self._affectedBy )
+		return self._affectedBy
 
 	def providesOutput( self ):
 		""":return: True if this is an output plug that can trigger computations"""
-		return bool( len( self.affectedBy() ) != 0 or self.attr.flags & Attribute.computable )
+		return bool( self._affectedBy or self.attr.flags & Attribute.computable )
 
 	def providesInput( self ):
 		""":return: True if this is an input plug that will never cause computations"""
@@ -508,24 +572,19 @@ class _PlugShell( tuple ):
 		""":return: value of the plug
 		:param mode: optional arbitary value specifying the mode of the get attempt"""
 		if self.hasCache( ):
+			graph = self[0].graph
+			if graph is not None and graph.profiler is not None:
+				graph.profiler.cacheHit( self )
 			return self.cache( )
 
 		# Output plugs compute values
 		if self.plug.providesOutput( ):
 			# otherwise compute the value
-			try:
-				result = self.node.compute( self.plug, mode )
-			except ComputeError,e:
-				raise ComputeError( "%s->%s" % ( repr( self ), str( e ) ) )
-			except Exception:		# except all - this is an unknown excetion - just pass it on, keeping the origin
-				raise
-
-			if result is None:
-				raise AssertionError( "Plug %s returned None - check your node implementation" % ( str( self ) ) )
-			# END result check
+			result = self._compute( mode )
 
 			# try to cache computed values
 			self.setCache( result )
+			self._markClean( )
 			return result
 		# END plug provides output
 		elif self.plug.providesInput( ):	# has to be separately checked
@@ -534,17 +593,18 @@ class _PlugShell( tuple ):
 			if not inputshell:
 				# check for default value
 				try:
-					return self.plug.attr.default()
+					value = self.plug.attr.default()
 				except ( TypeError, MissingDefaultValueError ),e:
 					raise MissingDefaultValueError( "Plug %r failed to getrieve its default value and is not connected" % repr( self ), e )
+			else:
+				# query the connected plug for the value
+				value = inputshell.get( mode )
+				if self.plug.attr.flags & Attribute.check_passing_values:
+					if not self.plug.attr.compatabilityRate( value ):
+						raise TypeError( "Value coming from input %s is not compatible with %s" % ( str( inputshell ), str( self ) ) )
 			# END if we have no input
 
-			# query the connected plug for the value
-			value = inputshell.get( mode )
-			if self.plug.attr.flags & Attribute.check_passing_values:
-				if not self.plug.attr.compatabilityRate( value ):
-					raise TypeError( "Value coming from input %s is not compatible with %s" % ( str( inputshell ), str( self ) ) )
-
+			self._markClean( )
 			return value
 		# END plug provides input
 
@@ -552,6 +612,32 @@ class _PlugShell( tuple ):
 
 
 
+	def _compute( self, mode ):
+		""":return: value computed by our node for our plug, without touching any cache
+		:raise ComputeError:"""
+		profiler = self[0].graph
+		if profiler is not None:
+			profiler = profiler.profiler
+			if profiler is not None:
+				profiler.startCompute( self )
+		# END profiler handling
+
+		try:
+			result = self.node.compute( self.plug, mode )
+		except ComputeError,e:
+			raise ComputeError( "%s->%s" % ( repr( self ), str( e ) ) )
+		except Exception:		# except all - this is an unknown excetion - just pass it on, keeping the origin
+			raise
+		finally:
+			if profiler is not None:
+				profiler.endCompute( self )
+		# END compute
+
+		if result is None:
+			raise AssertionError( "Plug %s returned None - check your node implementation" % ( str( self ) ) )
+		# END result check
+		return result
+
 	def set( self, value, ignore_connection = False ):
 		"""Set the given value to be used in our plug
 		:param ignore_connection: if True, the plug can be destination of a connection and
@@ -659,12 +745,9 @@ class _PlugShell( tuple ):
 
 
 	#{Caching
-	def _cachename( self ):
-		return self.plug.name() + "_c"
-
 	def hasCache( self ):
 		""":return: True if currently store a cached value"""
-		return hasattr( self.node, self._cachename() )
+		return self[0]._plugcache.has( self[1] )
 
 	def setCache( self, value ):
 		"""Set the given value to be stored in our cache
@@ -680,42 +763,94 @@ class _PlugShell( tuple ):
 		# our cache changed - dirty downstream plugs - thus clear the cache
 		# NOTE: this clears our own cache by deleting it, but we re-set it
 		self.clearCache( clear_affected = True )
-		setattr( self.node, self._cachename(), value )
+		self._markClean( )
+		self[0]._plugcache.set( self[1], value )
 
 	def cache( self ):
 		""":return: the cached value or raise
 		:raise ValueError:"""
-		if self.hasCache():
-			return getattr( self.node, self._cachename() )
-
-		raise ValueError( "Plug %r did not have a cached value" % repr( self ) )
+		try:
+			return self[0]._plugcache.get( self[1] )
+		except KeyError:
+			raise ValueError( "Plug %r did not have a cached value" % repr( self ) )
+		# END handle missing cache
+
+	def _markClean( self ):
+		"""Remove our dirty bit as we deliver an up-to-date value
+		:note: must be called after the value was retrieved, as retrieving it may dirty us"""
+		graph = self.node.graph
+		if graph is not None and graph._dirtyshells:
+			graph._dirtyshells.discard( self )
+
+	def isDirty( self ):
+		""":return: True if our value was invalidated by an upstream change and has not
+			been retrieved since
+		:note: only tracked if our node's graph has dirty_tracking enabled"""
+		graph = self.node.graph
+		return graph is not None and self in graph._dirtyshells
 
 	def clearCache( self, clear_affected = False, cleared_shells_set = None ):
 		"""Empty the cache of our plug
 		:param clear_affected: if True, the caches of our affected plugs ( connections
 		or affects relations ) will also be cleared
-		This operation is recursive, and needs to be as different shells on different nodes
+		This operation walks the downstream shells iteratively, but hands over to
+		shells that override this method as different shells on different nodes
 		might do things differently.
 		:param cleared_shells_set: if set, it can be used to track which plugs have already been dirtied to
 		prevent recursive loops
-		Propagation will happen even if we do not have a cache to clear ourselves """
-		if self.hasCache():
-			del( self.node.__dict__[ self._cachename() ] )
-
-		if clear_affected:
-			# our cache changed - dirty downstream plugs - thus clear the cache
-			if not cleared_shells_set:		# initialize our tracking list
-				cleared_shells_set = set()
+		Propagation will happen even if we do not have a cache to clear ourselves,
+		unless the graph uses dirty tracking and we are dirty already - our downstream
+		plugs have been dirtied already in that case"""
+		self[0]._plugcache.remove( self[1] )
 
-			if self in cleared_shells_set:
-				return
+		if not clear_affected:
+			return
 
-			cleared_shells_set.add( self )	# assure we do not come here twice
+		graph = self.node.graph
+		dirty_tracking = graph is not None and graph.dirty_tracking
+		if dirty_tracking:
+			# DIRTY TRACKING
+			# Everything downstream of a dirty shell is dirty too, or has not been
+			# evaluated through it since, thus we stop at dirty shells.
+			# As shells are marked before their downstream is visited, cycles are handled as well.
+			cleared_shells_set = graph._dirtyshells
+		elif not cleared_shells_set:		# initialize our tracking list
+			cleared_shells_set = set()
+		# END init tracking set
+
+		plainClearCache = _PlugShell.__dict__[ 'clearCache' ]
+		numcleared = 0
+		stack = [ self ]
+		while stack:
+			shell = stack.pop()
+			if shell in cleared_shells_set:
+				continue
 
-			all_shells = itertools.chain( self.node.toShells( self.plug.affected() ), self.outputs() )
-			for shell in all_shells:
-				shell.clearCache( clear_affected = True, cleared_shells_set = cleared_shells_set )
-			# END for each shell in all_shells to clear
+			if shell is not self:
+				# shells of another kind, or living in a graph that tracks differently
+				# handle themselves and their downstream
+				sgraph = shell.node.graph
+				if type( shell ).clearCache.im_func is not plainClearCache or \
+					( sgraph is not None and sgraph.dirty_tracking ) != dirty_tracking or \
+					( dirty_tracking and sgraph._dirtyshells is not cleared_shells_set ):
+					if dirty_tracking:
+						shell.clearCache( clear_affected = True )
+					else:
+						shell.clearCache( clear_affected = True, cleared_shells_set = cleared_shells_set )
+					continue
+				# END handle foreign shell
+
+				shell[0]._plugcache.remove( shell[1] )
+			# END handle downstream shell
+
+			cleared_shells_set.add( shell )	# assure we do not come here twice
+			numcleared += 1
+			stack.extend( shell.node.toShells( shell.plug.affected() ) )
+			stack.extend( shell.outputs() )
+		# END for each shell to clear
+
+		if graph is not None and graph.profiler is not None:
+			graph.profiler.recordPropagation( self, numcleared )
 	#} END caching
 
 
@@ -729,21 +864,242 @@ class _PlugShell( tuple ):
 
 
 
-class Graph( nx.DiGraph, iDuplicatable ):
+class Profiler( object ):
+	"""Records the evaluations of the graphs it is set to, see `Graph.profiler`.
+	
+	For each shell, it counts computations, cache hits and the shells dirtied by
+	cache invalidations starting at it ( the dirty propagation fan-out ). The wall
+	time of each computation is kept in total, including the time spent to compute
+	upstream shells, and for the shell itself.
+	Workflow call graphs report their process calls as well, see `startCall`.
+
+	The results can be written as aggregated table or as trace-event file to be viewed
+	in chrome://tracing.
+	
+	:note: the profiler is thread-safe"""
+	#{ Configuration
+	# if False, only the statistics are kept, which is sufficient for the table
+	record_events = True
+	#} END configuration
+
+	class Stat( object ):
+		"""Statistics of a shell or node"""
+		__slots__ = ( 'name', 'computes', 'hits', 'totaltime', 'selftime', 'propagations', 'fanout' )
+		def __init__( self, name ):
+			self.name = name
+			self.computes = 0			# amount of computations, equals the amount of cache misses
+			self.hits = 0				# amount of values retrieved from the cache
+			self.totaltime = 0.0		# wall time of our computations in seconds
+			self.selftime = 0.0		# as totaltime, without the time spent in nested computations
+			self.propagations = 0		# amount of cache invalidations starting at us
+			self.fanout = 0			# amount of shells dirtied by our invalidations
+
+		def __iadd__( self, other ):
+			for attr in self.__slots__[1:]:
+				setattr( self, attr, getattr( self, attr ) + getattr( other, attr ) )
+			return self
+
+	def __init__( self ):
+		self._lock = threading.Lock()
+		self._local = threading.local()	# per thread stack of running computations and calls
+		self.clear()
+
+	def clear( self ):
+		"""Drop all recorded information"""
+		self._starttime = time.time()
+		self._stats = dict()			# shell -> Stat
+		self._events = list()			# trace event dicts
+
+	#{ Recording
+	def _stat( self, shell ):
+		""":return: Stat for shell
+		:note: must be called with the lock held"""
+		try:
+			return self._stats[ shell ]
+		except KeyError:
+			stat = self._stats[ shell ] = self.Stat( repr( shell ) )
+			return stat
+
+	def _stack( self, kind ):
+		""":return: list of [ starttime, nested time ] entries of the current thread
+		:param kind: 'computes' or 'calls', which are tracked separately as calls happen
+			within computations"""
+		try:
+			return getattr( self._local, kind )
+		except AttributeError:
+			stack = list()
+			setattr( self._local, kind, stack )
+			return stack
+
+	def _addEvent( self, event ):
+		event[ 'pid' ] = os.getpid()
+		event[ 'tid' ] = threading.currentThread().ident
+		self._events.append( event )
+
+	def _start( self, kind ):
+		self._stack( kind ).append( [ time.time(), 0.0 ] )
+
+	def _end( self, kind ):
+		""":return: tuple( starttime, total time, self time ) of the entry started last"""
+		stack = self._stack( kind )
+		starttime, nested = stack.pop()
+		elapsed = time.time() - starttime
+		if stack:
+			stack[-1][1] += elapsed
+		return ( starttime, elapsed, elapsed - nested )
+
+	def startCompute( self, shell ):
+		"""Called before shell's node computes its value"""
+		self._start( 'computes' )
+
+	def endCompute( self, shell ):
+		"""Called once the computation started with `startCompute` finished"""
+		starttime, elapsed, selftime = self._end( 'computes' )
+		self._lock.acquire()
+		try:
+			stat = self._stat( shell )
+			stat.computes += 1
+			stat.totaltime += elapsed
+			stat.selftime += selftime
+			if self.record_events:
+				self._addEvent( dict( name = stat.name, cat = "compute", ph = "X",
+										ts = ( starttime - self._starttime ) * 1000000.0,
+										dur = elapsed * 1000000.0 ) )
+		finally:
+			self._lock.release()
+
+	def cacheHit( self, shell ):
+		"""Called if shell's value was retrieved from its cache"""
+		self._lock.acquire()
+		try:
+			self._stat( shell ).hits += 1
+		finally:
+			self._lock.release()
+
+	def recordPropagation( self, shell, numshells ):
+		"""Called once the cache invalidation starting at shell dirtied numshells shells"""
+		self._lock.acquire()
+		try:
+			stat = self._stat( shell )
+			stat.propagations += 1
+			stat.fanout += numshells
+			if self.record_events:
+				self._addEvent( dict( name = stat.name, cat = "dirty", ph = "i", s = "t",
+										ts = ( time.time() - self._starttime ) * 1000000.0,
+										args = dict( fanout = numshells ) ) )
+		finally:
+			self._lock.release()
+
+	def startCall( self, pdata ):
+		"""Called by a workflow's callgraph once the call of a process starts
+		:param pdata: ProcessData of the call"""
+		self._start( 'calls' )
+
+	def endCall( self, pdata ):
+		"""Called by a workflow's callgraph when the call started last has ended"""
+		starttime, elapsed, selftime = self._end( 'calls' )
+		if not self.record_events:
+			return
+		self._lock.acquire()
+		try:
+			self._addEvent( dict( name = "%s.%s" % ( pdata.process, pdata.plug ), cat = "process", ph = "X",
+									ts = ( starttime - self._starttime ) * 1000000.0,
+									dur = elapsed * 1000000.0,
+									args = dict( mode = str( pdata.mode ), exception = str( pdata.exception ) ) ) )
+		finally:
+			self._lock.release()
+
+	#} END recording
+
+	#{ Query
+	def stats( self, per_node = False ):
+		""":return: list of `Stat` instances, one per shell, sorted by total time, descending
+		:param per_node: if True, the returned statistics are combined per node"""
+		self._lock.acquire()
+		try:
+			items = self._stats.items()
+		finally:
+			self._lock.release()
+
+		if per_node:
+			nodestats = dict()
+			for shell, stat in items:
+				node = shell[0]
+				try:
+					nodestat = nodestats[ node ]
+				except KeyError:
+					nodestat = nodestats[ node ] = self.Stat( str( node ) )
+				nodestat += stat
+			# END for each shell statistic
+			stats = nodestats.values()
+		else:
+			stats = [ stat for shell, stat in items ]
+		# END handle per node
+
+		stats.sort( key = lambda s: s.totaltime, reverse = True )
+		return stats
+
+	def writeTable( self, stream = sys.stdout, per_node = False ):
+		"""Write the statistics as table to the given stream
+		:param per_node: see `stats`"""
+		header = ( "computes", "hits", "total[s]", "self[s]", "dirtied", "fanout", "name" )
+		stream.write( "%10s %10s %12s %12s %10s %10s  %s\n" % header )
+		for s in self.stats( per_node ):
+			stream.write( "%10i %10i %12.6f %12.6f %10i %10i  %s\n" % ( s.computes, s.hits, s.totaltime, s.selftime,
+																		s.propagations, s.fanout, s.name ) )
+		# END for each stat
+
+	def writeTrace( self, stream ):
+		"""Write all recorded events in the trace event format as understood by chrome://tracing
+		:param stream: stream to write the json data to"""
+		import json
+		self._lock.acquire()
+		try:
+			json.dump( dict( traceEvents = self._events, displayTimeUnit = "ms" ), stream )
+		finally:
+			self._lock.release()
+
+	#} END query
+
+
+class Graph( iDuplicatable ):
 	"""Holds the nodes and their connections
 
 	Nodes are kept in a separate list whereas the plug connections are kept
-	in the underlying DiGraph"""
+	in a connection index per node. Each input plug has exactly one source shell,
+	each output plug keeps a list of destination shells.
+
+	If dirty_tracking is enabled, each shell invalidated by an upstream change is
+	marked dirty until its value is retrieved again. Dirtying stops at shells
+	that are dirty already, which makes repeated writes to the same input cheap
+	as the downstream graph is only walked once."""
+
+	#{ Configuration
+	# if True, cache invalidation stops at shells that are dirty already
+	dirty_tracking = False
+
+	# if set to a `Profiler` instance, it records the evaluations of this graph
+	profiler = None
+	#} END configuration
 
 	#{ Overridden Object Methods
-	def __init__( self, **kwargs ):
-		"""initialize the DiGraph and add some additional attributes"""
-		super( Graph, self ).__init__( **kwargs )
+	def __init__( self, name = '', **kwargs ):
+		"""initialize the graph
+		:param name: name of the graph
+		:param kwargs: additional attributes of the graph, kept in the ``graph`` dict as 
+			networkx graphs do"""
+		self.name = name
+		self.graph = dict( kwargs )
 		self._nodes = set()			# our processes from which we can make connections
+		self._sources = dict()		# node -> dict( plug -> source shell )
+		self._destinations = dict()	# node -> dict( plug -> list( destination shell, ... ) )
+		self._dirtyshells = set()	# shells invalidated since their value was last retrieved
+		self._plans = dict()		# output shell -> tuple of shells to evaluate before it
 
 	def __del__( self ):
 		"""Clear our graph"""
-		self.clear()				# clear connections
+		self._sources.clear()		# clear connections
+		self._destinations.clear()
 
 		# NOTE : nodes will remove themselves once they are not referenced anymore
 		self._nodes.clear()
@@ -804,8 +1160,10 @@ class Graph( nx.DiGraph, iDuplicatable ):
 			# shells as it is equal to node.plugname
 			return getattr( nodecpy, shell.plug.name() )
 
-		# copy name ( networkx )
+		# copy name
 		self.name = other.name
+		self.graph = dict( other.graph )
+		self.dirty_tracking = other.dirty_tracking
 
 		# copy nodes first
 		nodemap = dict()
@@ -853,6 +1211,7 @@ class Graph( nx.DiGraph, iDuplicatable ):
 
 		self._nodes.add( node )		# assure the node knows us
 		node.graph = weakref.proxy( self )
+		self._topologyChanged( )
 
 		return self		# assure we have the graph set
 
@@ -866,6 +1225,9 @@ class Graph( nx.DiGraph, iDuplicatable ):
 			# assure the node does not call us anymore
 			node.graph = None
 			self._nodes.remove( node )
+			if self._dirtyshells:
+				self._dirtyshells.difference_update( [ s for s in self._dirtyshells if s.node is node ] )
+			self._topologyChanged( )
 		except KeyError:
 			pass
 
@@ -875,6 +1237,13 @@ class Graph( nx.DiGraph, iDuplicatable ):
 		for node in self._nodes:
 			node.clearCache()
 
+		# without caches, there is nothing left that could be dirty
+		self._dirtyshells.clear()
+
+	def cacheSize( self ):
+		""":return: amount of bytes used by the plug caches of all nodes in the graph"""
+		return sum( node.cacheSize() for node in self._nodes )
+
 	#} END node handling
 
 	#{ Query
@@ -898,15 +1267,15 @@ class Graph( nx.DiGraph, iDuplicatable ):
 			For an ordered itereration, use `iterShells`.
 			
 		:param predicate: if True for node, it will be returned"""
-		# iterate digraph keeping the plugs only ( and thus connected nodes )
-		nodes_seen = set()
-		for node,plug in self.nodes_iter():
-			if node in nodes_seen:
-				continue
-			nodes_seen.add( node )
+		# our connection index only keeps nodes which have connections
+		for node in self._sources:
 			if predicate( node ):
 				yield node
-		# END for each node
+		# END for each destination node
+		for node in self._destinations:
+			if node not in self._sources and predicate( node ):
+				yield node
+		# END for each source node
 
 	def nodes( self ):
 		""":return: immutable copy of the nodes used in the graph"""
@@ -964,79 +1333,410 @@ class Graph( nx.DiGraph, iDuplicatable ):
 		# END destinationshell already connected
 
 		# connect us
-		self.add_edge( sourceshell, v = destinationshell )
+		snode, dnode = sourceshell.node, destinationshell.node
+		self._sources.setdefault( dnode, dict() )[ destinationshell.plug ] = sourceshell
+		self._destinations.setdefault( snode, dict() ).setdefault( sourceshell.plug, list() ).append( destinationshell )
+		self._topologyChanged( )
+
+		# a dirty source will not propagate anymore, thus our new downstream
+		# needs to be dirty as well
+		if sourceshell in self._dirtyshells:
+			destinationshell.clearCache( clear_affected = True )
+		# END dirty source handling
 		return sourceshell
 
 	def disconnect( self, sourceshell, destinationshell ):
 		"""Remove the connection between sourceshell to destinationshell if they are connected
 		:note: does not raise if no connection is present"""
-		self.remove_edge( sourceshell, v = destinationshell )
+		snode, dnode = sourceshell.node, destinationshell.node
+		sources = self._sources.get( dnode )
+		if not sources or sources.get( destinationshell.plug ) != sourceshell:
+			return
 
-		# also, delete the plugshells if they are not connnected elsewhere
-		for shell in sourceshell,destinationshell:
-			if len( self.neighbors( shell ) ) == 0:
-				self.remove_node( shell )
+		# also, delete the entries if the plugs are not connnected elsewhere
+		del( sources[ destinationshell.plug ] )
+		if not sources:
+			del( self._sources[ dnode ] )
+
+		destinations = self._destinations[ snode ]
+		dshells = destinations[ sourceshell.plug ]
+		dshells.remove( destinationshell )
+		if not dshells:
+			del( destinations[ sourceshell.plug ] )
+			if not destinations:
+				del( self._destinations[ snode ] )
+		# END cleanup empty entries
+		self._topologyChanged( )
 
 	def input( self, plugshell ):
 		""":return: the connected input plug of plugshell or None if there is no such connection
 		:note: input plugs have on plug at most, output plugs can have more than one connected plug"""
-		try:
-			pred = self.predecessors( plugshell )
-			if pred:
-				return pred[0]
-		except nx.NetworkXError:
-			pass
-
+		sources = self._sources.get( plugshell[0] )
+		if sources:
+			return sources.get( plugshell[1] )
 		return None
 
 	def outputs( self, plugshell, predicate = lambda x : True ):
 		""":return: a list of plugs being the destination of the connection to plugshell
 		:param predicate: plug will only be returned if predicate is true for it - shells will be passed in """
-		try:
-			return [ s for s in self.successors( plugshell ) if predicate( s ) ]
-		except nx.NetworkXError:
-			return list()
+		destinations = self._destinations.get( plugshell[0] )
+		if destinations:
+			dshells = destinations.get( plugshell[1] )
+			if dshells:
+				return filter( predicate, dshells )
+		# END if node has outputs
+		return list()
+
+	def edges_iter( self ):
+		""":return: generator yielding all connections as tuple( sourceshell, destinationshell )
+			in no particular order"""
+		for destinations in self._destinations.itervalues():
+			for dshells in destinations.itervalues():
+				for dshell in dshells:
+					yield ( self._sources[ dshell[0] ][ dshell[1] ], dshell )
+			# END for each output plug
+		# END for each source node
+
+	def _topologyChanged( self ):
+		"""Called whenever nodes or connections were added or removed"""
+		self._plans.clear()
 
 	#} END connections
 
+	#{ Evaluation
+
+	def _compilePlan( self, outputshell ):
+		""":return: tuple( plan, dependencies, waves ) for outputshell
+			* plan: see `evaluationPlan`
+			* dependencies: dict mapping each shell in the plan to a tuple of output shells
+				it pulls from directly, not counting the shells in between
+			* waves: tuple of tuples of shells of the plan. Shells of one wave only depend
+				on shells of previous waves"""
+		try:
+			return self._plans[ outputshell ]
+		except KeyError:
+			pass
+		# END cached plan
+
+		def upstreamShells( shell ):
+			# I-N-O and O<-I, just like iterShells
+			shells = shell.node.toShells( shell.plug.affectedBy() )
+			ishell = shell.input( )
+			if ishell:
+				shells.append( ishell )
+			return shells
+		# END upstream shells
+
+		# depth first post-order, using our own stack as chains can be very deep
+		plan = list()
+		outdeps = dict()			# shell -> set of output shells it pulls from directly
+		visited = set( ( outputshell, ) )
+		ushells = upstreamShells( outputshell )
+		stack = [ ( outputshell, ushells, iter( ushells ) ) ]
+		while stack:
+			shell, ushells, upstream = stack[-1]
+			for ushell in upstream:
+				if ushell not in visited:
+					visited.add( ushell )
+					uushells = upstreamShells( ushell )
+					stack.append( ( ushell, uushells, iter( uushells ) ) )
+					break
+				# END if shell is new
+			else:
+				stack.pop()
+				deps = set()
+				for ushell in ushells:
+					if ushell.plug.providesOutput():
+						deps.add( ushell )
+					else:
+						deps.update( outdeps.get( ushell, () ) )
+				# END for each upstream shell
+				outdeps[ shell ] = deps
+
+				# the last one to be popped is outputshell itself
+				if stack and shell.plug.providesOutput():
+					plan.append( shell )
+			# END upstream exhausted
+		# END while there are shells to visit
+
+		# assign each shell to the wave after the last of its dependencies
+		dependencies = dict()
+		levels = dict()
+		waves = list()
+		for shell in plan:
+			deps = tuple( outdeps[ shell ] )
+			dependencies[ shell ] = deps
+			level = max( [ levels.get( d, -1 ) for d in deps ] or [ -1 ] ) + 1
+			levels[ shell ] = level
+			if level == len( waves ):
+				waves.append( list() )
+			waves[ level ].append( shell )
+		# END for each shell in plan
+
+		compiled = ( tuple( plan ), dependencies, tuple( tuple( w ) for w in waves ) )
+		self._plans[ outputshell ] = compiled
+		return compiled
+
+	def evaluationPlan( self, outputshell ):
+		""":return: tuple of output shells outputshell depends on, ordered such that
+			each shell comes after all shells it depends on. outputshell itself is not
+			part of the plan.
+		:note: plans are cached until nodes or connections of this graph change. If
+			affects relationships are changed afterwards, call `clearEvaluationPlans`"""
+		return self._compilePlan( outputshell )[0]
+
+	def clearEvaluationPlans( self ):
+		"""Remove all cached evaluation plans, forcing them to be recompiled on the
+		next evaluation"""
+		self._plans.clear()
+
+	def evaluate( self, outputshell, mode = None, pool = None ):
+		""":return: value of outputshell, after evaluating the shells of its `evaluationPlan`
+			one after another, without walking the graph recursively.
+		:param mode: passed to each shell that is evaluated
+		:param pool: if not None, a pool supporting ``apply_async``, like
+			``multiprocessing.pool.ThreadPool``. Independent shells of nodes with
+			thread_safe_compute enabled will be computed in parallel on it, whereas all
+			caches are written by the calling thread.
+		:note: as opposed to `_PlugShell.get`, all upstream outputs without cache
+			will be computed, even if the computation would not have required them.
+			Uncached plugs will be computed on demand by their destinations."""
+		if outputshell.hasCache( ):
+			return outputshell.cache( )
+
+		if pool is None:
+			for shell in self.evaluationPlan( outputshell ):
+				if shell.plug.attr.flags & Attribute.uncached or shell.hasCache( ):
+					continue
+				shell.get( mode )
+			# END for each shell to evaluate
+		else:
+			self._evaluateParallel( outputshell, mode, pool )
+		# END handle pool
+
+		return outputshell.get( mode )
+
+	def _evaluateParallel( self, outputshell, mode, pool ):
+		"""Evaluate the plan of outputshell wave by wave, computing thread-safe shells
+		of each wave on the given pool"""
+		plan, dependencies, waves = self._compilePlan( outputshell )
+		plainGet = _PlugShell.__dict__[ 'get' ]
+
+		# shells computing in a worker thread may only pull uncached shells which
+		# are thread-safe as well, as these are computed on demand
+		threadsafe = dict()
+		for shell in plan:
+			threadsafe[ shell ] = type( shell ).get.im_func is plainGet and \
+									shell.node.thread_safe_compute and \
+									not [ d for d in dependencies[ shell ]
+											if d.plug.attr.flags & Attribute.uncached and not threadsafe[ d ] ]
+		# END for each shell
+
+		for wave in waves:
+			asyncresults = list()
+			serial = list()
+			for shell in wave:
+				if shell.plug.attr.flags & Attribute.uncached or shell.hasCache( ):
+					continue
+				if threadsafe[ shell ]:
+					asyncresults.append( ( shell, pool.apply_async( shell._compute, ( mode, ) ) ) )
+				else:
+					serial.append( shell )
+			# END for each shell in wave
+
+			for shell in serial:
+				shell.get( mode )
+			# END for each shell to compute in this thread
+
+			# write back in order, raise the first error once all computations are done
+			excinfo = None
+			for shell, asyncresult in asyncresults:
+				try:
+					result = asyncresult.get( )
+				except Exception:
+					if excinfo is None:
+						excinfo = sys.exc_info()
+					continue
+				# END handle exception
+				shell.setCache( result )
+				shell._markClean( )
+			# END for each result
+
+			if excinfo is not None:
+				raise excinfo[0], excinfo[1], excinfo[2]
+		# END for each wave
+
+	#} END evaluation
+
+
+def _providesInput( p ):
+	return p.providesInput()
+
+def _providesOutput( p ):
+	return p.providesOutput()
+
+
+class _PlugTable( object ):
+	"""Keeps the plugs defined on a node class and its bases, gathered when the class 
+	is created. The table is created anew if plugs are set on or deleted from any node 
+	class later on, see `NodeBase._plugTable`.
+	
+	Sets of input and output plugs are cached as well. They are rebuilt if an affects
+	relationship changed since, the ``computable`` flag of a plug's attribute though
+	is expected not to change once the class exists"""
+	__slots__ = ( 'plugs', 'static', 'slots', 'classgeneration', '_generation', '_partitions' )
+
+	def __init__( self, nodecls, staticplugs ):
+		""":param staticplugs: plugs as visible on the class, sorted by name"""
+		# all plugs in all dicts of the mro, overridden ones included
+		self.plugs = tuple( v for c in nodecls.mro() for v in c.__dict__.itervalues() if isinstance( v, plug ) )
+		self.static = tuple( staticplugs )
+		# plug -> index of its value in the `_PlugCache` of our nodes
+		self.slots = dict( ( p, i ) for i, p in enumerate( self.plugs ) )
+		self.classgeneration = _NodeBaseCheckMeta._generation
+		self._generation = -1
+		self._partitions = None
+
+	def partition( self, static, predicate ):
+		""":return: tuple of input plugs if predicate is `_providesInput`, a tuple of output plugs
+			otherwise
+		:param static: if True, use the static plugs, all plugs otherwise"""
+		if self._generation != plug._affects_generation:
+			partitions = dict()
+			for isstatic, plugs in ( ( True, self.static ), ( False, self.plugs ) ):
+				partitions[ ( isstatic, _providesInput ) ] = tuple( p for p in plugs if p.providesInput() )
+				partitions[ ( isstatic, _providesOutput ) ] = tuple( p for p in plugs if p.providesOutput() )
+			# END for each plug list
+			self._partitions = partitions
+			self._generation = plug._affects_generation
+		# END rebuild partitions
+		return self._partitions[ ( static, predicate ) ]
+
+	def filter( self, static, predicate ):
+		""":return: list of our plugs matching predicate
+		:param static: if True, use the static plugs, all plugs otherwise"""
+		if predicate is _providesInput or predicate is _providesOutput:
+			return list( self.partition( static, predicate ) )
+		plugs = self.plugs
+		if static:
+			plugs = self.static
+		return [ p for p in plugs if predicate( p ) ]
+
+
+class _PlugCache( object ):
+	"""Stores the cached plug values of a node in a list, using the slot of the plug
+	in the `_PlugTable` of the node's class as index.
+	Plugs unknown to the class, like instance level plugs, are kept in a dict"""
+	__slots__ = ( 'slots', 'values', 'extra' )
+	_nocache = object()			# marks empty slots
+
+	def __init__( self, table ):
+		self.slots = table.slots
+		self.values = [ self._nocache ] * len( table.plugs )
+		self.extra = dict()
+
+	def has( self, plug ):
+		""":return: True if a value is cached for plug"""
+		slot = self.slots.get( plug )
+		if slot is None:
+			return plug in self.extra
+		return self.values[ slot ] is not self._nocache
+
+	def get( self, plug ):
+		""":return: cached value of plug
+		:raise KeyError: if there is no cached value"""
+		slot = self.slots.get( plug )
+		if slot is None:
+			return self.extra[ plug ]
+		value = self.values[ slot ]
+		if value is self._nocache:
+			raise KeyError( plug )
+		return value
+
+	def set( self, plug, value ):
+		"""Cache value for plug"""
+		slot = self.slots.get( plug )
+		if slot is None:
+			self.extra[ plug ] = value
+		else:
+			self.values[ slot ] = value
+
+	def remove( self, plug ):
+		"""Remove the cached value of plug, if there is one"""
+		slot = self.slots.get( plug )
+		if slot is None:
+			self.extra.pop( plug, None )
+		else:
+			self.values[ slot ] = self._nocache
+
+	def clear( self ):
+		"""Remove all cached values"""
+		self.values[:] = [ self._nocache ] * len( self.values )
+		self.extra.clear()
+
+	def size( self ):
+		""":return: size of our storage and the cached values in bytes
+		:note: objects referenced by the values are not taken into account"""
+		nocache = self._nocache
+		size = sys.getsizeof( self.values ) + sys.getsizeof( self.extra )
+		size += sum( sys.getsizeof( v ) for v in self.values if v is not nocache )
+		size += sum( sys.getsizeof( v ) for v in self.extra.itervalues() )
+		return size
+
 
 class _NodeBaseCheckMeta( type ):
 	"""Class checking the consistency of the nodebase class before it is being created"""
+	_generation = 0		# incremented whenever plugs are set on or deleted from node classes
+	
 	def __new__( metacls, name, bases, clsdict ):
 		"""Check:
 			- every plugname must correspond to a node member name
-		"""
+		
+		Additionally, a `_PlugTable` is created for node classes"""
 		newcls = super( _NodeBaseCheckMeta, metacls ).__new__( metacls, name, bases, clsdict )
 
-		# EVERY PLUG NAME MUST MATCH WITH THE ACTUAL NAME IN THE CLASS
-		# set the name according to its slot name in the parent class
-		membersdict = inspect.getmembers( newcls )		# do not filter, as plugs could be overridden
-		try:
-			if hasattr( newcls, "plugsStatic" ):
-				for plug in newcls.plugsStatic( ):
-					for name,member in membersdict:
-						if member == plug and plug.name() != name:
-							# try to set it
-							if hasattr( plug, 'setName' ):
-								plug.setName( name )
-							else:
-								raise AssertionError( "Plug %r is named %s, but must be named %s as in its class %s" % ( plug, plug.name(), name, newcls ) )
-							# END setName special handling
-						# END if member nanme is wrong
-					# END for each class member
-
-					# ignore plugs we possibly did not find in the physical class
-				# END for each plug in class
-			# END if method exists
-		except TypeError:
-			# it can be that a subclass overrides this method and makes it an instance method
-			# this is valid - the rest of the dgengine always accesses this method
-			# through instance - so we have to handle it
-			pass
+		if not hasattr( newcls, "plugsStatic" ):
+			return newcls
 
+		newcls._plugtable = metacls._makePlugTable( newcls )
 		return newcls
 
+	def __setattr__( cls, name, value ):
+		if isinstance( value, plug ) or isinstance( cls.__dict__.get( name ), plug ):
+			_NodeBaseCheckMeta._generation += 1
+		if isinstance( value, plug ) and value.name() != name and hasattr( value, 'setName' ):
+			value.setName( name )
+		super( _NodeBaseCheckMeta, cls ).__setattr__( name, value )
+
+	def __delattr__( cls, name ):
+		if isinstance( cls.__dict__.get( name ), plug ):
+			_NodeBaseCheckMeta._generation += 1
+		super( _NodeBaseCheckMeta, cls ).__delattr__( name )
+
+	@staticmethod
+	def _makePlugTable( nodecls ):
+		""":return: new `_PlugTable` for the given node class, whose plugs will be named 
+			like their class members"""
+		# EVERY PLUG NAME MUST MATCH WITH THE ACTUAL NAME IN THE CLASS
+		# set the name according to its slot name in the parent class
+		membersdict = inspect.getmembers( nodecls )		# do not filter, as plugs could be overridden
+		staticplugs = list()
+		for name,member in membersdict:
+			if not isinstance( member, plug ):
+				continue
+			staticplugs.append( member )
 
+			if member.name() != name:
+				# try to set it
+				if hasattr( member, 'setName' ):
+					member.setName( name )
+				else:
+					raise AssertionError( "Plug %r is named %s, but must be named %s as in its class %s" % ( member, member.name(), name, nodecls ) )
+				# END setName special handling
+			# END if member nanme is wrong
+		# END for each class member
+
+		return _PlugTable( nodecls, staticplugs )
 
 
 class NodeBase( iDuplicatable ):
@@ -1052,6 +1752,12 @@ class NodeBase( iDuplicatable ):
 	shellcls = _PlugShell					# class used to instantiate new shells
 	__metaclass__ = _NodeBaseCheckMeta		# check the class before its being created
 
+	#{ Configuration
+	# if True, compute may be called from worker threads, concurrently to computations
+	# of other nodes, see `Graph.evaluate`
+	thread_safe_compute = False
+	#} END configuration
+
 	#{ Overridden from Object
 	def __init__( self, *args, **kwargs ):
 		"""We require a directed graph to track the connectivity between the plugs.
@@ -1062,6 +1768,7 @@ class NodeBase( iDuplicatable ):
 		:note: we are super() compatible, and assure our base is initialized correctly"""
 		self.graph = None
 		self._id = None
+		self._plugcache = _PlugCache( self._plugTable() )
 
 		# set id
 		newid = kwargs.get( 'id', None )
@@ -1097,9 +1804,8 @@ class NodeBase( iDuplicatable ):
 		"""Just take the graph from other, but do not ( never ) duplicate it
 		
 		:param add_to_graph: if true, the new node instance will be added to the graph of
-		:note: default implementation does not copy plug caches ( which are stored in
-			the node dict - this is because a reevaluate is usually required on the
-			duplicated node"""
+		:note: default implementation does not copy plug caches - this is because
+			a reevaluate is usually required on the duplicated node"""
 		self.setID( other.id() )				# id copying would create equally named clones for now
 		if add_to_graph and other.graph:		# add ourselves to the graph of the other node
 			other.graph.addNode( self )
@@ -1150,9 +1856,32 @@ class NodeBase( iDuplicatable ):
 	def clearCache( self ):
 		"""Clear the cache of all plugs on this node - this basically forces it
 		to recompute the next time an output plug is being queried"""
+		shellcls = getattr( self, 'shellcls' )
+		if isinstance( shellcls, type ) and \
+			shellcls.clearCache.im_func is _PlugShell.__dict__[ 'clearCache' ]:
+			self._plugcache.clear()
+			return
+		# END plain shells
+
+		# custom shells might keep their caches elsewhere
 		for plug in self.plugs( ):
 			self.toShell( plug ).clearCache( clear_affected = False )
 
+	def cacheSize( self ):
+		""":return: amount of bytes used to cache the values of our plugs"""
+		return self._plugcache.size()
+
+	@classmethod
+	def _plugTable( cls ):
+		""":return: `_PlugTable` of our class. It is rebuilt if plugs of any node class 
+			were set or deleted since it was created"""
+		table = cls.__dict__.get( '_plugtable' )
+		if table is None or table.classgeneration != _NodeBaseCheckMeta._generation:
+			table = _NodeBaseCheckMeta._makePlugTable( cls )
+			cls._plugtable = table
+		# END rebuild table
+		return table
+
 	@classmethod
 	def plugsStatic( cls, predicate = lambda x: True ):
 		""":return: list of static plugs as defined on this node - they are class members
@@ -1160,47 +1889,45 @@ class NodeBase( iDuplicatable ):
 		:note: Use this method only if you do not have an instance - there are nodes
 			that actually have no static plug information, but will dynamically generate them.
 			For this to work, they need an instance - thus the plugs method is an instance
-			method and is meant to be the most commonly used one."""
-		pred = lambda m: isinstance( m, plug )
-
-		# END sanity check
-		pluggen = ( m[1] for m in inspect.getmembers( cls, predicate = pred ) if predicate( m[1] ) )
-		return list( pluggen )
+			method and is meant to be the most commonly used one.
+		:note: the class members are gathered into a table which `plugs` and the plug caches 
+			of our instances use as well. Overriding this method does not alter that table, 
+			plugs which are no class members need to be provided by overriding `plugs`"""
+		return cls._plugTable().filter( True, predicate )
 
 	def plugs( self, predicate = lambda x: True ):
 		""":return: list of dynamic plugs as defined on this node - they are usually retrieved
 			on class level, but may be overridden on instance level
 		:param predicate: return static plug only if predicate is true"""
-		# the getmembers function appears to be ... buggy with my classes
-		# use special handling to assure he gets all the instance members AND the class members
-		# In ipython tests this worked as expected - get the dicts individually
-		all_dict_holders = itertools.chain( ( self, ), self.__class__.mro() )
-		all_dicts = ( instance.__dict__ for instance in all_dict_holders )
-		pluggen = ( v for d in all_dicts for v in d.itervalues() if isinstance( v, plug ) and predicate( v ) )
+		# class level plugs come from the plug table, only the instance needs a look
+		outplugs = [ v for v in self.__dict__.itervalues() if isinstance( v, plug ) and predicate( v ) ]
+		if not outplugs:
+			return self._plugTable().filter( False, predicate )
 
-		return list( pluggen )
+		outplugs.extend( self._plugTable().filter( False, predicate ) )
+		return outplugs
 
 	@classmethod
 	def inputPlugsStatic( cls, **kwargs ):
 		""":return: list of static plugs suitable as input
 		:note: convenience method"""
-		return cls.plugsStatic( predicate = lambda p: p.providesInput(), **kwargs )
+		return cls.plugsStatic( predicate = _providesInput, **kwargs )
 
 	def inputPlugs( self, **kwargs ):
 		""":return: list of plugs suitable as input
 		:note: convenience method"""
-		return self.plugs( predicate = lambda p: p.providesInput(), **kwargs )
+		return self.plugs( predicate = _providesInput, **kwargs )
 
 	@classmethod
 	def outputPlugsStatic( cls, **kwargs ):
 		""":return: list of static plugs suitable to deliver output
 		:note: convenience method"""
-		return cls.plugsStatic( predicate = lambda p: p.providesOutput(), **kwargs )
+		return cls.plugsStatic( predicate = _providesOutput, **kwargs )
 
 	def outputPlugs( self, **kwargs ):
 		""":return: list of plugs suitable to deliver output
 		:note: convenience method"""
-		return self.plugs( predicate = lambda p: p.providesOutput(), **kwargs )
+		return self.plugs( predicate = _providesOutput, **kwargs )
 
 	def connections( self, inpt, output ):
 		""":return: Tuples of input shells defining a connection of the given type from
@@ -1231,7 +1958,7 @@ class NodeBase( iDuplicatable ):
 
 	@classmethod
 	def filterCompatiblePlugs( cls, plugs, attrOrValue, raise_on_ambiguity = False, attr_affinity = False,
-							  	attr_as_source=True ):
+							  	attr_as_source=True, rate_cache = None ):
 		""":return: sorted list of (rate,plug) tuples suitable to deal with the given attribute.
 			Thus they could connect to it as well as get their value set.
 			Most suitable plug comes first.
@@ -1249,6 +1976,8 @@ class NodeBase( iDuplicatable ):
 			each plug would need to take its values.
 			if False, attrOrValue is the destination of a connection and it needs to take values of the given plugs
 			or they would connect to it. Only used if attrOrValue is an attribute.
+		:param rate_cache: if not None, a dict keeping the rates of attributes for the given value,
+			see `Attribute.compatabilityRates`. Only used if attrOrValue is a value
 		:raise TypeError: if ambiguous input was found"""
 
 		attribute = None
@@ -1256,8 +1985,15 @@ class NodeBase( iDuplicatable ):
 		if isinstance( attrOrValue, Attribute ):
 			attribute = attrOrValue
 
+		# rate all plugs against the value in one go
+		valuerates = None
+		if not attribute:
+			plugs = list( plugs )
+			valuerates = Attribute.compatabilityRates( ( p.attr for p in plugs ), value, rate_cache )
+		# END value rating
+
 		outSorted = list()
-		for plug in plugs:
+		for i, plug in enumerate( plugs ):
 
 			if attribute:
 				sourceattr = attribute
@@ -1273,7 +2009,7 @@ class NodeBase( iDuplicatable ):
 				# END which affinity type
 			# END attribute rating
 			else:
-				rate = plug.attr.compatabilityRate( value )
+				rate = valuerates[ i ]
 			# END value rating
 
 			if not rate:
@@ -5,26 +5,116 @@ and convert it into an easy-to-use networkx graph with convenience methods.
 __docformat__ = "restructuredtext"
 
 from networkx import DiGraph, NetworkXError
-from util import iterNetworkxGraph
+from util import iterNetworkxGraph, replaceFileAtomically
 from path import make_path
 
 import sys
 import os
 import re
+import mmap
+import hashlib
+import struct
+from array import array
 
 import logging
 log = logging.getLogger("mrv.mdepparse")
 
+def fileStamp( filepath, with_digest = False ):
+	""":return: tuple( mtime, size, digest ) of the given file, digest being the md5 digest
+		of its contents if with_digest is True, or None
+	:raise OSError: if the file does not exist"""
+	filepath = make_path( filepath )
+	st = os.stat( filepath.expandvars() )
+	digest = None
+	if with_digest:
+		digest = filepath.digest( hashlib.md5() )
+	return ( st.st_mtime, st.st_size, digest )
+
+def _parseReferencesInProcess( args ):
+	"""Parse references in a worker process of `MayaFileGraph.addFromFiles`
+	:param args: tuple( graphcls, mafile, allPaths, with_digest )
+	:return: tuple( mafile, references, stamp, None ) or tuple( mafile, None, None, exception ) if
+		parsing failed"""
+	graphcls, mafile, allPaths, with_digest = args
+	try:
+		stamp = fileStamp( mafile, with_digest )
+		return ( mafile, graphcls._parseReferences( mafile, allPaths ), stamp, None )
+	except Exception, e:
+		# whatever happens, the parent needs an answer
+		return ( mafile, None, None, e )
+
+class _ReachabilityIndex( object ):
+	"""Caches the files reachable from a file in either direction, as well as the set of
+	invalid files, to answer queries of the `MayaFileGraph` without traversing it.
+	Closures are computed on first use and dropped once edges leading into them change"""
+	__slots__ = ( 'closures', 'invalid' )
+
+	def __init__( self ):
+		self.closures = ( dict(), dict() )			# per direction: node -> ( ordered files, set of files )
+		self.invalid = None
+
+	def closure( self, graph, node, direction ):
+		""":return: tuple of all files reachable from node in the given direction, in the
+			order they are found when traversing the graph branch first
+		:raise NetworkXError: if node does not exist in graph"""
+		closures = self.closures[ direction ]
+		try:
+			return closures[ node ][0]
+		except KeyError:
+			files = tuple( f for d, f in iterNetworkxGraph( graph, node, direction = direction,
+														ignore_startitem = 1, branch_first = 1, visit_once = 1 ) )
+			closures[ node ] = ( files, frozenset( files ) )
+			return files
+		# END handle cache
+
+	def invalidFiles( self, graph ):
+		""":return: set of invalid files of graph"""
+		if self.invalid is None:
+			self.invalid = frozenset( graph.invalidFiles() )
+		return self.invalid
+
+	def edgesChanged( self, sources, targets ):
+		"""Drop all closures which could have been changed by altered edges from sources to targets"""
+		self.invalid = None
+		for direction, nodes in enumerate( ( sources, targets ) ):
+			if not nodes:
+				continue
+			nodes = set( nodes )
+			closures = self.closures[ direction ]
+			for node in [ n for n, ( files, fileset ) in closures.iteritems()
+							if n in nodes or not fileset.isdisjoint( nodes ) ]:
+				del( closures[ node ] )
+			# END for each closure to drop
+		# END for each direction
+
+	def clear( self ):
+		self.invalid = None
+		for closures in self.closures:
+			closures.clear()
+		# END for each direction
+
+
 class MayaFileGraph( DiGraph ):
 	"""Contains dependnecies between maya files including utility functions
 	allowing to more easily find what you are looking for"""
 	kAffects,kAffectedBy = range( 2 )
 
 	refpathregex = re.compile( '.*-r .*"(.*)";' )
+	# matches the last quoted string of each statement containing a -r flag, across lines
+	refstatementregex = re.compile( r'-r [^;]*"([^"\n]*)";' )
+
+	#{ Configuration
+	# maximum amount of bytes to read when searching the end of the reference section
+	max_header_size = 16 * 1024 * 1024
+	# amount of bytes to read at once when searching the end of the reference section
+	header_block_size = 64 * 1024
+	#} END configuration
 
 	invalidNodeID = "__invalid__"
 	invalidPrefix = ":_iv_:"
 
+	_reachability = None			# the reachability index if enabled
+
 	#{ Edit
 	@classmethod
 	def createFromFiles( cls, fileList, **kwargs ):
@@ -42,11 +132,76 @@ class MayaFileGraph( DiGraph ):
 		"""Add an invalid file to our special location
 		:note: we prefix it to assure it does not popup in our results"""
 		self.add_edge( self.invalidNodeID, self.invalidPrefix + str( invalidfile ) )
+		self._edgesChanged()
+
+	def _edgesChanged( self, sources = tuple(), targets = tuple() ):
+		"""Update the reachability index after the edges from sources to targets have been
+		added or removed"""
+		if self._reachability is not None:
+			self._reachability.edgesChanged( sources, targets )
 
 	@classmethod
 	def _parseReferences( cls, mafile, allPaths = False ):
 		""":return: list of reference strings parsed from the given maya ascii file
-		:raise IOError: if the file could not be read"""
+		:raise IOError: if the file could not be read
+		:note: only the reference section is read, in blocks of header_block_size bytes, until
+			the first requires statement or max_header_size bytes. If allPaths is True,
+			the whole file is mapped into memory and searched"""
+		filehandle = open( os.path.expandvars( mafile ), "rb" )
+		try:
+			if allPaths:
+				try:
+					data = mmap.mmap( filehandle.fileno(), 0, access = mmap.ACCESS_READ )
+				except ( ValueError, EnvironmentError ):
+					data = filehandle.read()	# empty files cannot be mapped
+				# END handle mapping
+			else:
+				data = cls._readHeader( mafile, filehandle )
+			# END handle data source
+
+			return [ match.group(1) for match in cls.refstatementregex.finditer( data ) ]
+		finally:
+			filehandle.close()
+		# END assure file is closed
+
+	@classmethod
+	def _readHeader( cls, mafile, filehandle ):
+		""":return: string with all data of the given file handle up to the first requires statement"""
+		blocks = list()
+		numbytes = 0
+		while numbytes < cls.max_header_size:
+			block = filehandle.read( cls.header_block_size )
+			if not block:
+				break
+
+			if not blocks and block.startswith( "requires" ):
+				return ''
+			# END no reference section
+
+			# search the block including the end of the previous one, the statement could span both
+			prevtail = ''
+			if blocks:
+				prevtail = blocks[-1][-len( "\nrequires" ):]
+			pos = ( prevtail + block ).find( "\nrequires" )
+			if pos > -1:
+				end = pos - len( prevtail )
+				if end < 0:
+					blocks[-1] = blocks[-1][:end]
+				else:
+					blocks.append( block[:end] )
+				return ''.join( blocks )
+			# END found requires
+
+			blocks.append( block )
+			numbytes += len( block )
+		else:
+			log.warn( "Reference section of %s exceeds %i bytes - references past that point are ignored" % ( mafile, cls.max_header_size ) )
+		# END for each block
+		return ''.join( blocks )
+
+	@classmethod
+	def _parseReferencesByLine( cls, mafile, allPaths = False ):
+		"""As `_parseReferences`, but reads the file line by line, which is considerably slower"""
 		outrefs = list()
 		filehandle = open( os.path.expandvars( mafile ), "r" )
 
@@ -80,26 +235,106 @@ class MayaFileGraph( DiGraph ):
 
 		return outrefs
 
-	def _parseDepends( self, mafile, allPaths ):
-		""":return: list of filepath as parsed from the given mafile.
+	def _parseDepends( self, mafile, allPaths, with_digest = False ):
+		""":return: tuple( depends, stamp ) - list of filepath as parsed from the given mafile and
+			the `fileStamp` of mafile, which is None if it could not be parsed
 		:param allPaths: if True, the whole file will be parsed, if False, only
 			the reference section will be parsed"""
 		outdepends = list()
+		stamp = None
 		log.info("Parsing %s" % ( mafile ))
 
 		try:
+			stamp = fileStamp( mafile, with_digest )
 			outdepends = self._parseReferences( mafile, allPaths )
-		except IOError,e:
+		except EnvironmentError,e:
 			# store as invalid
+			stamp = None
 			self._addInvalid( mafile )
 			log.warn("Parsing Failed: %s" % str( e ))
 		# END exception handlign
-		return outdepends
+		return ( outdepends, stamp )
+
+	def _stamps( self ):
+		""":return: dict( dbkey -> `fileStamp` ) of all files parsed into this graph"""
+		return self.graph.setdefault( 'stamps', dict() )
 
+	def _isUpToDate( self, dbkey, osfile ):
+		""":return: True if osfile, stored as dbkey, did not change since it was parsed"""
+		stamp = self._stamps().get( dbkey )
+		if stamp is None:
+			return False
+
+		try:
+			curstamp = fileStamp( osfile )
+		except OSError:
+			return False
+		# END handle missing files
+
+		if curstamp[:2] == stamp[:2]:
+			return True
+
+		# files could have been touched without being changed
+		if stamp[2] is None or curstamp[1] != stamp[1]:
+			return False
+		if fileStamp( osfile, True )[2] != stamp[2]:
+			return False
+
+		self._stamps()[ dbkey ] = curstamp[:2] + stamp[2:]
+		return True
+
+	def _addDepends( self, curfile, curfiledepends, stamp, to_os_path, os_path_to_db_key, incremental ):
+		"""Add edges from the given depends of curfile to the graph
+		:param stamp: `fileStamp` of curfile or None if it could not be parsed
+		:param incremental: if True, previous edges to curfile will be removed
+		:return: list of valid depends, which need to be parsed as well"""
+		curfilestr = str( curfile )
+		curkey = os_path_to_db_key( curfilestr )
+		sources, targets = list(), [ curkey ]
+
+		if incremental and self.has_node( curkey ):
+			# rewire - previous depends could be gone
+			predecessors = self.predecessors( curkey )
+			self.remove_edges_from( [ ( p, curkey ) for p in predecessors ] )
+			sources.extend( predecessors )
+			for p in predecessors:
+				if not self.degree( p ) and p not in self._stamps():
+					self.remove_node( p )
+					targets.append( p )
+					if self.has_node( self.invalidPrefix + p ):
+						self.remove_node( self.invalidPrefix + p )
+				# END remove orphaned depends
+			# END for each previous depend
+		# END handle incremental
+
+		if stamp is None:
+			self._stamps().pop( curkey, None )
+		else:
+			self._stamps()[ curkey ] = stamp
+		# END handle stamp
+
+		valid_depends = list()
+		for depfile in curfiledepends:
+			# only valid files may be adjusted - we keep them as is otherwise
+			dbdepfile = to_os_path( depfile )
+			if os.path.exists( dbdepfile ):
+				valid_depends.append( depfile )				# store the orig path - it will be converted later
+				dbdepfile = os_path_to_db_key( dbdepfile )		# make it db key path
+			else:
+				dbdepfile = depfile								# invalid - revert it
+				self._addInvalid( depfile )						# store it as invalid, no further processing
+
+			self.add_edge( dbdepfile, curkey )
+			sources.append( dbdepfile )
+		# END for each depfile
+
+		self._edgesChanged( sources, targets )
+		return valid_depends
 
 	def addFromFiles( self, mafiles, parse_all_paths = False,
 					to_os_path = lambda f: make_path(f).expandvars(),
-					os_path_to_db_key = lambda f: f):
+					os_path_to_db_key = lambda f: f, num_workers = 0,
+					incremental = False, with_digest = False ):
 		"""Parse the dependencies from the given maya ascii files and add them to
 		this graph
 		
@@ -115,10 +350,22 @@ class MayaFileGraph( DiGraph ):
 		:param os_path_to_db_key: converts the given path as used in the filesystem into
 			a path to be used as key in the database. It should be general.
 			Ideally, os_path_to_db_key is the inverse as to_os_path.
+		:param num_workers: if larger than 1, the files will be parsed by the given amount of
+			processes. References are scheduled for parsing as soon as they are found, the
+			graph is only altered by the calling process
+		:param incremental: if True, files which did not change since they were parsed into this
+			graph will not be parsed again, changed files will get their previous dependencies replaced
+		:param with_digest: if True, the md5 digest of each parsed file is stored along with its
+			modification time and size. Files whose modification time changed, but whose contents
+			are the same, are considered unchanged then
 		:note: if the parsed path contain environment variables you must start the
 			tool such that these can be resolved by the system. Otherwise files might
 			not be found
 		:todo: parse_all_paths still to be implemented"""
+		if num_workers > 1:
+			return self._addFromFilesParallel( mafiles, parse_all_paths, to_os_path, os_path_to_db_key,
+												num_workers, incremental, with_digest )
+
 		files_parsed = set()					 # assure we do not duplicate work
 		for mafile in mafiles:
 			depfiles = [ mafile.strip() ]
@@ -134,38 +381,143 @@ class MayaFileGraph( DiGraph ):
 				if curfile in files_parsed:
 					continue
 
-				curfiledepends = self._parseDepends( curfile, parse_all_paths )
 				files_parsed.add( curfile )
+				if incremental and self._isUpToDate( os_path_to_db_key( str( curfile ) ), curfile ):
+					continue
 
-				# create edges
-				curfilestr = str( curfile )
-				valid_depends = list()
-				for depfile in curfiledepends:
-					print depfile
-					# only valid files may be adjusted - we keep them as is otherwise
-					dbdepfile = to_os_path( depfile )
-					print dbdepfile
-					if os.path.exists( dbdepfile ):
-						valid_depends.append( depfile )				# store the orig path - it will be converted later
-						dbdepfile = os_path_to_db_key( dbdepfile )		# make it db key path
-					else:
-						dbdepfile = depfile								# invalid - revert it
-						self._addInvalid( depfile )						# store it as invalid, no further processing
-
-					self.add_edge( dbdepfile, os_path_to_db_key( curfilestr ) )
+				curfiledepends, stamp = self._parseDepends( curfile, parse_all_paths, with_digest )
 
-				# add to stack and go on
-				depfiles.extend( valid_depends )
+				# create edges and add valid depends to stack and go on
+				depfiles.extend( self._addDepends( curfile, curfiledepends, stamp, to_os_path,
+													os_path_to_db_key, incremental ) )
 			# END dependency loop
 		# END for each file to parse
 
+	def _addFromFilesParallel( self, mafiles, parse_all_paths, to_os_path, os_path_to_db_key,
+								num_workers, incremental, with_digest ):
+		"""As `addFromFiles`, but parses the files using a pool of num_workers processes"""
+		import multiprocessing
+		import Queue
+
+		results = Queue.Queue( )			# receives the results of the workers
+		files_parsed = set()				# files scheduled for parsing
+		num_pending = [ 0 ]
+
+		def schedule( depfiles ):
+			for depfile in depfiles:
+				curfile = to_os_path( depfile )
+
+				# ASSURE MA FILE
+				if os.path.splitext( curfile )[1] != ".ma":
+					log.info( "Skipped non-ma file: %s" % curfile )
+					continue
+				# END assure ma file
+
+				if curfile in files_parsed:
+					continue
+
+				files_parsed.add( curfile )
+				if incremental and self._isUpToDate( os_path_to_db_key( str( curfile ) ), curfile ):
+					continue
+
+				log.info("Parsing %s" % ( curfile ))
+				pool.apply_async( _parseReferencesInProcess, ( ( type( self ), str( curfile ), parse_all_paths, with_digest ), ),
+									callback = results.put )
+				num_pending[0] += 1
+			# END for each file to schedule
+		# END utility
+
+		def handle( result ):
+			"""Add the result of a worker to the graph and schedule the valid depends"""
+			num_pending[0] -= 1
+			curfile, curfiledepends, stamp, error = result
+			if error is not None:
+				if not isinstance( error, EnvironmentError ):
+					raise error
+				# store as invalid
+				self._addInvalid( curfile )
+				log.warn("Parsing Failed: %s" % str( error ))
+				curfiledepends = list()
+			# END handle error
+
+			schedule( self._addDepends( curfile, curfiledepends, stamp, to_os_path, os_path_to_db_key, incremental ) )
+		# END utility
+
+		pool = multiprocessing.Pool( num_workers )
+		try:
+			for mafile in mafiles:
+				schedule( ( mafile.strip(), ) )
+
+				# handle results as they come in, without waiting for them
+				while not results.empty():
+					handle( results.get() )
+			# END for each file to parse
+
+			while num_pending[0]:
+				handle( results.get() )
+			# END for each pending result
+		finally:
+			pool.terminate()
+			pool.join()
+		# END assure pool is shut down
+
+	def update( self, to_os_path = lambda f: make_path(f).expandvars(), **kwargs ):
+		"""Parse all files again which changed since they have been parsed into this graph,
+		replacing their dependencies. Files referencing invalid files which exist by now
+		will be parsed again as well.
+		
+		:param to_os_path: see `addFromFiles`
+		:param kwargs: passed to `addFromFiles`
+		:return: list of database keys of the files that have been checked for changes"""
+		stamps = self._stamps()
+		changed = [ key for key in stamps.keys() if not self._isUpToDate( key, to_os_path( key ) ) ]
+
+		# references which could not be found before
+		for invalid in self.invalidFiles():
+			if not os.path.exists( to_os_path( invalid ) ):
+				continue
+			self.remove_node( self.invalidPrefix + invalid )
+			self._edgesChanged()
+			if not self.has_node( invalid ):
+				continue
+			for key in self.successors( invalid ):
+				stamps.pop( key, None )			# force it to be parsed
+				changed.append( key )
+			# END for each file referencing the invalid one
+		# END for each invalid file
+
+		kwargs[ 'incremental' ] = True
+		self.addFromFiles( changed, to_os_path = to_os_path, **kwargs )
+		return changed
+
+	def setIndexed( self, state = True ):
+		"""Enable or disable the reachability index. If enabled, the files related to a file
+		are cached once they have been retrieved by `depends`. Edits done by `addFromFiles` and
+		`update` only drop the cached results they affect.
+		
+		:note: if the graph is edited directly, the index must be reset using `clearIndex`"""
+		if not state:
+			self._reachability = None
+		elif self._reachability is None:
+			self._reachability = _ReachabilityIndex()
+		# END handle state
+
+	def isIndexed( self ):
+		""":return: True if the reachability index is enabled"""
+		return self._reachability is not None
+
+	def clearIndex( self ):
+		"""Drop all information cached in the reachability index"""
+		if self._reachability is not None:
+			self._reachability.clear()
+
 		#} END edit
 
 	#{ Query
 	def depends( self, filePath, direction = kAffects,
 				   to_os_path = lambda f: os.path.expandvars( f ),
 					os_path_to_db_key = lambda f: f, return_unresolved = False,
-				   invalid_only = False, **kwargs ):
+				   invalid_only = False, leaves_only = False, **kwargs ):
 		""":return: list of paths ( converted to os paths ) that are related to
 			the given filePath
 		:param direction: specifies search direction, either :
@@ -177,15 +529,25 @@ class MayaFileGraph( DiGraph ):
 			a valid key, depending on the format of filepaths stored in this graph
 		:param invalid_only: if True, only invalid dependencies will be returned, all
 			including the invalid ones otherwise
+		:param leaves_only: if True, only files at the end of the dependency chains will be
+			returned, i.e. files which do not affect any file or are not affected by any file
 		:param to_os_path: see `addFromFiles`
 		:param os_path_to_db_key: see `addFromFiles`
-		:param kwargs: passed to `iterNetworkxGraph`"""
+		:param kwargs: passed to `iterNetworkxGraph`
+		:note: uses the reachability index if it is enabled and all dependencies are requested,
+			see `setIndexed`"""
 		kwargs[ 'direction' ] = direction
 		kwargs[ 'ignore_startitem' ] = 1			# default
 		kwargs[ 'branch_first' ] = 1		# default
 
 		keypath = os_path_to_db_key( to_os_path( filePath ) )	# convert key
-		invalid = set( self.invalidFiles() )
+		index = getattr( self, '_reachability', None )
+		use_index = ( index is not None and kwargs.get( 'depth', -1 ) == -1 and kwargs.get( 'visit_once', 1 ) and
+						'prune' not in kwargs and 'stop' not in kwargs )
+
+		if leaves_only:
+			degree = ( direction == self.kAffects and self.out_degree ) or self.in_degree
+		# END leaves only
 
 		if return_unresolved:
 			to_os_path = lambda f: f
@@ -193,7 +555,24 @@ class MayaFileGraph( DiGraph ):
 		outlist = list()
 
 		try:
-			for d, f in iterNetworkxGraph( self, keypath, **kwargs ):
+			if use_index:
+				invalid = index.invalidFiles( self )
+				files = index.closure( self, keypath, direction )
+				if leaves_only:
+					files = [ f for f in files if not degree( f ) ]
+			else:
+				invalid = set( self.invalidFiles() )
+				if leaves_only:
+					userprune = kwargs.get( 'prune' )
+					if userprune is None:
+						kwargs[ 'prune' ] = lambda i, g: degree( i[1] ) != 0
+					else:
+						kwargs[ 'prune' ] = lambda i, g: userprune( i, g ) or degree( i[1] ) != 0
+				# END handle leaves
+				files = ( f for d, f in iterNetworkxGraph( self, keypath, **kwargs ) )
+			# END get files
+
+			for f in files:
 				is_valid = f not in invalid
 				f = to_os_path( f )		# remap only valid paths
 
@@ -220,3 +599,226 @@ class MayaFileGraph( DiGraph ):
 		# END no invalid found exception handling
 	#} END query
 
+	#{ Persistence
+	def writeDatabase( self, filepath ):
+		"""Write this graph into a compact file at the given path which can be read by
+		`MayaFileDatabase`. Paths are stored only once, adjacencies are stored in arrays
+		for both directions, along with the invalid files and the file stamps.
+		
+		:note: isolated nodes are only preserved if they are invalid or parsed files"""
+		db = MayaFileDatabase
+		invalid = self.invalidFiles()
+		stamps = self.graph.get( 'stamps', dict() )
+		nodes = set( n for n in self.nodes_iter()
+					if n != self.invalidNodeID and not n.startswith( self.invalidPrefix ) )
+		nodes.update( invalid )
+		nodes.update( stamps )
+		nodes = sorted( nodes )
+		index = dict( ( n, i ) for i, n in enumerate( nodes ) )
+
+		def uintarray( items ):
+			a = array( 'I', items )
+			if sys.byteorder != 'little':
+				a.byteswap()
+			return a.tostring()
+		# END utility
+
+		def adjacency( adjacentfunc ):
+			offsets, targets = [ 0 ], list()
+			for n in nodes:
+				if self.has_node( n ):
+					targets.extend( index[ a ] for a in adjacentfunc( n ) if a in index )
+				offsets.append( len( targets ) )
+			# END for each node
+			return uintarray( offsets ), uintarray( targets ), len( targets )
+		# END utility
+
+		strings = [ isinstance( n, unicode ) and n.encode( 'utf-8' ) or str( n ) for n in nodes ]
+		stroffsets = [ 0 ]
+		for string in strings:
+			stroffsets.append( stroffsets[-1] + len( string ) )
+		# END for each string
+
+		outoffsets, outtargets, numedges = adjacency( self.successors )
+		inoffsets, intargets, numedges = adjacency( self.predecessors )
+
+		nostamp = db._stampstruct.pack( 0, 0.0, 0, '' )
+		packedstamps = list()
+		for n in nodes:
+			stamp = stamps.get( n )
+			if stamp is None:
+				packedstamps.append( nostamp )
+			else:
+				packedstamps.append( db._stampstruct.pack( 1 + ( stamp[2] is not None ), stamp[0], stamp[1], stamp[2] or '' ) )
+		# END for each node
+
+		def writer( fp ):
+			fp.write( db._headerstruct.pack( db.magic, len( nodes ), numedges, len( invalid ) ) )
+			for section in ( uintarray( stroffsets ), outoffsets, outtargets, inoffsets, intargets,
+							uintarray( sorted( index[ iv ] for iv in invalid ) ) ):
+				fp.write( section )
+			fp.write( ''.join( packedstamps ) )
+			fp.write( ''.join( strings ) )
+		# END writer
+		
+		# readers may have the existing file mapped - truncating it would invalidate
+		# their maps, hence we replace it atomically
+		replaceFileAtomically( filepath, writer )
+	#} END persistence
+
+
+class MayaFileDatabase( object ):
+	"""Read-only dependency information as written by `MayaFileGraph.writeDatabase`.
+	
+	The file is memory mapped and only read on demand, hence it can be queried right
+	away, independently of its size. It provides the query interface of the
+	`MayaFileGraph`, use `toGraph` to get a graph which can be altered."""
+	kAffects, kAffectedBy = MayaFileGraph.kAffects, MayaFileGraph.kAffectedBy
+
+	magic = "MFGDB001"
+	_headerstruct = struct.Struct( "<8sIII" )		# magic, num nodes, num edges, num invalid
+	_stampstruct = struct.Struct( "<Bdq16s" )		# flag, mtime, size, digest
+
+	def __init__( self, filepath ):
+		""":raise ValueError: if the file at filepath is no dependency database"""
+		fp = open( filepath, 'rb' )
+		try:
+			try:
+				self._map = mmap.mmap( fp.fileno(), 0, access = mmap.ACCESS_READ )
+			except ( ValueError, EnvironmentError ):
+				raise ValueError( "Could not map dependency database at %s" % filepath )
+			# END handle empty files
+		finally:
+			fp.close()
+		# END assure file gets closed
+
+		if len( self._map ) < self._headerstruct.size or self._map[ : len( self.magic ) ] != self.magic:
+			raise ValueError( "%s is not a dependency database" % filepath )
+
+		magic, self._numnodes, self._numedges, self._numinvalid = self._headerstruct.unpack_from( self._map, 0 )
+
+		# compute section offsets
+		nodetablesize = ( self._numnodes + 1 ) * 4
+		edgetablesize = self._numedges * 4
+		self._stroffsets = self._headerstruct.size
+		self._outoffsets = self._stroffsets + nodetablesize
+		self._outtargets = self._outoffsets + nodetablesize
+		self._inoffsets = self._outtargets + edgetablesize
+		self._intargets = self._inoffsets + nodetablesize
+		self._invalid = self._intargets + edgetablesize
+		self._stamptable = self._invalid + self._numinvalid * 4
+		self._strings = self._stamptable + self._numnodes * self._stampstruct.size
+
+		# the string table ends the file, incomplete files are too short to hold it
+		if len( self._map ) < self._strings or \
+			len( self._map ) != self._strings + struct.unpack_from( "<I", self._map, self._outoffsets - 4 )[0]:
+			self._map.close()
+			raise ValueError( "Dependency database at %s is incomplete" % filepath )
+		# END check size
+
+	@classmethod
+	def isDatabase( cls, filepath ):
+		""":return: True if the file at filepath was written by `MayaFileGraph.writeDatabase`"""
+		fp = open( filepath, 'rb' )
+		try:
+			return fp.read( len( cls.magic ) ) == cls.magic
+		finally:
+			fp.close()
+		# END assure file gets closed
+
+	#{ Internals
+	def _uints( self, offset, count ):
+		return struct.unpack_from( "<%iI" % count, self._map, offset )
+
+	def _string( self, index ):
+		start, end = struct.unpack_from( "<II", self._map, self._stroffsets + index * 4 )
+		return self._map[ self._strings + start : self._strings + end ]
+
+	def _index( self, node ):
+		""":return: index of the given node or -1 if it does not exist"""
+		lo, hi = 0, self._numnodes
+		while lo < hi:
+			mid = ( lo + hi ) // 2
+			if self._string( mid ) < node:
+				lo = mid + 1
+			else:
+				hi = mid
+		# END binary search
+		if lo < self._numnodes and self._string( lo ) == node:
+			return lo
+		return -1
+
+	def _adjacent( self, node, offsets, targets ):
+		index = self._index( node )
+		if index < 0:
+			raise NetworkXError( "The node %s is not in the graph." % node )
+		start, end = self._uints( offsets + index * 4, 2 )
+		return [ self._string( i ) for i in self._uints( targets + start * 4, end - start ) ]
+	#} END internals
+
+	#{ Query
+	# only requires successors, predecessors and invalidFiles
+	depends = MayaFileGraph.depends.im_func
+
+	def successors( self, node ):
+		""":return: list of files affected by node
+		:raise NetworkXError: if the node does not exist"""
+		return self._adjacent( node, self._outoffsets, self._outtargets )
+
+	def predecessors( self, node ):
+		""":return: list of files affecting node
+		:raise NetworkXError: if the node does not exist"""
+		return self._adjacent( node, self._inoffsets, self._intargets )
+
+	def out_degree( self, node ):
+		return len( self.successors( node ) )
+
+	def in_degree( self, node ):
+		return len( self.predecessors( node ) )
+
+	def has_node( self, node ):
+		return self._index( node ) > -1
+
+	__contains__ = has_node
+
+	def __len__( self ):
+		return self._numnodes
+
+	def nodes( self ):
+		""":return: list of all files in the database, sorted by name"""
+		return [ self._string( i ) for i in xrange( self._numnodes ) ]
+
+	def edges( self ):
+		""":return: list of ( file, affected file ) tuples"""
+		strings = self.nodes()
+		offsets = self._uints( self._outoffsets, self._numnodes + 1 )
+		targets = self._uints( self._outtargets, self._numedges )
+		return [ ( strings[ i ], strings[ t ] ) for i in xrange( self._numnodes )
+											for t in targets[ offsets[ i ] : offsets[ i + 1 ] ] ]
+
+	def invalidFiles( self ):
+		""":return: list of filePaths that could not be parsed"""
+		return [ self._string( i ) for i in self._uints( self._invalid, self._numinvalid ) ]
+	#} END query
+
+	#{ Conversion
+	def toGraph( self ):
+		""":return: `MayaFileGraph` with all the information stored in this database"""
+		graph = MayaFileGraph()
+		graph.add_edges_from( self.edges() )
+		for invalid in self.invalidFiles():
+			graph._addInvalid( invalid )
+		# END for each invalid file
+
+		stamps = graph._stamps()
+		for i, node in enumerate( self.nodes() ):
+			flag, mtime, size, digest = self._stampstruct.unpack_from( self._map, self._stamptable + i * self._stampstruct.size )
+			if flag:
+				stamps[ node ] = ( mtime, size, ( flag == 2 and digest ) or None )
+		# END for each node
+		return graph
+	#} END conversion
+
+	def close( self ):
+		"""Release the memory map, the database cannot be used afterwards"""
+		self._map.close()
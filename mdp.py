@@ -10,8 +10,12 @@ from mdepparse import *
 from networkx.readwrite import gpickle
 
 from itertools import chain
+import SocketServer
+import threading
 import getopt
+import shlex
 import sys
+import os
 
 
 
@@ -34,13 +38,15 @@ EDIT
 -----
 -t	Target file used to store the parsed dependency information
 	If not given, the command will automatically be in query mode.
-	The file format is simply a pickle of the underlying Networkx graph
+	The file is a compact database which can be queried without reading it entirely
 
 -s	Source dependency file previously written with -t. If specified, this file
 	will be read to quickly be read for queries. If not given, the information
 	will be parsed first. Thus it is recommended to have a first run storing
 	the dependencies and do all queries just reading in the dependencies using
 	-s
+	Files written by previous versions, being a pickle of the underlying networkx graph,
+	can be read as well
 
 -i	if given, a list of input files will be read from stdin. The tool will start
 	parsing the files as the come through the pipe
@@ -49,6 +55,16 @@ EDIT
 	than just parsing references as the whole file needs to be read
 	TODO: actual implementation
 
+-j int	amount of processes to parse the files with, default 1
+
+-u	update the dependency file read with -s. Only files which changed since they
+	were parsed will be parsed again, as well as files referencing previously
+	invalid files which exist by now. Use -t to store the result
+
+--digest	store the md5 digest of each parsed file. Files whose modification time
+	changed, but whose contents did not, will not be parsed again when updating
+	with -u
+
 --to-fs-map	tokenmap
 	map one part of the path to another in order to make it a valid path
 	in the filesystem, i.e:
@@ -97,6 +113,17 @@ All values returned in query mode will be new-line separated file paths
 
 -v				enable more verbose output
 
+SERVER
+------
+--serve socket	load the dependency file given with -s once and answer queries sent to the
+				unix domain socket at the given path. Each request is a single line with
+				query flags and input files as given on the commandline, i.e.
+				--affects -l -d 1 "file.ma" "other file.ma"
+				Supported flags are --affects, --affected-by, -l, -d, -b and -e. The response
+				consists of the newline separated file paths, terminated by an empty line.
+				Invalid requests are answered with a single line starting with "error: ".
+				The dependency file is read again once it changes on disk
+
 """)
 	if msg:
 		sys.stdout.write(msg+"\n")
@@ -125,13 +152,145 @@ def tokensToRemapFunc( tokenstring ):
 
 
 
+def readGraph( sourceFile ):
+	""":return: `MayaFileDatabase` or `MayaFileGraph` with the dependency information
+		stored in the given file, depending on its format"""
+	if MayaFileDatabase.isDatabase( sourceFile ):
+		return MayaFileDatabase( sourceFile )
+	return gpickle.read_gpickle( sourceFile )
+
+
+class QueryServer( SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer ):
+	"""Answers dependency queries sent to a unix domain socket, one request per line.
+	Each connection is served by its own thread, so clients may keep their connection 
+	open. Requests are answered one after another though, the dependency file is read 
+	again before answering a request if it changed since it was loaded.
+	
+	:note: see the SERVER section of the usage for the protocol"""
+	shortflags = "ld:be"
+	longflags = [ "affects", "affected-by" ]
+	daemon_threads = True		# open connections do not keep us alive
+
+	def __init__( self, socketpath, sourceFile, **kwargs_query ):
+		""":param kwargs_query: passed to `MayaFileGraph.depends`"""
+		self.sourceFile = sourceFile
+		self.kwargs_query = kwargs_query
+		self.graph = None
+		self._stamp = None
+		self._lock = threading.Lock()		# serializes answers, the graph is not thread-safe
+		SocketServer.UnixStreamServer.__init__( self, socketpath, _QueryHandler )
+
+	def server_close( self ):
+		SocketServer.UnixStreamServer.server_close( self )
+		try:
+			os.remove( self.server_address )
+		except OSError:
+			pass
+		# END remove socket file
+
+	def loadGraph( self ):
+		""":return: graph with the dependency information of our source file, which is
+			read again if it changed. If it cannot be read, for instance because it is
+			being written, the previously loaded graph is returned and the file will be
+			read again on the next call
+		:raise ValueError: if the file could not be read and no graph was loaded yet"""
+		try:
+			st = os.stat( self.sourceFile )
+			stamp = ( st.st_mtime, st.st_size, st.st_ino )
+			if stamp == self._stamp:
+				return self.graph
+			graph = readGraph( self.sourceFile )
+		except Exception, e:
+			# incomplete files fail in many different ways, depending on their format
+			if self.graph is None:
+				raise ValueError( "Could not read %s: %s" % ( self.sourceFile, e ) )
+			sys.stderr.write( "Could not reload %s, using previous version: %s\n" % ( self.sourceFile, e ) )
+			return self.graph
+		# END handle unreadable files
+
+		if isinstance( self.graph, MayaFileDatabase ):
+			self.graph.close()
+		self.graph = graph
+		if isinstance( self.graph, MayaFileGraph ):
+			self.graph.setIndexed()			# repeated queries are the common case
+		self._stamp = stamp
+		return self.graph
+
+	def answer( self, request ):
+		""":return: list of result lines for the given request line
+		:raise ValueError: if the request is invalid
+		:note: not thread-safe, connection handlers call it while holding our lock"""
+		try:
+			opts, filelist = getopt.getopt( shlex.split( request ), self.shortflags, self.longflags )
+		except getopt.GetoptError, e:
+			raise ValueError( str( e ) )
+		# END handle invalid flags
+
+		opts = dict( opts )
+		graph = self.loadGraph()
+		return_invalid = "-b" in opts
+		if not filelist:
+			if return_invalid:
+				return graph.invalidFiles()
+			return list()
+		# END handle invalid files
+
+		try:
+			depth = int( opts.get( "-d", -1 ) )
+		except ValueError:
+			raise ValueError( "-d must be followed by a number" )
+		# END handle depth
+
+		out = list()
+		for flag, direction in ( ( "--affects", MayaFileGraph.kAffects ),
+								( "--affected-by", MayaFileGraph.kAffectedBy ) ):
+			if flag not in opts:
+				continue
+
+			for filepath in filelist:
+				prefix = ""
+				if "-e" in opts:
+					prefix = "%s->" % filepath
+
+				depends = graph.depends( filepath, direction = direction, leaves_only = "-l" in opts,
+										depth = depth, invalid_only = return_invalid, **self.kwargs_query )
+				out.extend( prefix + dep for dep in depends )
+			# END for each file
+		# END for each direction
+		return out
+
+
+class _QueryHandler( SocketServer.StreamRequestHandler ):
+	"""Answers all requests sent through one connection"""
+
+	def handle( self ):
+		for request in iter( self.rfile.readline, '' ):
+			self.server._lock.acquire()
+			try:
+				try:
+					lines = self.server.answer( request.strip() )
+				except Exception, e:
+					# no request may end the connection
+					lines = [ "error: %s" % str( e ).replace( "\n", " " ) ]
+				# END handle failed requests
+			finally:
+				self.server._lock.release()
+			# END assure lock is released
+
+			self.wfile.writelines( l + "\n" for l in lines )
+			self.wfile.write( "\n" )
+			self.wfile.flush()
+		# END for each request
+
+
 # COMMAND LINE INTERFACE
 ############################
 if __name__ == "__main__":
 	# parse the arguments as retrieved from the command line !
 	try:
-		opts, rest = getopt.getopt( sys.argv[1:], "iat:s:ld:benvo:", [ "affects", "affected-by",
-								   										"to-fs-map=","to-db-map=" ] )
+		opts, rest = getopt.getopt( sys.argv[1:], "iat:s:ld:benvo:j:u", [ "affects", "affected-by",
+								   										"to-fs-map=","to-db-map=", "digest",
+																				"serve=" ] )
 	except getopt.GetoptError,e:
 		_usageAndExit( str( e ) )
 
@@ -146,6 +305,8 @@ if __name__ == "__main__":
 	#####################
 	allpaths = "-a" in opts
 	kwargs_creategraph = dict( ( ( "parse_all_paths", allpaths ), ) )
+	kwargs_creategraph[ 'num_workers' ] = int( opts.get( "-j", 1 ) )
+	kwargs_creategraph[ 'with_digest' ] = "--digest" in opts
 	kwargs_query = dict()
 
 	# PATH REMAPPING
@@ -172,6 +333,27 @@ if __name__ == "__main__":
 
 	targetFile = opts.get( "-t", None )
 	sourceFile = opts.get( "-s", None )
+	dotOutputFile = opts.get( "-o", None )
+	update = "-u" in opts
+	if update and not sourceFile:
+		_usageAndExit( "-u requires a dependency file given with -s" )
+
+
+	# SERVER MODE
+	##############
+	if "--serve" in opts:
+		if not sourceFile:
+			_usageAndExit( "--serve requires a dependency file given with -s" )
+
+		server = QueryServer( opts[ "--serve" ], sourceFile, **kwargs_query )
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		# END handle interrupt
+		server.server_close()
+		sys.exit( 0 )
+	# END server mode
 
 
 	# GET DEPENDS
@@ -184,7 +366,17 @@ if __name__ == "__main__":
 	else:
 		if verbose:
 			sys.stdout.write("Reading dependencies from: %s\n" % sourceFile)
-		graph = gpickle.read_gpickle( sourceFile )
+		graph = readGraph( sourceFile )
+
+		# edits and the dot output need the whole graph
+		if isinstance( graph, MayaFileDatabase ) and ( update or targetFile or dotOutputFile ):
+			graph = graph.toGraph()
+
+		if update:
+			updated = graph.update( **kwargs_creategraph )
+			if verbose:
+				sys.stdout.write("Updated %i changed files\n" % len( updated ))
+		# END update
 
 
 
@@ -194,7 +386,7 @@ if __name__ == "__main__":
 	if targetFile:
 		if verbose:
 			sys.stdout.write("Saving dependencies to %s\n" % targetFile)
-		gpickle.write_gpickle( graph, targetFile )
+		graph.writeDatabase( targetFile )
 
 
 	# QUERY MODE
@@ -204,7 +396,6 @@ if __name__ == "__main__":
 	as_edge = "-e" in opts
 	nice_mode = "-n" in opts
 	dotgraph = None
-	dotOutputFile = opts.get( "-o", None )
 	kwargs_query[ 'invalid_only' ] = return_invalid		# if given, filtering for invalid only is enabled
 
 	if dotOutputFile:
@@ -216,12 +407,6 @@ if __name__ == "__main__":
 		if not flag in opts:
 			continue
 
-		# PREPARE LEAF FUNCTION
-		prune = lambda i,g: False
-		if "-l" in opts:
-			degreefunc = ( ( direction == MayaFileGraph.kAffects ) and MayaFileGraph.out_degree ) or MayaFileGraph.in_degree
-			prune = lambda i,g: degreefunc( g, i ) != 0
-
 		listcopy = list()			# as we read from iterators ( stdin ), its required to copy it to iterate it again
 
 
@@ -230,7 +415,7 @@ if __name__ == "__main__":
 			listcopy.append( filepath )
 			queried_files = True			# used as flag to determine whether filers have been applied or not
 			filepath = filepath.strip()		# could be from stdin
-			depends = graph.depends( filepath, direction = direction, prune = prune,
+			depends = graph.depends( filepath, direction = direction, leaves_only = "-l" in opts,
 									   	visit_once=1, branch_first=1, depth=depth,
 										return_unresolved=0, **kwargs_query )
 
@@ -33,16 +33,21 @@ __license__='Freeware'
 import sys
 import logging
 import os
+import stat
 import fnmatch
 import glob
 import shutil
 import codecs
 import re
+import mmap
+import cPickle
+import hashlib
 from interface import iDagItem
+from util import replaceFileAtomically
 log = logging.getLogger("mrv.path")
 
 __version__ = '3.0'
-__all__ = ['Path', 'BasePath', 'make_path']
+__all__ = ['Path', 'BasePath', 'make_path', 'DigestCache']
 
 # Platform-specific support for path.owner
 if os.name == 'nt':
@@ -56,6 +61,15 @@ else:
 	except ImportError:
 		pwd = None
 
+# scandir provides the type of directory entries without additional stat calls
+_scandir = getattr(os, 'scandir', None)
+if _scandir is None:
+	try:
+		from scandir import scandir as _scandir
+	except ImportError:
+		_scandir = None
+# END handle scandir availability
+
 # Pre-2.3 support.	Are unicode filenames supported?
 _base = str
 _getcwd = os.getcwd
@@ -485,7 +499,7 @@ class Path( _base, iDagItem ):
 
 		return [p for p in self.listdir(pattern) if p.isfile()]
 
-	def walk(self, pattern=None, errors='strict', predicate=lambda p: True):
+	def walk(self, pattern=None, errors='strict', predicate=lambda p: True, workers=0, ordered=True):
 		"""create iterator over files and subdirs, recursively.
 
 		The iterator yields path objects naming each child item of
@@ -493,6 +507,9 @@ class Path( _base, iDagItem ):
 
 		It performs a depth-first traversal of the directory tree.
 		Each directory is returned just before all its children.
+		
+		The type of each entry is obtained while listing its directory, which 
+		requires no additional system call per entry if the scandir module is available.
 
 		:param pattern: fnmatch compatible pattern or None
 		:param errors: controls behavior when an
@@ -500,64 +517,148 @@ class Path( _base, iDagItem ):
 			exception.	The other allowed values are 'warn', which
 			reports the error via log.warn(), and 'ignore'.
 		:param predicate: returns True for each Path p to be yielded by iterator
+		:param workers: if larger than 0, directories will be listed by the given amount
+			of threads in advance. This is beneficial on network shares with high latency.
+		:param ordered: if True, the items will be yielded in the same order as without 
+			workers. Otherwise, the contents of directories are yielded in the order 
+			in which their listing completed. Only used if workers is larger than 0.
 		"""
+		return self._walk(pattern, errors, predicate, None, workers, ordered)
+
+	def walkdirs(self, pattern=None, errors='strict', predicate=lambda p: True, workers=0, ordered=True):
+		""" D.walkdirs() -> iterator over subdirs, recursively.
+		see `walk` for a parameter description """
+		return self._walk(pattern, errors, predicate, 'dir', workers, ordered)
+
+	def walkfiles(self, pattern=None, errors='strict', predicate=lambda p: True, workers=0, ordered=True):
+		""" D.walkfiles() -> iterator over files in D, recursively.
+		see `walk` for a parameter description"""
+		return self._walk(pattern, errors, predicate, 'file', workers, ordered)
+		
+	def _walk(self, pattern, errors, predicate, filetype, workers, ordered):
+		"""Implements `walk`, yielding only directories or files if filetype is 'dir'
+		or 'file' respectively"""
 		if errors not in ('strict', 'warn', 'ignore'):
 			raise ValueError("invalid errors parameter")
-
-		try:
-			childList = self.listdir()
-		except Exception:
-			if errors == 'ignore':
-				return
-			elif errors == 'warn':
+			
+		def entries(dirpath, result):
+			""":return: entries of the given listing result, handle errors"""
+			entrylist, excinfo = result
+			if excinfo is None:
+				return entrylist
+			if errors == 'warn':
 				log.warn(
 					"Unable to list directory '%s': %s"
-					% (self, sys.exc_info()[1]))
-				childList = list()
-			else:
-				raise
+					% (dirpath, excinfo[1]))
+			elif errors == 'strict':
+				raise excinfo[0], excinfo[1], excinfo[2]
 			# END handle errors value
-		# END listdir exception handling
-
-		for child in childList:
-			if ( pattern is None or child.fnmatch(pattern) ) and predicate(child):
-				yield child
-				
-			try:
-				isdir = child.isdir()
-			except Exception:
-				isdir = False
-				if errors == 'ignore':
-					pass
-				elif errors == 'warn':
-					log.warn(
-						"Unable to access '%s': %s"
-						% (child, sys.exc_info()[1]))
+			return tuple()
+		# END utility
+		
+		def children(dirpath, entrylist):
+			"""yield ( name, childpath, is_to_be_yielded, isdir ) tuples"""
+			# equals dirpath / name, but joining strings once per directory is faster
+			cls = dirpath.__class__
+			prefix = _base(dirpath / '')
+			for name, isdir, isfile in entrylist:
+				matches = ( filetype is None or ( filetype == 'dir' and isdir ) or ( filetype == 'file' and isfile ) )
+				if matches and pattern is not None:
+					if '$' in name:
+						# names must be matched with expanded variables
+						matches = ( dirpath / name ).fnmatch(pattern)
+					else:
+						matches = fnmatch.fnmatch(name, pattern)
+					# END handle variables
+				# END match pattern
+				if not ( matches or isdir ):
+					continue
+				child = cls(prefix + name)
+				yield name, child, matches and predicate(child), isdir
+			# END for each entry
+		# END utility
+		
+		rootospath = self._expandvars(self)
+		if workers < 1:
+			# depth first, using an explicit stack instead of recursive generators 
+			stack = [ ( rootospath, children(self, entries(self, _scanDirectory(rootospath))) ) ]
+			while stack:
+				ospath, childiter = stack[-1]
+				for name, child, yieldchild, isdir in childiter:
+					if yieldchild:
+						yield child
+					if isdir:
+						childospath = os.path.join(ospath, name)
+						stack.append(( childospath, children(child, entries(child, _scanDirectory(childospath))) ))
+						break
+					# END descend into directory
 				else:
-					raise
-				# END handle errors value
-			# END directory access exception handling
-			
-			if not isdir:
-				continue
+					stack.pop()
+				# END handle exhausted directory
+			# END while there are directories
+			return
+		# END serial walk
+		
+		from multiprocessing.pool import ThreadPool
+		import Queue
+		pool = ThreadPool(workers)
+		try:
+			if ordered:
+				# depth first, but the listings of subdirectories are requested
+				# as soon as a directory is listed
+				def listing(dirpath, ospath, request):
+					entrylist = entries(dirpath, request.get())
+					requests = dict()
+					for name, isdir, isfile in entrylist:
+						if isdir:
+							requests[name] = pool.apply_async(_scanDirectory, (os.path.join(ospath, name), ))
+					# END for each entry
+					return ospath, requests, children(dirpath, entrylist)
+				# END utility
 				
-			for item in child.walk(pattern, errors, predicate):
-				yield item
-			# END for each item
-		# END for each child in childlist
-
-	def walkdirs(self, pattern=None, errors='strict', predicate=lambda p: True):
-		""" D.walkdirs() -> iterator over subdirs, recursively.
-		see `walk` for a parameter description """
-		pred = lambda p: p.isdir() and predicate(p)
-		return self.walk(pattern, errors, pred)
+				stack = [ listing(self, rootospath, pool.apply_async(_scanDirectory, (rootospath, ))) ]
+				while stack:
+					ospath, requests, childiter = stack[-1]
+					for name, child, yieldchild, isdir in childiter:
+						if yieldchild:
+							yield child
+						if isdir:
+							stack.append(listing(child, os.path.join(ospath, name), requests.pop(name)))
+							break
+						# END descend into directory
+					else:
+						stack.pop()
+					# END handle exhausted directory
+				# END while there are directories
+			else:
+				# directories are handled in the order in which their listing completed
+				results = Queue.Queue()
+				def request(dirpath, ospath):
+					def done(result):
+						results.put(( dirpath, ospath, result ))
+					pool.apply_async(_scanDirectory, (ospath, ), callback=done)
+				# END utility
+				
+				request(self, rootospath)
+				numpending = 1
+				while numpending:
+					dirpath, ospath, result = results.get()
+					numpending -= 1
+					for name, child, yieldchild, isdir in children(dirpath, entries(dirpath, result)):
+						if yieldchild:
+							yield child
+						if isdir:
+							request(child, os.path.join(ospath, name))
+							numpending += 1
+						# END request listing of directory
+					# END for each child
+				# END while there are pending listings
+			# END handle order
+		finally:
+			pool.terminate()
+			pool.join()
+		# END assure pool is shut down
 
-	def walkfiles(self, pattern=None, errors='strict', predicate=lambda p: True):
-		""" D.walkfiles() -> iterator over files in D, recursively.
-		see `walk` for a parameter description"""
-		pred = lambda p: p.isfile() and predicate(p)
-		return self.walk(pattern, errors, pred)
-		
 	def fnmatch(self, pattern):
 		""" Return True if self.basename() matches the given pattern.
 
@@ -829,25 +930,97 @@ class Path( _base, iDagItem ):
 		else:
 			return self.text(encoding, errors).splitlines(retain)
 
-	def digest(self, hashobject):
+	def digest(self, hashobject, cache=None, buffersize=None, use_mmap=False):
 		""" Calculate the  hash for this file using the given hashobject. It must 
 		support the 'update' and 'digest' methods.
-
-		:note: This reads through the entire file.
+		
+		:param cache: if not None, a `DigestCache` instance. If it contains a digest 
+			for this file in its current state, it will be returned without reading the file, 
+			otherwise the computed digest will be stored in the cache. Only hashobjects 
+			of the hashlib module which did not receive any data yet can be cached.
+		:param buffersize: amount of bytes to read at once, defaults to the module's 
+			digest_buffer_size
+		:param use_mmap: if True, the file will be memory mapped and passed to 
+			the hashobject at once instead of being read in chunks
+		:note: This reads through the entire file unless the digest was cached. 
+			In that case, the hashobject does not receive any data.
 		"""
-
-		f = self.open('rb')
+		ospath = self._expandvars(self)
+		if cache is not None:
+			key = cache._key(ospath, hashobject)
+			digest = cache._lookup(key)
+			if digest is not None:
+				return digest
+			# END cache hit
+		# END query cache
+		
+		f = open(ospath, 'rb')
 		try:
-			while True:
-				d = f.read(8192)
-				if not d:
-					break
-				hashobject.update(d)
+			fed = False
+			if use_mmap:
+				try:
+					m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				except (ValueError, EnvironmentError):
+					# empty files cannot be mapped
+					pass
+				else:
+					try:
+						hashobject.update(m)
+						fed = True
+					finally:
+						m.close()
+				# END handle mapping
+			# END use mmap
+			
+			if not fed:
+				buffersize = buffersize or digest_buffer_size
+				while True:
+					d = f.read(buffersize)
+					if not d:
+						break
+					hashobject.update(d)
+				# END for each chunk
+			# END read chunks
 		finally:
 			f.close()
 		# END assure file gets closed
 		
-		return hashobject.digest()
+		digest = hashobject.digest()
+		if cache is not None:
+			cache._store(key, ospath, digest)
+		return digest
+		
+	@classmethod
+	def digest_many(cls, paths, hashfactory, workers=0, cache=None, buffersize=None, use_mmap=False):
+		"""Calculate the digests of the given files
+		
+		:param paths: iterable of paths or strings
+		:param hashfactory: callable returning a new hashobject, like hashlib.md5
+		:param workers: if larger than 0, the files will be hashed by the given 
+			amount of threads in parallel.
+		:param cache, buffersize, use_mmap: see `digest`
+		:return: iterator yielding ( Path, digest ) tuples in the order of the paths
+		:raise IOError: if a file could not be read"""
+		def digest(path):
+			path = cls(path)
+			return path, path.digest(hashfactory(), cache, buffersize, use_mmap)
+		# END utility
+		
+		if workers < 1:
+			for path in paths:
+				yield digest(path)
+			return
+		# END serial
+		
+		from multiprocessing.pool import ThreadPool
+		pool = ThreadPool(workers)
+		try:
+			for item in pool.imap(digest, paths):
+				yield item
+		finally:
+			pool.terminate()
+			pool.join()
+		# END assure pool is shut down
 
 	#} END Reading or writing an enitre file at once
 
@@ -1162,10 +1335,159 @@ class Path( _base, iDagItem ):
 _ossep = os.path.sep
 _oossep = (_ossep == "/" and "\\") or "/"
 
+# amount of bytes to read at once when computing digests
+digest_buffer_size = 1024 * 1024
+
 def _to_os_path(path):
 	""":return: string being an os compatible path"""
 	return path.replace(_oossep, _ossep)
 	
+def _scanDirectory(ospath):
+	"""List the given directory, determining the type of each entry
+	
+	:return: tuple( list of ( name, isdir, isfile ) tuples, None ) or tuple( None, exc_info )
+		if the directory could not be listed. Symbolic links are followed, entries
+		which cannot be accessed are neither directories nor files"""
+	entrylist = list()
+	try:
+		if _scandir is not None:
+			for entry in _scandir(ospath):
+				try:
+					isdir = entry.is_dir()
+					isfile = not isdir and entry.is_file()
+				except OSError:
+					isdir = isfile = False
+				# END handle inaccessible entries
+				entrylist.append(( entry.name, isdir, isfile ))
+			# END for each entry
+		else:
+			# one stat per entry provides all information
+			prefix = os.path.join(ospath, '')
+			for name in os.listdir(ospath):
+				try:
+					mode = os.stat(prefix + name).st_mode
+				except OSError:
+					entrylist.append(( name, False, False ))
+					continue
+				# END handle inaccessible entries
+				entrylist.append(( name, stat.S_ISDIR(mode), stat.S_ISREG(mode) ))
+			# END for each name
+		# END handle scandir availability
+	except Exception:
+		return None, sys.exc_info()
+	# END exception handling
+	return entrylist, None
+	
+
+class DigestCache(object):
+	"""Keeps digests of files, allowing them to be retrieved without reading the file
+	as long as it did not change.
+	
+	Digests are keyed by the device, inode, size and modification time of the file 
+	and the name of the hash algorithm, and can be stored in a file to be reused
+	by subsequent processes. For each file and hash algorithm, only the latest 
+	digest is kept."""
+	__slots__ = ('_filepath', '_entries', '_changed')
+	
+	# increment if the layout of the cache file changes
+	version = 1
+	
+	def __init__(self, filepath=None):
+		""":param filepath: path to the file keeping the cache. If it exists, the cache
+			will be initialized with its contents, unless it cannot be read. If None, 
+			the cache will only exist in memory"""
+		self._filepath = filepath
+		self._entries = dict()		# ( dev, inode, hashname ) -> ( size, mtime, digest )
+		self._changed = False
+		if filepath is not None and os.path.isfile(filepath):
+			try:
+				fp = open(filepath, 'rb')
+				try:
+					version, entries = cPickle.load(fp)
+				finally:
+					fp.close()
+				if version == self.version:
+					self._entries = entries
+			except Exception:
+				log.warn("Could not read digest cache at %s - it will be recreated" % filepath)
+			# END exception handling
+		# END read existing cache
+		
+	def __len__(self):
+		return len(self._entries)
+		
+	def _key(self, ospath, hashobject):
+		""":return: tuple identifying the file at the given path in its current state
+			and the type of the hashobject, or None if the digest of the hashobject
+			cannot be cached"""
+		name = getattr(hashobject, 'name', None)
+		if name is None:
+			return None
+		try:
+			# the cached digest only applies if the hashobject is untouched
+			if hashlib.new(name).digest() != hashobject.digest():
+				return None
+		except ValueError:
+			return None
+		# END exception handling
+		try:
+			st = os.stat(ospath)
+		except OSError:
+			# reading the file will fail with an appropriate error
+			return None
+		# END handle inaccessible files
+		return (st.st_dev, st.st_ino, name.lower()), (st.st_size, st.st_mtime)
+		
+	def _lookup(self, key):
+		""":return: cached digest for the given key or None"""
+		if key is None:
+			return None
+		entry = self._entries.get(key[0])
+		if entry is None or entry[:2] != key[1]:
+			return None
+		return entry[2]
+		
+	def _store(self, key, ospath, digest):
+		"""Store the digest of the file at the given path if it did not change 
+		while it was read"""
+		if key is None:
+			return
+		try:
+			st = os.stat(ospath)
+		except OSError:
+			return
+		# END handle removed files
+		if (st.st_size, st.st_mtime) != key[1]:
+			return
+		self._entries[key[0]] = key[1] + (digest, )
+		self._changed = True
+		
+	def clear(self):
+		"""Remove all cached digests"""
+		self._entries.clear()
+		self._changed = True
+		
+	def save(self, filepath=None):
+		"""Write the cache to the given file, or the file it was initialized with. 
+		The file is replaced atomically, and only written if the cache changed
+		
+		:raise ValueError: if no filepath is known
+		:return: self"""
+		filepath = filepath or self._filepath
+		if filepath is None:
+			raise ValueError("Cannot save digest cache without a file path")
+		if not self._changed and filepath == self._filepath and os.path.isfile(filepath):
+			return self
+		
+		def writer(fp):
+			cPickle.dump((self.version, self._entries), fp, cPickle.HIGHEST_PROTOCOL)
+		# END writer
+		replaceFileAtomically(filepath, writer)
+		
+		if filepath == self._filepath:
+			self._changed = False
+		return self
+
 #} END utilities
 
 # backup original class
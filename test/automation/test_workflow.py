@@ -2,10 +2,21 @@
 """ Test the workflow class """
 import unittest
 import workflows
+import processes
 import mrv.automation.workflow as workflow
 from mrv.automation.workflow import Workflow
 from mrv.automation.process import *
 from cStringIO import StringIO
+from mrv.dge import Profiler
+import json
+
+class _PositiveProcess( processes.TestProcess ):
+	"""Process which can only make positive numbers"""
+	def targetRating( self, target, *args, **kwargs ):
+		if isinstance( target, ( int, float ) ) and target < 0:
+			return ( 0, None )
+		return processes.TestProcess.targetRating( self, target, *args, **kwargs )
+
 
 class TestWorkflow( unittest.TestCase ):
 	"""Test workflow class"""
@@ -112,7 +123,95 @@ class TestWorkflow( unittest.TestCase ):
 			# END for each done type
 		# END for each outtype
 
-
+		# BATCH MODE
+		targets = [ 1.0, 2.0, 5, "someInput", {}, 3.0, 4 ]
+		serial = list( scwfl.iterTargets( targets ) )
+		self.failUnless( [ t[0] for t in serial ] == targets )
+		self.failUnless( serial[0][1] == 4.0 and serial[2][1] == 20 )
+		self.failUnless( serial[4][2] is not None and isinstance( serial[4][2][0], workflow.TargetError ) )
+
+		for workers in ( 0, 3 ):
+			results = list( scwfl.iterTargets( targets, batch = True, workers = workers ) )
+			self.failUnless( [ r[:2] for r in results ] == [ r[:2] for r in serial ] )
+			self.failUnless( [ r[2] is None for r in results ] == [ r[2] is None for r in serial ] )
+		# END for each worker count
+
+		errstream = StringIO()
+		scwfl.makeTargets( targets, errstream, batch = True, workers = 2 )
+		self.failUnless( "Cannot handle target" in errstream.getvalue() )
+		
+		# shells are not shared if processes judge the values themselves
+		wfl = Workflow( name = "batch_value" )
+		wfl.addNode( _PositiveProcess( "p" ) )
+		results = list( wfl.iterTargets( [ 5, -1, 3 ], batch = True ) )
+		self.failUnless( results[0][1] == 10 and results[2][1] == 6 )
+		self.failUnless( results[1][2] is not None and isinstance( results[1][2][0], workflow.TargetError ) )
+
+
+
+	def test_targetRouting( self ):
+		import processes
+		wfl = Workflow( name = "routing" )
+		p1 = processes.TestProcess( "p1" )
+		wfl.addNode( p1 )
+
+		rate, shell = wfl.targetRating( 5 )
+		self.failUnless( rate == 255 and shell == p1.inInt )
+		self.failUnless( wfl.targetRating( 6 ) == ( rate, shell ) and len( wfl._routes ) == 1 )
+		self.failUnless( wfl.targetRating( {} )[0] == 0 and len( wfl._routes ) == 2 )
+
+		# equal processes are ambiguous - the diagnostics remain
+		p2 = processes.TestProcess( "p2" )
+		wfl.addNode( p2 )
+		self.failUnless( not wfl._routes )
+		for i in range( 2 ):
+			self.failUnlessRaises( AssertionError, wfl.targetRating, 5 )
+
+		# connections change the rating - leafs are preferred
+		p1.outInt >> p2.inInt
+		self.failUnless( not wfl._routes )
+		self.failUnless( wfl.targetRating( 5 )[1] == p1.inInt )
+		p1.outInt.disconnect( p2.inInt )
+		self.failUnlessRaises( AssertionError, wfl.targetRating, 5 )
+		
+		# overrides which do not take additional keyword arguments are rated as well
+		class NoKwargsProcess( processes.TestProcess ):
+			def targetRating( self, target, check_input_plugs = True ):
+				return processes.TestProcess.targetRating( self, target, check_input_plugs )
+		# END override
+		
+		wfl = Workflow( name = "routing_override" )
+		p3 = NoKwargsProcess( "p3" )
+		wfl.addNode( p3 )
+		self.failUnless( wfl.targetRating( 5 ) == ( 255, p3.inInt ) )
+		
+		# processes judging the value itself are asked for each target
+		wfl = Workflow( name = "routing_value" )
+		p4 = _PositiveProcess( "p4" )
+		wfl.addNode( p4 )
+		self.failUnless( wfl.targetRating( 5 ) == ( 255, p4.inInt ) )
+		self.failUnless( wfl.targetRating( -1 ) == p4.targetRating( -1 ) == ( 0, None ) )
+
+	def test_profiler( self ):
+		miwfl = workflows.multiinput
+		profiler = miwfl.profiler = Profiler( )
+		try:
+			miwfl.makeTarget( unicode( "this" ) )
+		finally:
+			miwfl.profiler = None
+		# END assure profiler is removed
+
+		# the callgraph reports its calls, each of them being a computation
+		trace = StringIO()
+		profiler.writeTrace( trace )
+		events = json.loads( trace.getvalue() )[ 'traceEvents' ]
+		calls = [ e for e in events if e[ 'cat' ] == "process" ]
+		self.failUnless( len( calls ) == len( miwfl._callgraph.nodes() ) )
+		self.failUnless( sum( s.computes for s in profiler.stats() ) >= len( calls ) )
+
+		table = StringIO()
+		profiler.writeTable( table, per_node = True )
+		self.failUnless( len( table.getvalue().splitlines() ) > 1 )
 
 	def test_workflowfacades( self ):
 		wfl = workflows.multiWorkflow
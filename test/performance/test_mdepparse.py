@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""Performance Testing"""
+from mrv.test.lib import *
+from mrv.mdepparse import *
+
+import time
+import sys
+
+class TestMayaDependencyParsingPerformance( unittest.TestCase ):
+	
+	def test_parse_references( self ):
+		mafiles = get_maya_file('').files('*.ma')
+		numiterations = 20
+		
+		for parse in (MayaFileGraph._parseReferencesByLine, MayaFileGraph._parseReferences):
+			st = time.time()
+			for i in range(numiterations):
+				for mafile in mafiles:
+					parse(mafile)
+			# END for each iteration
+			elapsed = time.time() - st
+			numfiles = numiterations * len(mafiles)
+			print >> sys.stderr, "%s: parsed %i files in %f s ( %f files / s )" % (parse.__name__, numfiles, elapsed, numfiles / elapsed)
+		# END for each parse method
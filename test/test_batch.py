@@ -14,9 +14,154 @@ else:
 
 import mrv.batch as batch
 
+from StringIO import StringIO
+import signal
+import os
+import re
+import json
+import tempfile
+import resource
+import time
+import sys
+
+#{ Worker Callables
+
+def workerTask( inputs ):
+	if 'bad' in inputs:
+		raise ValueError("bad input")
+	if 'die' in inputs:
+		os._exit(1)
+	print "output goes to stderr"
+	return "%i:%s" % (os.getpid(), ",".join(inputs))
+
+#} END worker callables
+
+
 class TestBatch( unittest.TestCase ):
 
 	def test_base( self ):
 		# currently we only test import
 		pass 
-
+		
+	def test_process( self ):
+		inputs = [ str(i) for i in range(20) ]
+		prevhandler = signal.getsignal(signal.SIGCHLD)
+		
+		# chatty jobs may not block on a full pipe, short jobs are not delayed
+		script = "import sys; sys.stderr.write(sys.argv[-1] * 100000); sys.exit(sys.argv[-1] == '3')"
+		errors, done = StringIO(), StringIO()
+		st = time.time()
+		batch.process(sys.executable, ["-c", script], inputs, errors, done, numJobs=3)
+		assert time.time() - st < 5		# polling took at least a second per slot refill
+		
+		# inputs of failed jobs are not done
+		assert sorted(done.getvalue().split()) == sorted(i for i in inputs if i != '3')
+		erroutput = re.sub("FAILED: 3 \\(.*\n", "", errors.getvalue())
+		assert len(erroutput) == sum(len(i) * 100000 for i in inputs)
+		assert signal.getsignal(signal.SIGCHLD) == prevhandler
+		
+		# multiple inputs per process
+		done = StringIO()
+		batch.process(sys.executable, ["-c", "pass"], inputs, None, done, inputsPerProcess=3, numJobs=2)
+		assert sorted(done.getvalue().split()) == sorted(inputs)
+		
+	def test_retry( self ):
+		inputs = ( str(i) for i in range(12) )		# streams work as well
+		script = "import sys; sys.exit('3' in sys.argv)"
+		errors, done, report = StringIO(), StringIO(), StringIO()
+		batch.process(sys.executable, ["-c", script], inputs, errors, done, inputsPerProcess=4,
+						numJobs=2, attempts=2, reportstream=report)
+		
+		# the bad input was isolated
+		assert sorted(done.getvalue().split()) == sorted(str(i) for i in range(12) if i != 3)
+		assert errors.getvalue().startswith("FAILED: 3 ( exit code 1, 2 attempt(s)")
+		
+		records = dict((l.split("\t")[-1], l.split("\t")) for l in report.getvalue().splitlines())
+		assert len(records) == 12
+		assert records['3'][:2] == ['failed', '2']
+		assert records['0'][:2] == ['done', '2']		# it was in the failed job
+		assert records['11'][:2] == ['done', '1']
+		assert float(records['11'][2]) > 0
+		
+	def test_distributor( self ):
+		# the tail is distributed across all jobs
+		dist = batch._Distributor(range(10), 4, 2, 1, None)
+		assert [len(dist.nextChunk()) for i in range(4)] == [4, 3, 2, 1]
+		assert not dist.nextChunk()
+		
+		# chunks are sized by the time their inputs take
+		dist = batch._Distributor(iter(range(100)), 10, 2, 3, 1.0)
+		assert len(dist.nextChunk()) == 10
+		assert dist.finished(range(10), 5.0, True) == [(i, 1) for i in range(10)]
+		assert len(dist.nextChunk()) == 2
+		
+		# failed inputs are retried on their own first
+		assert not dist.finished([10, 11], 0.5, False)
+		assert dist.nextChunk() == [10] and dist.nextChunk() == [11]
+		assert dist.finished([10], 0.1, False) == list()
+		assert dist.finished([10], 0.1, False) == [(10, 3)]
+		
+		# aborted jobs report and forget the attempts of all their inputs
+		dist = batch._Distributor(range(4), 4, 1, 3, None)
+		chunk = dist.nextChunk()
+		assert not dist.finished(chunk, 0.1, False)
+		report = StringIO()
+		batch._reportAborted(dist, report, chunk)
+		assert not dist.attempt
+		assert [l.split("\t")[:2] for l in report.getvalue().splitlines()] == [['aborted', '2']] * 4
+		
+	def test_workers( self ):
+		inputs = [ str(i) for i in range(20) ] + ['bad', 'die']
+		errors, done, report, results = StringIO(), StringIO(), StringIO(), StringIO()
+		batch.processWithWorkers("mrv.test.test_batch:workerTask", iter(inputs), errors, done, inputsPerProcess=3,
+									numJobs=2, attempts=2, reportstream=report, resultstream=results, tasksPerWorker=3)
+		
+		assert sorted(done.getvalue().split()) == sorted(inputs[:-2])
+		assert "FAILED: bad" in errors.getvalue() and "FAILED: die" in errors.getvalue()
+		assert "ValueError: bad input" in errors.getvalue()
+		assert "output goes to stderr" in errors.getvalue()
+		
+		records = dict((l.split("\t")[-1], l.split("\t")) for l in report.getvalue().splitlines())
+		assert len(records) == len(inputs)
+		assert records['bad'][:2] == ['failed', '2']
+		assert records['die'][:2] == ['failed', '2']
+		
+		# all results arrived, workers were recycled
+		results = [ l.split(":") for l in results.getvalue().splitlines() ]
+		assert sorted(sum((r[1].split(",") for r in results), [])) == sorted(inputs[:-2])
+		pids = set(r[0] for r in results)
+		assert len(pids) > 2
+		assert max([r[0] for r in results].count(pid) for pid in pids) <= 3
+		
+		# invalid entry points fail all inputs
+		errors = StringIO()
+		batch.processWithWorkers("mrv.test.test_batch:doesntexist", ['a', 'b'], errors, numJobs=2)
+		assert errors.getvalue().count("FAILED") == 2
+		
+	def test_resources( self ):
+		summaryfile = tempfile.mktemp()
+		script = "import sys, time\nif sys.argv[-1] == 'spin':\n\twhile True: pass\ntime.sleep(0.2)"
+		inputs = ['a', 'b', 'c', 'spin']
+		try:
+			# memory limit only allows one job at a time, cpu time is limited
+			st = time.time()
+			batch.process(sys.executable, ["-c", script], inputs, numJobs=4, maxRSS=1,
+							rlimits={resource.RLIMIT_CPU: (1, 1)}, summaryfile=summaryfile)
+			assert time.time() - st >= 0.6
+			
+			summary = json.load(open(summaryfile))
+			jobs = dict((j['inputs'][0], j) for j in summary['jobs'])
+			assert sorted(jobs.keys()) == sorted(inputs)
+			assert jobs['a']['exitcode'] == 0 and jobs['spin']['exitcode'] < 0
+			assert jobs['spin']['cputime'] > 0.9 and jobs['a']['cputime'] < 1.0
+			assert jobs['a']['walltime'] >= 0.2 and jobs['a']['maxrss'] > 0
+			assert summary['total']['jobs'] == 4 and summary['total']['failed'] == 1
+			assert summary['total']['maxrss'] == max(j['maxrss'] for j in summary['jobs'])
+		finally:
+			os.remove(summaryfile)
+		# END assure summary is removed
+		
+		# load average has no effect if there are no jobs
+		monitor = batch._ResourceMonitor(maxLoad=0.0000001)
+		assert monitor.allowsJob([])
+		assert monitor.currentRSS(os.getpid()) > 0
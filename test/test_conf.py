@@ -195,6 +195,86 @@ class TestConfigAccessor( unittest.TestCase ):
 		# now with default value
 		assert ca['doesntexist',2].value == 2
 
+	def test_index( self ):
+		"""ConfigAccessor: lookups by name see all structural changes of the configuration"""
+		ca = _getca( 'valid_allfeatures' )
+		assert ca.hasSection( 'section' ) and not ca.hasSection( 'new_section' )
+		assert not ca.keysByName( 'new_key' )
+		
+		# keys created through the accessor or the section
+		section = ca.sectionDefault( 'new_section' )
+		assert ca.section( 'new_section' ) is section
+		key = ca.keyDefault( 'new_section', 'new_key', 1 )
+		assert ca.keysByName( 'new_key' ) == [ ( key, section ) ]
+		otherkey = ca.section( 'section' ).keyDefault( 'new_key', 2 )[0]
+		assert len( ca.keysByName( 'new_key' ) ) == 2
+		
+		# changes of other configurations do not affect our index
+		index = ca._lookupIndex()
+		other = _getca( 'valid_allfeatures' )
+		other.section( 'section' ).keyDefault( 'new_key', 3 )
+		other.removeSection( 'section' )
+		ConfigDiffer( ca, other )
+		assert ca._lookupIndex() is index
+		
+		# removals
+		ca.removeSection( 'new_section' )
+		assert not ca.hasSection( 'new_section' )
+		assert ca.keysByName( 'new_key' ) == [ ( otherkey, ca.section( 'section' ) ) ]
+		
+		# merged sections
+		ca.mergeSection( section )
+		assert ca.section( 'new_section' ).key( 'new_key' ).value == 1
+		assert sorted( k.value for k, s in ca.keysByName( 'new_key' ) ) == [ 1, 2 ]
+		
+		# properties of large configurations are resolved quickly
+		numkeys = 2000
+		fp = ConfigStringIO()
+		fp.write( "[ section ]\n" + "".join( "key%i = %i\n" % ( i, i ) for i in range( numkeys ) ) )
+		fp.write( "".join( "[ +key%i ]\nproperty = %i\n" % ( i, i ) for i in range( numkeys ) ) )
+		fp.seek( 0 )
+		ca = ConfigAccessor()
+		ca.readfp( fp )
+		assert ca.section( 'section' ).key( 'key7' ).properties.key( 'property' ).value == 7
+		
+	def test_index_interleaved( self ):
+		"""ConfigAccessor: structural changes done by the accessor keep its index up to date"""
+		readonly = ConfigStringIO( "[ section ]\nshared = 1\n" )
+		writable = ConfigStringIO( "[ section ]\nmine = 2\n" )
+		ca = ConfigAccessor()
+		ca.readfp( [ readonly, writable ], close_fp = False )
+		readonly.close()
+		
+		index = ca._lookupIndex()
+		for i in range( 100 ):
+			key = ca.keyDefault( 'section%i' % ( i % 10 ), 'key%i' % i, i )
+			assert ca.keyDefault( 'section%i' % ( i % 10 ), 'key%i' % i, -1 ) is key
+			assert ca.keysByName( 'key%i' % i ) == [ ( key, ca.section( 'section%i' % ( i % 10 ) ) ) ]
+			assert ca.get( 'key%i' % i ) is key
+		# END for each key
+		
+		# keys are ordered by node, even if they are added later
+		shared = ca.keyDefault( 'section1', 'shared', 3 )
+		assert [ k.value for k, s in ca.keysByName( 'shared' ) ] == [ 1, 3 ]
+		assert ca['shared'].value == 1
+		
+		sections = ca.section( 'section' ), ca.section( 'section1' )
+		ca.mergeSection( Section( 'section2', 0 ) )
+		assert ca.removeSection( 'section1' ) == 0 and not ca.hasSection( 'section1' )
+		assert [ k.value for k, s in ca.keysByName( 'shared' ) ] == [ 1 ]
+		assert ca.removeSection( 'section' ) == 1 and ca.section( 'section' ) is sections[0]
+		assert not ca.keysByName( 'mine' )
+		
+		# none of the changes required the index to be rebuilt
+		assert ca._lookupIndex() is index
+		
+		# changes done directly to the structure are seen as well
+		ca.section( 'section2' ).keyDefault( 'direct', 4 )
+		assert ca.get( 'direct' ).value == 4
+		ca._configChain.append( ConfigNode( ConfigStringIO() ) )
+		assert ca.sectionDefault( 'section' ) is sections[0]
+		assert ca._lookupIndex() is not index
+
 
 class TestConfigManager( unittest.TestCase ):
 	""" Test the ConfigAccessor Class and all its featuers"""
@@ -295,6 +375,45 @@ class TestConfigManager( unittest.TestCase ):
 		
 
 
+	def test_snapshot( self ):
+		"""ConfigManager: compiled snapshots are used as long as the sources do not change"""
+		cachefile = os.path.join( self.testpath, "config.cache" )
+		def fps():
+			return _getprefixedinifps( 'valid', dirname=self.testpath )
+		
+		cm = ConfigManager( fps(), write_back_on_desctruction=False, cachefile=cachefile )
+		assert os.path.isfile( cachefile )
+		
+		# snapshot yields the same configuration, including properties 
+		cmc = ConfigManager( fps(), write_back_on_desctruction=False, cachefile=cachefile )
+		diff = ConfigDiffer( cm.config, cmc.config )
+		assert not ( diff.added or diff.removed or diff.changed )
+		for ca in ( cm.config, cmc.config ):
+			assert ca.section( 'section' ).key( 'my_key_with_property' ).properties.key( 'property' ).value == 'value'
+			assert ca.section( 'section_with_prop' ).properties.key( 'property' ).value == 'flag'
+		# END for each accessor
+		
+		# changes can be written back to the sources
+		cmc.config.sectionDefault( "snapshotSection" ).keyDefault( "snapshotKey", 1 )
+		cmc.write()
+		
+		# the changed source invalidates the snapshot
+		cm = ConfigManager( fps(), write_back_on_desctruction=False, cachefile=cachefile )
+		assert cm.config.section( "snapshotSection" ).key( "snapshotKey" ).value == 1
+		
+		ca = ConfigAccessor()
+		ca.readfp( fps(), cachefile=cachefile + "2" )
+		ca.readfp( fps(), cachefile=cachefile + "2" )
+		diff = ConfigDiffer( ca.flatten( ConfigStringIO() ), cm.config )
+		assert not ( diff.added or diff.removed or diff.changed )
+		
+		# changed in-memory sources invalidate it as well
+		for value in ( 'value', 'value', 'other' ):
+			cm = ConfigManager( [ DictConfigINIFile( { 'key' : value }, section='dict' ) ], 
+								write_back_on_desctruction=False, cachefile=cachefile )
+			assert cm.config.section( 'dict' ).key( 'key' ).value == value
+		# END for each value
+
 	def test_taggedFileDescriptors( self ):
 		"""ConfigManager: check if filedescriptor parsing is generally working"""
 
@@ -428,6 +547,40 @@ class TestConfigDiffer( unittest.TestCase ):
 		self.failUnless( len( diff.changed[0].properties.changed[0].removed ) )	 # section property value changed ( removed )
 		self.failUnless( len( diff.changed[0].properties.changed[0].added ) )	 # section property value changed ( added )
 
+	def test_stream( self ):
+		"""ConfigDiffer: differences can be streamed and applied in one batch"""
+		def getca( numsections, numkeys, offset, close_fp=False ):
+			fp = ConfigStringIO()
+			for i in range( numsections ):
+				fp.write( "[ section%i ]\n" % ( i + offset ) )
+				fp.write( "".join( "key%i = %s\n" % ( k, ",".join( str( v ) for v in range( k % 20 + offset ) ) ) 
+									for k in range( numkeys + offset ) ) )
+			# END for each section
+			fp.seek( 0 )
+			ca = ConfigAccessor()
+			ca.readfp( fp, close_fp=close_fp )
+			return ca
+		# END utility
+		
+		a, b = getca( 20, 50, 0 ), getca( 20, 50, 1 )
+		diff = ConfigDiffer( a, b )
+		self._checkLengths( diff, 1, 1, 19, 0 )
+		
+		kinds = dict()
+		for kind, item in ConfigDiffer.iterDiff( a, b ):
+			kinds[ kind ] = kinds.get( kind, 0 ) + 1
+		assert kinds == { 'added' : 1, 'removed' : 1, 'changed' : 19 }
+		
+		assert ConfigDiffer.applyStream( a, ConfigDiffer.iterDiff( a, b ) ) == ( list(), list(), list() )
+		assert not ConfigDiffer( a, b ).hasDifferences()
+		assert a.section( 'section20' ).key( 'key50' ).values == range( 11 )
+		
+		# read-only configurations cannot receive any change
+		ca = getca( 2, 10, 0, close_fp=True )
+		added, removed, changed = ConfigDiffer.applyStream( ca, ConfigDiffer.iterDiff( ca, b ) )
+		assert len( added ) == 19 and len( removed ) == 1 and not changed
+		assert ca.hasSection( 'section0' ) and not ca.hasSection( 'section2' )
+
 
 
 
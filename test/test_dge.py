@@ -3,6 +3,8 @@
 import unittest
 from mrv.dge import *
 from random import randint
+from multiprocessing.pool import ThreadPool
+import threading
 import tempfile
 
 A = Attribute
@@ -49,6 +51,53 @@ class SimpleNode( NodeBase ):
 		raise PlugUnhandled( )
 
 
+class CountingNode( NodeBase ):
+	"""Count the computations done on the cached output plug"""
+	#{ Plugs
+	outFloat = plug( A( float, 0 ) )
+	inFloat = plug( A( float, 0, default = 1.0 ) )
+
+	inFloat.affects( outFloat )
+	#} END plugs
+
+	def __init__( self, name ):
+		super( CountingNode, self ).__init__( id = name )
+		self.numComputations = 0
+
+	def compute( self, plug, mode ):
+		if plug == CountingNode.outFloat:
+			self.numComputations += 1
+			return self.inFloat.get( ) * 2.0
+		raise PlugUnhandled( )
+
+
+class ThreadedCountingNode( CountingNode ):
+	"""Remember the thread our computation ran in"""
+	thread_safe_compute = True
+
+	def compute( self, plug, mode ):
+		self.computeThread = threading.currentThread()
+		return super( ThreadedCountingNode, self ).compute( plug, mode )
+
+
+class SumNode( NodeBase ):
+	"""Add two floats"""
+	#{ Plugs
+	outSum = plug( A( float, 0 ) )
+	inA = plug( A( float, 0 ) )
+	inB = plug( A( float, 0 ) )
+
+	inA.affects( outSum )
+	inB.affects( outSum )
+	#} END plugs
+
+	def compute( self, plug, mode ):
+		if plug == SumNode.outSum:
+			self.computeThread = threading.currentThread()
+			return self.inA.get( ) + self.inB.get( )
+		raise PlugUnhandled( )
+
+
 #}
 
 
@@ -77,7 +126,7 @@ class TestDGEngine( unittest.TestCase ):
 		del( addrem )
 		self.failUnless( len( list( graph.iterNodes() ) ) == 2 )
 		# get the node back and remove it properly
-		addrem = list( graph.iterNodes() )[1]
+		addrem = [ n for n in graph.iterNodes() if n is not s1 ][0]
 		graph.removeNode( addrem )
 		del( addrem )
 		self.failUnless( len( list( graph.iterNodes() ) ) == 1 )
@@ -255,10 +304,23 @@ class TestDGEngine( unittest.TestCase ):
 		self.failUnless( len( SimpleNode.filterCompatiblePlugs( inplugs, floatattr ) ) == 2 )
 		self.failUnlessRaises( TypeError, SimpleNode.filterCompatiblePlugs, inplugs, floatattr, raise_on_ambiguity = 1 )
 
+		# rate values - shared attributes are rated once
+		ratecache = dict()
+		rated = SimpleNode.filterCompatiblePlugs( inplugs, 2.0, rate_cache = ratecache )
+		self.failUnless( len( rated ) == 2 and len( ratecache ) == len( inplugs ) )
+		self.failUnless( Attribute.compatabilityRates( [ floatattr, intattr ], 2.0 ) == [ 255, 0 ] )
+
+		# class ratings are cached per type pair
+		Attribute.clearRatingCache()
+		self.failUnless( floatattr.compatabilityRate( 5.0 ) == 255 )
+		self.failUnless( ( float, 0, float ) in Attribute._rating_cache )
+		self.failUnless( A( float, 0 ).compatabilityRate( 1.0 ) == 255 )
+		self.failUnless( len( Attribute._rating_cache ) == 1 )
+
 	def test_duplication( self ):
 		"""dgengine: duplicate a graph"""
 		# test shallow copy
-		graph = Graph()
+		graph = Graph( name = "graph", author = "me" )
 		s1 = SimpleNode( "s1" )
 		s2 = SimpleNode( "s2" )
 		s3 = SimpleNode( "s3" )
@@ -271,8 +333,248 @@ class TestDGEngine( unittest.TestCase ):
 		s2.outMult >> s3.inFloat
 
 		g2 = graph.duplicate( )
+		self.failUnless( g2.name == "graph" and g2.graph == { 'author' : "me" } )
 
 		self.failUnless( len( list( graph.iterNodes() ) ) == len( list( g2.iterNodes() ) ) )
 		self.failUnless( len( list( graph.iterConnectedNodes() ) ) == len( list( g2.iterConnectedNodes() ) ) )
+		self.failUnless( len( list( g2.edges_iter() ) ) == 2 )
+		for sshell, dshell in g2.edges_iter():
+			self.failUnless( dshell.input() == sshell and dshell in sshell.outputs() )
+		# END for each edge
 
+		# disconnecting unconnected shells does nothing
+		s1.outRand.disconnect( s3.inFloat )
+		self.failUnless( len( list( graph.edges_iter() ) ) == 2 )
 
+	def test_dirtyTracking( self ):
+		"""dgengine: incremental dirty propagation"""
+		graph = Graph()
+		graph.dirty_tracking = True
+		nodes = [ CountingNode( "c%i" % i ) for i in range( 4 ) ]
+		for node in nodes:
+			graph.addNode( node )
+		# END for each node
+		for snode, dnode in zip( nodes[:-1], nodes[1:] ):
+			snode.outFloat >> dnode.inFloat
+		# END for each node pair
+		first, last = nodes[0], nodes[-1]
+
+		self.failUnless( last.outFloat.get( ) == 16.0 )
+		self.failUnless( not last.outFloat.isDirty() )
+
+		# the first write dirties the whole chain
+		first.inFloat.set( 2.0 )
+		self.failUnless( not first.inFloat.isDirty() )
+		self.failUnless( last.outFloat.isDirty() and not last.outFloat.hasCache() )
+		numdirty = len( graph._dirtyshells )
+
+		# further writes stop at the first dirty shell
+		first.inFloat.set( 3.0 )
+		self.failUnless( len( graph._dirtyshells ) == numdirty )
+
+		# retrieving values cleans the shells and recomputes once
+		self.failUnless( last.outFloat.get( ) == 48.0 )
+		self.failUnless( last.numComputations == 2 )
+		self.failUnless( not graph._dirtyshells )
+
+		# partial evaluation keeps the rest of the chain dirty
+		first.inFloat.set( 1.0 )
+		self.failUnless( nodes[1].outFloat.get( ) == 4.0 )
+		first.inFloat.set( 0.5 )
+		self.failUnless( last.outFloat.get( ) == 8.0 )
+
+		# new connections from dirty shells dirty their destination
+		other = CountingNode( "other" )
+		graph.addNode( other )
+		self.failUnless( other.outFloat.get( ) == 2.0 )
+		first.inFloat.set( 4.0 )
+		first.outFloat.connect( other.inFloat )
+		self.failUnless( other.outFloat.isDirty() )
+		self.failUnless( other.outFloat.get( ) == 16.0 )
+
+		# removed nodes do not stay dirty in the graph
+		first.inFloat.set( 5.0 )
+		graph.removeNode( last )
+		self.failUnless( graph._dirtyshells )
+		self.failUnless( not [ s for s in graph._dirtyshells if s.node is last ] )
+
+		graph.clearCache( )
+		self.failUnless( not graph._dirtyshells )
+
+	def test_evaluationPlan( self ):
+		"""dgengine: evaluate deep chains using a precompiled plan"""
+		graph = Graph()
+		graph.dirty_tracking = True
+		nodes = [ CountingNode( "c%i" % i ) for i in range( 1000 ) ]
+		for node in nodes:
+			graph.addNode( node )
+		# END for each node
+		for snode, dnode in zip( nodes[:-1], nodes[1:] ):
+			snode.outFloat >> dnode.inFloat
+		# END for each node pair
+		first, last = nodes[0], nodes[-1]
+
+		plan = graph.evaluationPlan( last.outFloat )
+		self.failUnless( len( plan ) == len( nodes ) - 1 )
+		self.failUnless( plan[0] == first.outFloat and plan[-1] == nodes[-2].outFloat )
+		self.failUnless( graph.evaluationPlan( last.outFloat ) is plan )	# cached
+
+		# would exceed the recursion limit when pulled recursively
+		self.failUnless( graph.evaluate( last.outFloat ) == 2.0 ** len( nodes ) )
+		self.failUnless( sum( n.numComputations for n in nodes ) == len( nodes ) )
+
+		first.inFloat.set( 0.5 )
+		self.failUnless( graph.evaluate( last.outFloat ) == 2.0 ** ( len( nodes ) - 1 ) )
+		self.failUnless( last.numComputations == 2 )
+
+		# topology changes invalidate the plan
+		first.outFloat.disconnect( nodes[1].inFloat )
+		self.failUnless( len( graph.evaluationPlan( last.outFloat ) ) == len( nodes ) - 2 )
+		self.failUnless( graph.evaluate( nodes[1].outFloat ) == 2.0 )
+
+	def test_parallelEvaluation( self ):
+		"""dgengine: evaluate independent branches in parallel"""
+		graph = Graph()
+		sumnode = SumNode( id = "sum" )
+		graph.addNode( sumnode )
+		branches = list()
+		for bid, inplug in enumerate( ( sumnode.inA, sumnode.inB ) ):
+			nodes = [ ThreadedCountingNode( "b%i_%i" % ( bid, i ) ) for i in range( 3 ) ]
+			for node in nodes:
+				graph.addNode( node )
+			# END for each node
+			for snode, dnode in zip( nodes[:-1], nodes[1:] ):
+				snode.outFloat >> dnode.inFloat
+			# END for each node pair
+			nodes[-1].outFloat >> inplug
+			branches.append( nodes )
+		# END for each branch
+
+		waves = graph._compilePlan( sumnode.outSum )[2]
+		self.failUnless( len( waves ) == 3 )
+		self.failUnless( [ len( w ) for w in waves ] == [ 2, 2, 2 ] )
+
+		pool = ThreadPool( 2 )
+		try:
+			self.failUnless( graph.evaluate( sumnode.outSum, pool = pool ) == 16.0 )
+		finally:
+			pool.close()
+			pool.join()
+		# END assure pool is shut down
+
+		mainthread = threading.currentThread()
+		self.failUnless( sumnode.computeThread is mainthread )
+		for nodes in branches:
+			for node in nodes:
+				self.failUnless( node.numComputations == 1 )
+				self.failUnless( node.computeThread is not mainthread )
+				self.failUnless( node.outFloat.hasCache() )
+			# END for each node
+		# END for each branch
+
+	def test_plugTable( self ):
+		"""dgengine: class level plugs are gathered once per class"""
+		self.failUnless( set( SimpleNode.plugsStatic() ) == set( SimpleNode._plugtable.plugs ) )
+		self.failUnless( len( SimpleNode.inputPlugsStatic() ) == 3 )
+		self.failUnless( len( SimpleNode.outputPlugsStatic() ) == 3 )
+		self.failUnless( CountingNode._plugtable is not ThreadedCountingNode._plugtable )
+		self.failUnless( set( CountingNode.plugsStatic() ) == set( ThreadedCountingNode.plugsStatic() ) )
+
+		# changes to affects relationships update the input and output sets
+		class LateNode( NodeBase ):
+			outFloat = plug( A( float, 0 ) )
+			inFloat = plug( A( float, 0 ) )
+		# END node class
+
+		node = LateNode( )
+		self.failUnless( len( node.outputPlugs() ) == 0 )
+		LateNode.inFloat.affects( LateNode.outFloat )
+		self.failUnless( node.outputPlugs() == [ LateNode.outFloat ] )
+		self.failUnless( node.inputPlugs() == [ LateNode.inFloat ] )
+
+		# instance level plugs are merged in
+		instplug = plug( A( float, 0 ) )
+		instplug.setName( "inInstance" )
+		node.inInstance = instplug
+		self.failUnless( node.inputPlugs()[0] is instplug )
+		self.failUnless( len( node.plugs() ) == 3 )
+		self.failUnless( len( LateNode.plugsStatic() ) == 2 )
+
+		# plugs set on classes later on are picked up by subclasses as well
+		class LateSubNode( LateNode ):
+			pass
+		# END subclass
+		
+		table = LateSubNode._plugtable
+		LateNode.outLate = plug( A( float, 0 ) )
+		self.failUnless( LateNode.outLate.name() == "outLate" )
+		self.failUnless( len( LateNode.plugsStatic() ) == 3 and len( LateSubNode.plugsStatic() ) == 3 )
+		self.failUnless( LateSubNode._plugtable is not table )
+		subnode = LateSubNode( )
+		self.failUnless( LateNode.outLate in subnode.plugs() and len( node.plugs() ) == 4 )
+		self.failUnless( LateNode.outLate in subnode._plugcache.slots )
+
+		del( LateNode.outLate )
+		self.failUnless( len( LateSubNode.plugsStatic() ) == 2 )
+
+		# other class attributes keep the tables
+		table = LateSubNode._plugTable()
+		LateSubNode.value = 5
+		self.failUnless( LateSubNode._plugTable() is table )
+
+	def test_plugCache( self ):
+		"""dgengine: plug values are cached in slots of the node's plug cache"""
+		graph = Graph()
+		node = CountingNode( "c" )
+		graph.addNode( node )
+		emptysize = graph.cacheSize()
+		self.failUnless( emptysize == node.cacheSize() and emptysize > 0 )
+
+		self.failUnless( node.outFloat.get() == 2.0 )
+		self.failUnless( node.outFloat.hasCache() and not node.inFloat.hasCache() )
+		self.failUnless( "outFloat_c" not in node.__dict__ )
+		self.failUnless( node.cacheSize() > emptysize )
+
+		# instance level plugs work as well
+		instplug = plug( A( float, 0 ) )
+		instplug.setName( "inInstance" )
+		node.inInstance = instplug
+		instshell = node.toShell( instplug )
+		instshell.setCache( 4.0 )
+		self.failUnless( instshell.cache() == 4.0 )
+		self.failUnlessRaises( ValueError, node.inFloat.cache )
+
+		graph.clearCache()
+		self.failUnless( not node.outFloat.hasCache() and not instshell.hasCache() )
+		self.failUnless( node.cacheSize() == emptysize )
+		self.failUnless( node.outFloat.get() == 2.0 and node.numComputations == 2 )
+
+	def test_profiler( self ):
+		"""dgengine: profile computations, cache hits and dirty propagation"""
+		graph = Graph()
+		profiler = graph.profiler = Profiler()
+		nodes = [ CountingNode( "p%i" % i ) for i in range( 3 ) ]
+		for node in nodes:
+			graph.addNode( node )
+		for snode, dnode in zip( nodes[:-1], nodes[1:] ):
+			snode.outFloat >> dnode.inFloat
+		# END for each node pair
+
+		last = nodes[-1].outFloat
+		self.failUnless( last.get() == 8.0 and last.get() == 8.0 )
+		nodes[0].inFloat.set( 2.0 )
+
+		stats = dict( ( s.name, s ) for s in profiler.stats() )
+		laststat = stats[ repr( last ) ]
+		self.failUnless( laststat.computes == 1 and laststat.hits == 1 )
+		self.failUnless( laststat.totaltime >= laststat.selftime )
+		self.failUnless( stats[ repr( nodes[0].outFloat ) ].totaltime <= laststat.totaltime )
+
+		# inFloat, outFloat and the shells of the two downstream nodes
+		self.failUnless( stats[ repr( nodes[0].inFloat ) ].fanout == 6 )
+		self.failUnless( len( profiler.stats( per_node = True ) ) == 3 )
+
+		trace = tempfile.TemporaryFile()
+		profiler.writeTrace( trace )
+		profiler.clear()
+		self.failUnless( not profiler.stats() )
@@ -2,6 +2,9 @@
 """Tests for the maya dependency parser"""
 from mrv.test.lib import *
 from mrv.mdepparse import *
+import os
+import shutil
+import tempfile
 
 
 class TestMayaDependencyParsing( unittest.TestCase ):
@@ -24,4 +27,197 @@ class TestMayaDependencyParsing( unittest.TestCase ):
 			assert len(mfg.depends(mbfile, mfg.kAffectedBy)) == 0
 		# END for each possible parse_all_paths value
 		
+	def test_parse_references( self ):
+		mafiles = get_maya_file('').files('*.ma')
+		assert mafiles
 		
+		# small blocks make requires statements span blocks
+		default_block_size = MayaFileGraph.header_block_size
+		for block_size in (default_block_size, 7):
+			MayaFileGraph.header_block_size = block_size
+			try:
+				for mafile in mafiles:
+					for parse_all_paths in range(2):
+						refs = MayaFileGraph._parseReferences(mafile, parse_all_paths)
+						assert refs == MayaFileGraph._parseReferencesByLine(mafile, parse_all_paths)
+					# END for each parse mode
+				# END for each file
+			finally:
+				MayaFileGraph.header_block_size = default_block_size
+			# END restore block size
+		# END for each block size
+		
+		assert len(MayaFileGraph._parseReferences(get_maya_file('ref2re.ma'))) == 2
+		
+	def test_index( self ):
+		mafiles = get_maya_file('').files('*.ma') + [get_maya_file('notthere.ma')]
+		mfg = MayaFileGraph.createFromFiles(mafiles)
+		assert not mfg.isIndexed()
+		
+		def results():
+			out = list()
+			for mafile in mafiles:
+				for direction in (mfg.kAffects, mfg.kAffectedBy):
+					for leaves_only in range(2):
+						out.append(mfg.depends(mafile, direction, leaves_only=leaves_only))
+						out.append(mfg.depends(mafile, direction, leaves_only=leaves_only, invalid_only=1))
+					# END for each leave mode
+				# END for each direction
+			# END for each file
+			return out
+		# END utility
+		
+		unindexed = results()
+		assert [r for r in unindexed if r]
+		
+		mfg.setIndexed()
+		assert mfg.isIndexed()
+		assert results() == unindexed
+		assert mfg._reachability.closures[mfg.kAffects]
+		# cached results are the same
+		assert results() == unindexed
+		
+		# limited queries do not use the index
+		mfg.clearIndex()
+		assert mfg.depends(mafiles[0], depth=1) == MayaFileGraph.depends(mfg, mafiles[0], depth=1)
+		assert not mfg._reachability.closures[mfg.kAffects]
+		
+		# prune functions of the caller are used along with the leaf filter
+		ref2re = get_maya_file('ref2re.ma')
+		leaves = mfg.depends(ref2re, mfg.kAffectedBy, leaves_only=True)
+		assert len(leaves) > 1
+		assert not mfg.depends(ref2re, mfg.kAffectedBy, leaves_only=True, prune=lambda i, g: True)
+		assert mfg.depends(ref2re, mfg.kAffectedBy, leaves_only=True, prune=lambda i, g: i[1] == leaves[0]) == leaves[1:]
+		
+		# adding files only drops the affected closures
+		nodes = [n for n in mfg.nodes() if not n.startswith(mfg.invalidPrefix)]
+		for node in nodes:
+			mfg.depends(node)
+			mfg.depends(node, mfg.kAffectedBy)
+		# END for each node
+		mfg.addFromFiles([ref2re], incremental=True)
+		assert len(mfg._reachability.closures[mfg.kAffects]) == len(nodes)
+		mfg._stamps().pop(ref2re)
+		mfg.addFromFiles([ref2re], incremental=True)
+		num_affectedby = len(mfg._reachability.closures[mfg.kAffectedBy])
+		assert num_affectedby < len(nodes)
+		assert results() == unindexed
+		
+		mfg.setIndexed(False)
+		assert not mfg.isIndexed()
+		assert results() == unindexed
+		
+	def test_parallel( self ):
+		mafiles = [ get_maya_file(f) for f in ('ref2re.ma', 'ref8m.ma', 'ref10m.ma', 'notthere.ma', 'cube.ma') ]
+		mfg = MayaFileGraph.createFromFiles(mafiles)
+		pmfg = MayaFileGraph.createFromFiles(mafiles, num_workers=3)
+		
+		assert sorted(mfg.edges()) == sorted(pmfg.edges())
+		assert sorted(mfg.invalidFiles()) == sorted(pmfg.invalidFiles())
+		assert len(pmfg.invalidFiles()) == 1
+		
+		
+		
+	def test_update( self ):
+		tmpdir = tempfile.mkdtemp()
+		def write_ma(name, *refs):
+			path = os.path.join(tmpdir, name)
+			fp = open(path, "w")
+			fp.write("//Maya ASCII 8.5 scene\n")
+			for ref in refs:
+				fp.write('file -r -ns "%s" -rfn "%sRN" "%s";\n' % (ref[:-3], ref[:-3], os.path.join(tmpdir, ref)))
+			fp.write('requires maya "8.5";\n')
+			fp.close()
+			return path
+		# END utility
+		
+		try:
+			a = write_ma("a.ma", "b.ma")
+			b = write_ma("b.ma", "c.ma")
+			c = os.path.join(tmpdir, "c.ma")
+			
+			mfg = MayaFileGraph.createFromFiles([a], with_digest=True)
+			mfg.setIndexed()			# edits need to update the index
+			assert mfg.invalidFiles() == [c]
+			assert mfg.depends(a, mfg.kAffectedBy) == [b, c]
+			
+			# nothing changed, nothing gets parsed
+			assert mfg.update() == list()
+			
+			# touched files do not count if their digest is the same
+			st = os.stat(a)
+			os.utime(a, (st.st_atime, st.st_mtime + 10))
+			assert mfg.update(with_digest=True) == list()
+			
+			# changed file gets rewired, the orphaned invalid file is gone
+			write_ma("b.ma")
+			os.utime(b, (st.st_atime, st.st_mtime + 20))
+			assert mfg.update() == [b]
+			assert mfg.depends(a, mfg.kAffectedBy) == [b]
+			assert not mfg.invalidFiles() and not mfg.has_node(c)
+			
+			# previously invalid files are picked up once they exist
+			b = write_ma("b.ma", "c.ma")
+			os.utime(b, (st.st_atime, st.st_mtime + 30))
+			assert mfg.update() == [b]
+			assert mfg.invalidFiles() == [c]
+			write_ma("c.ma", "a.ma")
+			assert mfg.update() == [b]
+			assert not mfg.invalidFiles()
+			assert mfg.depends(c, mfg.kAffectedBy, visit_once=1) == [a, b]
+			
+			# the result is the same as if it was parsed from scratch
+			assert sorted(mfg.edges()) == sorted(MayaFileGraph.createFromFiles([a]).edges())
+		finally:
+			shutil.rmtree(tmpdir)
+		# END assure tmp files are removed
+		
+	def test_database( self ):
+		mafiles = get_maya_file('').files('*.ma') + [get_maya_file('notthere.ma')]
+		mfg = MayaFileGraph.createFromFiles(mafiles, with_digest=True)
+		assert mfg.invalidFiles()
+		
+		dbfile = tempfile.mktemp()
+		try:
+			mfg.writeDatabase(dbfile)
+			assert MayaFileDatabase.isDatabase(dbfile)
+			db = MayaFileDatabase(dbfile)
+			
+			# invalid files are not stored as edges
+			assert sorted(db.edges()) == sorted(e for e in mfg.edges() if e[0] != mfg.invalidNodeID)
+			assert sorted(db.invalidFiles()) == sorted(mfg.invalidFiles())
+			assert not db.has_node(get_maya_file('doesntexist.ma'))
+			
+			for mafile in mafiles:
+				for direction in (mfg.kAffects, mfg.kAffectedBy):
+					for invalid_only in range(2):
+						assert db.depends(mafile, direction, invalid_only=invalid_only) == mfg.depends(mafile, direction, invalid_only=invalid_only)
+					# END for each invalid mode
+				# END for each direction
+				if mfg.has_node(mafile):
+					assert db.in_degree(mafile) == mfg.in_degree(mafile)
+					assert db.out_degree(mafile) == mfg.out_degree(mafile)
+				# END check degrees
+			# END for each file
+			
+			# conversion preserves everything
+			cmfg = db.toGraph()
+			assert sorted(cmfg.edges()) == sorted(mfg.edges())
+			assert cmfg.graph['stamps'] == mfg.graph['stamps']
+			assert cmfg.update() == list()
+			
+			# rewriting the file does not affect open databases, empty graphs work as well
+			MayaFileGraph().writeDatabase(dbfile)
+			assert sorted(db.edges()) == sorted(e for e in mfg.edges() if e[0] != mfg.invalidNodeID)
+			db.close()
+			db = MayaFileDatabase(dbfile)
+			assert not db.edges() and not db.invalidFiles() and not db.depends(mafiles[0])
+			db.close()
+			
+			# other files are rejected
+			open(dbfile, "w").write("something else")
+			assert not MayaFileDatabase.isDatabase(dbfile)
+			self.failUnlessRaises(ValueError, MayaFileDatabase, dbfile)
+		finally:
+			os.remove(dbfile)
+		# END assure file is removed
@@ -1,6 +1,13 @@
 # -*- coding: utf-8 -*-
 """Tests for the mdp dependency parser commandline tool"""
 from mrv.test.lib import *
+from mrv.mdepparse import *
+import mrv.mdp as mdp
+
+import threading
+import tempfile
+import socket
+import os
 
 try:
 	from mrv.mdp import *
@@ -15,4 +22,79 @@ class TestMDPTool( unittest.TestCase ):
 	def test_base( self ):
 		# tests just the import for now
 		pass
-
+		
+	def test_server( self ):
+		mafiles = get_maya_file('').files('*.ma') + [get_maya_file('notthere.ma')]
+		mfg = MayaFileGraph.createFromFiles(mafiles)
+		dbfile = tempfile.mktemp()
+		socketpath = tempfile.mktemp()
+		mfg.writeDatabase(dbfile)
+		
+		server = mdp.QueryServer(socketpath, dbfile)
+		thread = threading.Thread(target=server.serve_forever)
+		thread.start()
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(10)
+		reader = sock.makefile('r')
+		idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			# clients keeping their connection open do not block others
+			idle.connect(socketpath)
+			sock.connect(socketpath)
+			def query(request):
+				sock.sendall(request + "\n")
+				return list(iter(lambda: reader.readline().rstrip("\n"), ''))
+			# END utility
+			
+			ref2re = get_maya_file('ref2re.ma')
+			assert query('--affected-by "%s"' % ref2re) == mfg.depends(ref2re, mfg.kAffectedBy)
+			assert query('--affected-by -d 1 "%s"' % ref2re) == mfg.depends(ref2re, mfg.kAffectedBy, depth=1)
+			assert sorted(query('-b')) == sorted(mfg.invalidFiles())
+			assert not query('--affects -b "%s"' % ref2re)
+			
+			# batches of files, with edges
+			expected = list()
+			for direction in (mfg.kAffects, mfg.kAffectedBy):
+				for mafile in mafiles:
+					expected.extend("%s->%s" % (mafile, d) for d in mfg.depends(mafile, direction, leaves_only=True))
+			# END for each direction
+			assert expected
+			assert query('--affects --affected-by -l -e ' + " ".join('"%s"' % f for f in mafiles)) == expected
+			
+			# invalid requests
+			answer = query('--foo')
+			assert len(answer) == 1 and answer[0].startswith("error: ")
+			assert query('--affects -d x "%s"' % ref2re)[0].startswith("error: ")
+			
+			# partially written files are not picked up
+			expected = query('--affected-by "%s"' % ref2re)
+			assert expected
+			data = open(dbfile, 'rb').read()
+			for size in (0, 10, len(data) / 2):
+				# the server maps the current file, which must not be truncated
+				os.remove(dbfile)
+				open(dbfile, 'wb').write(data[:size])
+				assert query('--affected-by "%s"' % ref2re) == expected
+			# END for each size
+			
+			# changes on disk are picked up
+			MayaFileGraph.createFromFiles([get_maya_file('cube.ma')]).writeDatabase(dbfile)
+			assert not query('--affected-by "%s"' % ref2re)
+			assert not query('-b')
+			
+			# unreadable files are reported if there is no previous version
+			server.graph = server._stamp = None
+			os.remove(dbfile)
+			open(dbfile, 'wb').write(data[:10])
+			assert query('-b')[0].startswith("error: ")
+		finally:
+			# the server handles the connection until it is closed
+			reader.close()
+			sock.close()
+			idle.close()
+			server.shutdown()
+			thread.join()
+			server.server_close()
+			os.remove(dbfile)
+		# END assure server is shut down
+		assert not os.path.exists(socketpath)
@@ -12,6 +12,7 @@ import tempfile
 import shutil
 import sha
 import md5
+import hashlib
 
 class TestPath( unittest.TestCase ):
 	prev_cwd = os.getcwd()
@@ -491,6 +492,107 @@ class TestPath( unittest.TestCase ):
 		
 		assert addir.rmtree() == addir and not addir.isdir()
 		
+	def test_walk(self):
+		workdir = self.workdir
+		for dirname in ('a', 'a/b', 'a/b/c', 'd', 'd/e'):
+			(workdir / dirname).mkdir()
+			for filename in ('x.txt', 'y.py'):
+				(workdir / dirname / filename).touch()
+		# END for each directory
+		os.symlink(workdir / 'd', workdir / 'a' / 'dlink')
+		os.symlink(workdir / 'doesntexist', workdir / 'broken')
+		
+		items = list(workdir.walk())
+		assert len(items) == 22 and all(isinstance(p, Path) for p in items)
+		for i, p in enumerate(items):
+			assert p.dirname() == workdir or items.index(p.dirname()) < i
+		# END directories come before their children
+		
+		# symbolic links are followed, broken ones are neither files nor directories
+		assert len(list(workdir.walkdirs())) == 7
+		assert len(list(workdir.walkfiles('*.py'))) == 7
+		assert len(list(workdir.walkfiles(predicate=lambda p: 'dlink' not in p))) == 10
+		assert list(workdir.walk('broken')) == [workdir / 'broken']
+		
+		# the same results are yielded in the same order using workers
+		for walkername, args in (('walk', ()), ('walkdirs', ('d*',)), ('walkfiles', (None, 'strict', lambda p: 'b' in p))):
+			items = list(getattr(workdir, walkername)(*args))
+			assert items == list(getattr(workdir, walkername)(*args, **dict(workers=3)))
+			unordered = list(getattr(workdir, walkername)(*args, **dict(workers=3, ordered=False)))
+			assert sorted(unordered) == sorted(items)
+		# END for each walker
+		
+		# variables are expanded
+		varpath = Path('$%s' % self.envtmp) / workdir.basename()
+		assert list(varpath.walk()) == list(workdir.walk())
+		
+		# errors are handled in the workers as well
+		invalidpath = Path("toNOWhere/and/doesntexist")
+		for ordered in (True, False):
+			assert len(list(invalidpath.walk(errors='ignore', workers=2, ordered=ordered))) == 0
+			self.failUnlessRaises(OSError, invalidpath.walk(errors='strict', workers=2, ordered=ordered).next)
+		# END for each order
+		
+		# the walk can be aborted
+		walker = workdir.walk(workers=2)
+		walker.next()
+		walker.close()
+
+	def test_digest(self):
+		workdir = self.workdir
+		files = list()
+		for i in range(10):
+			f = workdir / ('file%i' % i)
+			f.write_bytes(str(i) * (i * 100000))
+			files.append(f)
+		# END for each file
+		expected = [ hashlib.sha1(f.bytes()).digest() for f in files ]
+		
+		# reading in chunks of any size or using mmap yields the same result
+		for kwargs in (dict(), dict(buffersize=7), dict(use_mmap=True)):
+			assert [ f.digest(hashlib.sha1(), **kwargs) for f in files ] == expected
+		# END for each keyword set
+		
+		# bulk digests keep the order of the input
+		for workers in (0, 3):
+			items = list(Path.digest_many(map(str, files), hashlib.sha1, workers=workers))
+			assert [ p for p, d in items ] == files and [ d for p, d in items ] == expected
+		# END for each amount of workers
+		self.failUnlessRaises(IOError, list, Path.digest_many([workdir / 'doesntexist'], hashlib.md5, workers=2))
+		
+		# cached digests are retrieved without reading the file
+		cachefile = workdir / 'digests.cache'
+		cache = DigestCache(cachefile)
+		assert len(cache) == 0
+		assert [ d for p, d in Path.digest_many(files, hashlib.sha1, cache=cache) ] == expected
+		assert len(cache) == len(files)
+		cache.save()
+		
+		cache = DigestCache(cachefile)
+		assert len(cache) == len(files)
+		afile = files[1]
+		afile.chmod(0)
+		try:
+			if not os.access(afile, os.R_OK):
+				self.failUnlessRaises(IOError, afile.digest, hashlib.sha1())
+			assert afile.digest(hashlib.sha1(), cache) == expected[1]
+		finally:
+			afile.chmod(0644)
+		# END assure file is readable
+		
+		# changed files, other hash algorithms and used hash objects are not retrieved from the cache
+		afile.write_bytes('2' * 10)
+		assert afile.digest(hashlib.sha1(), cache) == hashlib.sha1(afile.bytes()).digest()
+		assert afile.digest(hashlib.md5(), cache) == hashlib.md5(afile.bytes()).digest()
+		hashobject = hashlib.sha1('prefix')
+		assert files[2].digest(hashobject, cache) == hashlib.sha1('prefix' + files[2].bytes()).digest()
+		assert len(cache) == len(files) + 1
+		
+		# invalid cache files are ignored
+		cachefile.write_bytes('garbage')
+		assert len(DigestCache(cachefile)) == 0
+		self.failUnlessRaises(ValueError, DigestCache().save)
+
 	def test_separator(self):
 		# assert Path.sep == os.path.sep
 		
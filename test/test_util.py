@@ -293,6 +293,31 @@ class TestDAGTree( unittest.TestCase ):
 		sender.clearAllEvents()
 		assert not sender.estrong._getFunctionSet(sender)
 		
+	def test_replace_file(self):
+		import os
+		import tempfile
+		tmpdir = tempfile.mkdtemp()
+		filepath = os.path.join(tmpdir, "file")
+		try:
+			replaceFileAtomically(filepath, lambda fp: fp.write("first"))
+			assert open(filepath, 'rb').read() == "first"
+			
+			# failing writers keep the previous file and leave no temporary file behind
+			def writer(fp):
+				fp.write("partial")
+				raise ValueError("failed")
+			# END failing writer
+			self.failUnlessRaises(ValueError, replaceFileAtomically, filepath, writer)
+			assert open(filepath, 'rb').read() == "first"
+			assert os.listdir(tmpdir) == ["file"]
+			
+			replaceFileAtomically(filepath, lambda fp: fp.write("second"))
+			assert open(filepath, 'rb').read() == "second"
+		finally:
+			import shutil
+			shutil.rmtree(tmpdir)
+		# END cleanup
+		
 	def test_info(self):
 		assert len(info.version) == 5
 		major, minor, micro, level, serial = info.version
@@ -5,6 +5,8 @@ from collections import deque as Deque
 import weakref
 import inspect
 import itertools
+import os
+import sys
 from interface import iDuplicatable
 
 import logging
@@ -15,7 +17,8 @@ __all__ = ("decodeString", "decodeStringOrList", "capitalize", "uncapitalize",
 	"pythonIndex", "copyClsMembers", "packageClasses", "iterNetworkxGraph", 
            "Call", "CallAdv", "WeakInstFunction", "Event", "EventSender", 
            "InterfaceMaster", "Singleton", "CallOnDeletion", 
-           "DAGTree", "PipeSeparatedFile", "MetaCopyClsMembers", "And", "Or") 
+           "DAGTree", "PipeSeparatedFile", "MetaCopyClsMembers", "And", "Or", 
+           "replaceFileAtomically") 
            
 
 def decodeString( valuestr ):
@@ -140,6 +143,38 @@ def packageClasses( importBase, packageFile, predicate = lambda x: True ):
 	# import the modules
 	return outclasses
 
+def replaceFileAtomically( filepath, writer, mode = 'wb' ):
+	"""Write the file at filepath by calling writer with a temporary file opened for writing, 
+	and replace the existing file with it in one step once writer succeeded. Readers will 
+	never see a partially written file, and may keep the previous version open or mapped.
+	
+	:param writer: callable( fp ) writing the contents of the file
+	:param mode: mode to open the temporary file with
+	:raise Exception: any error raised by writer or the file system. The existing file stays 
+		untouched and the temporary file will be removed in that case"""
+	tmpfile = "%s.%i.tmp" % ( filepath, os.getpid() )
+	try:
+		fp = open( tmpfile, mode )
+		try:
+			writer( fp )
+		finally:
+			fp.close()
+		# END assure file gets closed
+		
+		if os.name == 'nt' and os.path.exists( filepath ):
+			os.remove( filepath )
+		os.rename( tmpfile, filepath )
+	except:
+		exc_info = sys.exc_info()
+		try:
+			if os.path.exists( tmpfile ):
+				os.remove( tmpfile )
+		except OSError:
+			pass
+		# END ignore cleanup errors
+		raise exc_info[0], exc_info[1], exc_info[2]
+	# END assure temporary file is removed
+
 def iterNetworkxGraph( graph, startItem, direction = 0, prune = lambda i,g: False,
 					   stop = lambda i,g: False, depth = -1, branch_first=True,
 					   visit_once = True, ignore_startitem=1 ):